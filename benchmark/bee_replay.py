@@ -0,0 +1,175 @@
+"""
+Replays recorded `.bee` buffer streams through parse_from_buffer, without a gRPC peer, so the receive
+ path can be profiled without network effects.
+
+The streams can be captured from real traffic with client.record_to_file, or written with
+ client.write_to_file. Every buffer of the file is given to the parser as it was recorded, with its
+ block markers, signals and credits. Each replay reports the time of its stages: block_exists checks,
+ chunk writes to disk, generate_wbp_file, and the parser (feed_message and its sinks, the rest of
+ the time).
+
+Usage:
+    python bee_replay.py stream.bee --mode dir --repeat 5
+    python bee_replay.py stream.bee --indices 1=grpcbigbuffer.test_pb2:Test --profile cprofile
+"""
+import argparse
+import cProfile
+import importlib
+import io
+import json
+import os
+import pstats
+import resource
+import shutil
+import sys
+import time
+from typing import Callable, Dict, Optional, Union
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import client
+from grpcbigbuffer.instrumentation import MemoryInstrumentation
+from grpcbigbuffer.reader import read_bee_file
+from grpcbigbuffer.utils import Dir, modify_env
+
+BENCHMARK_DIR = os.path.abspath('__cache__/benchmark_bee_replay') + '/'
+MODES: Dict[str, Optional[bool]] = {'memory': True, 'dir': False, 'auto': None}
+
+
+class StageTimer(object):
+    # Accumulates the time spent on the functions of the client module that it wraps.
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.originals: Dict[str, Callable] = {}
+
+    def wrap(self, name: str):
+        original: Callable = getattr(client, name)
+
+        def timed(*args, **kwargs):
+            start: float = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - start
+                self.calls[name] = self.calls.get(name, 0) + 1
+
+        self.originals[name] = original
+        setattr(client, name, timed)
+
+    def restore(self):
+        for name, original in self.originals.items():
+            setattr(client, name, original)
+        self.originals = {}
+
+
+def load_class(path: str) -> Union[type, object]:
+    # 'bytes' or 'package.module:Class'.
+    if path == 'bytes':
+        return bytes
+    module, cls = path.split(':')
+    return getattr(importlib.import_module(module), cls)
+
+
+def get_indices(filename: str, indices: Optional[str]) -> Dict:
+    if indices:
+        return {int(i): load_class(cls) for i, cls in (e.split('=') for e in indices.split(','))}
+    # Without them, every message is parsed as bytes.
+    return {buffer.head.index: bytes for buffer in read_bee_file(filename) if buffer.HasField('head')} or {1: bytes}
+
+
+def remove_output(output):
+    if type(output) is Dir:
+        shutil.rmtree(output.dir) if os.path.isdir(output.dir) else os.remove(output.dir)
+
+
+def replay(filename: str, indices: Dict, mode: Optional[bool], stream: bool, keep_blocks: bool,
+           profiler: Optional[cProfile.Profile]) -> Dict:
+    if not keep_blocks:
+        shutil.rmtree(BENCHMARK_DIR + 'blocks/', ignore_errors=True)
+    os.makedirs(BENCHMARK_DIR + 'blocks/', exist_ok=True)
+    buffers = read_bee_file(filename) if stream else list(read_bee_file(filename))
+    instrumentation = MemoryInstrumentation()
+    timer = StageTimer()
+    for name in ('block_exists', 'generate_wbp_file'):
+        timer.wrap(name)
+    messages: int = 0
+    try:
+        if profiler:
+            profiler.enable()
+        start: float = time.perf_counter()
+        for output in client.parse_from_buffer(
+                request_iterator=iter(buffers),
+                indices=dict(indices),
+                partitions_message_mode=mode,
+                instrumentation=instrumentation
+        ):
+            messages += 1
+            remove_output(output)
+        seconds: float = time.perf_counter() - start
+    finally:
+        if profiler:
+            profiler.disable()
+        timer.restore()
+
+    snapshot: Dict = instrumentation.snapshot()
+    disk_write: float = sum(snapshot['histograms'].get('disk_write_seconds', []))
+    received: int = int(snapshot['counters'].get('received_bytes', 0))
+    stages: Dict[str, float] = {
+        'block_exists': timer.seconds.get('block_exists', 0),
+        'disk_write': disk_write,
+        'generate_wbp_file': timer.seconds.get('generate_wbp_file', 0),
+    }
+    stages['parser'] = max(seconds - sum(stages.values()), 0)
+    return {
+        'messages': messages,
+        'received_bytes': received,
+        'blocks_skipped': int(snapshot['counters'].get('blocks_skipped', 0)),
+        'seconds': round(seconds, 4),
+        'MB/s': round(received / (1024 * 1024) / seconds, 2) if seconds else None,
+        'stages_seconds': {stage: round(s, 4) for stage, s in stages.items()},
+        'block_exists_calls': timer.calls.get('block_exists', 0),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='Recorded .bee streams.')
+    parser.add_argument('--indices', help="Classes of the indices, like 1=grpcbigbuffer.test_pb2:Test,2=bytes. "
+                                          "By default every message is parsed as bytes.")
+    parser.add_argument('--mode', choices=list(MODES), default='dir')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stream', action='store_true', help='Reads the file while replaying, '
+                                                              'instead of loading its buffers before.')
+    parser.add_argument('--keep-blocks', action='store_true', help='Keeps the blocks saved by a replay, '
+                                                                   'so the next ones skip them.')
+    parser.add_argument('--profile', choices=['cprofile'], help='Attaches cProfile to the replays.')
+    parser.add_argument('--profile-output', help='File for the cProfile stats, for snakeviz or pstats.')
+    parser.add_argument('--top', type=int, default=25, help='Functions of the cProfile stats to print.')
+    args = parser.parse_args()
+
+    shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
+    os.makedirs(BENCHMARK_DIR + 'cache/')
+    modify_env(cache_dir=BENCHMARK_DIR + 'cache/', block_dir=BENCHMARK_DIR + 'blocks/')
+    profiler: Optional[cProfile.Profile] = cProfile.Profile() if args.profile else None
+    try:
+        for file in args.files:
+            indices: Dict = get_indices(filename=file, indices=args.indices)
+            for i in range(args.repeat):
+                print(json.dumps({
+                    'file': file,
+                    'mode': args.mode,
+                    'repeat': i,
+                    **replay(filename=file, indices=indices, mode=MODES[args.mode], stream=args.stream,
+                             keep_blocks=args.keep_blocks, profiler=profiler),
+                    'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                }), flush=True)
+    finally:
+        shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
+
+    if profiler:
+        if args.profile_output:
+            profiler.dump_stats(args.profile_output)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(args.top)
+        print(output.getvalue(), file=sys.stderr)
@@ -0,0 +1,101 @@
+"""
+Phase breakdown of block_builder.build_multiblock and create_block on a synthetic test_pb2.Filesystem.
+
+The filesystem is a tree of the given depth, with width directories on each level and width files on
+ each directory. The files of the last level are blocks of block-size KB (created with create_block),
+ the rest are inline files of inline-size bytes. It reports the seconds of each phase, their share of
+ the total, and the counters of the build.
+
+Usage:
+    python build_multiblock.py --depth 3 --width 8 --block-size-kb 1024 --inline-size 4096
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+from typing import Dict, List
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.block_builder import BuildStats, build_multiblock, create_block
+from grpcbigbuffer.utils import modify_env
+
+BENCHMARK_DIR = os.path.abspath('__cache__/benchmark_build_multiblock') + '/'
+
+
+def generate_filesystem(depth: int, width: int, block_size: int, inline_size: int,
+                        blocks: List[bytes], stats: BuildStats, path: str = '') -> test_pb2.Filesystem:
+    filesystem = test_pb2.Filesystem()
+    for i in range(width):
+        name: str = path + '/file' + str(i)
+        if depth <= 1:
+            with open(BENCHMARK_DIR + 'files/block', 'wb') as f:
+                f.write(name.encode() + os.urandom(block_size))
+            block_hash, block = create_block(file_path=BENCHMARK_DIR + 'files/block', stats=stats)
+            blocks.append(block_hash)
+            filesystem.branch.add(name='file' + str(i), file=block.SerializeToString())
+        else:
+            filesystem.branch.add(name='file' + str(i), file=os.urandom(inline_size))
+            filesystem.branch.add(name='dir' + str(i)).filesystem.CopyFrom(generate_filesystem(
+                depth=depth - 1, width=width, block_size=block_size, inline_size=inline_size,
+                blocks=blocks, stats=stats, path=path + '/dir' + str(i)
+            ))
+    return filesystem
+
+
+def run(depth: int, width: int, block_size: int, inline_size: int) -> Dict:
+    for d in ('files/', 'blocks/', 'cache/'):
+        shutil.rmtree(BENCHMARK_DIR + d, ignore_errors=True)
+        os.makedirs(BENCHMARK_DIR + d)
+    modify_env(cache_dir=BENCHMARK_DIR + 'cache/', block_dir=BENCHMARK_DIR + 'blocks/')
+
+    create_stats = BuildStats()
+    blocks: List[bytes] = []
+    filesystem: test_pb2.Filesystem = generate_filesystem(
+        depth=depth, width=width, block_size=block_size, inline_size=inline_size,
+        blocks=blocks, stats=create_stats
+    )
+
+    build_stats = BuildStats()
+    start: float = time.perf_counter()
+    build_multiblock(pf_object_with_block_pointers=filesystem, blocks=blocks, stats=build_stats)
+    seconds: float = time.perf_counter() - start
+
+    return {
+        'depth': depth,
+        'width': width,
+        'block_size_kb': block_size // 1024,
+        'inline_size': inline_size,
+        'blocks': len(blocks),
+        'message_bytes': filesystem.ByteSize(),
+        'seconds': round(seconds, 4),
+        'phases': {
+            name: {'seconds': round(s, 4), 'share': round(s / seconds, 3) if seconds else 0}
+            for name, s in sorted(build_stats.phases.items(), key=lambda p: -p[1])
+        },
+        'counters': build_stats.counters,
+        'create_block': {
+            'phases': {name: round(s, 4) for name, s in create_stats.phases.items()},
+            'counters': create_stats.counters,
+        },
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--depth', type=int, default=3, help='Levels of directories, the last one has the blocks.')
+    parser.add_argument('--width', type=int, default=8, help='Directories and files on each directory.')
+    parser.add_argument('--block-size-kb', type=int, default=64)
+    parser.add_argument('--inline-size', type=int, default=1024, help='Bytes of the files that are not blocks.')
+    args = parser.parse_args()
+
+    try:
+        print(json.dumps(run(depth=args.depth, width=args.width, block_size=args.block_size_kb * 1024,
+                             inline_size=args.inline_size)), flush=True)
+    finally:
+        shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
@@ -0,0 +1,87 @@
+"""
+Time to the first useful work on a big message: parse_events, that gives the fields as their chunks
+ arrive, against parse_from_buffer on memory and on disk, that give the message once it's whole.
+
+The message is a test_pb2.Filesystem of files of file-size bytes that add up to size MB, serialized
+ with serialize_to_buffer on the same process. The first useful work is the first byte of the first
+ file. Each case runs on its own process, so its peak RSS is its own.
+
+Usage:
+    python events.py --size-mb 256 --file-size 1048576 --paths events,memory,dir
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.client import parse_from_buffer, serialize_to_buffer, remove_file, remove_dir
+from grpcbigbuffer.events import parse_events, CHUNK
+
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def generate_message(size: int, file_size: int) -> test_pb2.Filesystem:
+    message = test_pb2.Filesystem()
+    for i in range(size // file_size):
+        message.branch.add(name=str(i), file=bytes([i % 255 + 1]) * file_size)
+    return message
+
+
+def run_case(path: str, size: int, file_size: int):
+    message: test_pb2.Filesystem = generate_message(size=size, file_size=file_size)
+    base_rss: float = peak_rss_mb()
+    buffers = serialize_to_buffer(message_iterator=message, indices=test_pb2.Filesystem)
+    start: float = time.perf_counter()
+    first: float = 0
+    if path == 'events':
+        for event in parse_events(request_iterator=buffers, indices=test_pb2.Filesystem):
+            if not first and event.kind == CHUNK:
+                first = time.perf_counter() - start
+    else:
+        for result in parse_from_buffer(request_iterator=buffers, indices=test_pb2.Filesystem,
+                                        partitions_message_mode=path == 'memory'):
+            first = time.perf_counter() - start
+            if path == 'memory':
+                assert result.branch[0].file[:1]
+            elif os.path.isdir(result.dir):
+                remove_dir(result.dir)
+            else:
+                with open(result.dir, 'rb') as f:
+                    assert f.read(1)
+                remove_file(result.dir)
+    seconds: float = time.perf_counter() - start
+    print(json.dumps({
+        'path': path,
+        'message_mb': round(size / 1024 / 1024, 1),
+        'first_work_ms': round(first * 1000, 2),
+        'seconds': round(seconds, 3),
+        'MB/s': round(size / seconds / 1e6, 1),
+        'peak_rss_over_message_mb': round(peak_rss_mb() - base_rss, 1),
+    }), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help='Bytes of each file of the message.')
+    parser.add_argument('--paths', default='events,memory,dir')
+    parser.add_argument('--case', help='Runs only this path.')
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(path=args.case, size=args.size_mb * 1024 * 1024, file_size=args.file_size)
+    else:
+        for path in args.paths.split(','):
+            subprocess.run(
+                [sys.executable, __file__, '--case', path,
+                 '--size-mb', str(args.size_mb), '--file-size', str(args.file_size)],
+                check=True
+            )
@@ -0,0 +1,244 @@
+"""
+End to end throughput and latency of client_grpc against a BeeServer on a local gRPC server.
+
+Every case runs on its own process, with the server on another one (each one with its own block
+ registry, so the server only has the fraction of the blocks given by the dedup ratio). The case
+ sends calls messages with the given concurrency, on memory (test_pb2.Test) or as a Dir, optionally
+ as a multiblock test_pb2.Filesystem of some blocks, and the server parses them on memory or on disk.
+
+Usage:
+    python grpc_stream.py --sizes-kb 1,1024,65536 --modes memory,dir --blocks 0,4 --dedup 0,0.5 \\
+        --concurrency 1,4 --output results.json --baseline baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent import futures
+from hashlib import sha3_256
+from typing import Dict, List, Optional
+
+import grpc
+
+sys.path.append('../src/')
+sys.path.append('../test/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.block_builder import build_multiblock
+from grpcbigbuffer.client import client_grpc
+from grpcbigbuffer.server import BeeServer
+from grpcbigbuffer.utils import Dir, Enviroment, CHUNK_SIZE, encode_bytes, modify_env
+from helpers import LocalServer, stream_stub
+
+BENCHMARK_DIR = os.path.abspath('__cache__/benchmark_grpc_stream') + '/'
+SERVICE = 'benchmark.Service'
+INDICES = {1: test_pb2.Test, 2: test_pb2.Filesystem}
+
+
+def serve(address: str, block_dir: str, mode: str, concurrency: int):
+    modify_env(cache_dir=BENCHMARK_DIR + 'server_cache/', block_dir=block_dir)
+    os.makedirs(BENCHMARK_DIR + 'server_cache/', exist_ok=True)
+    bee_server = BeeServer(max_concurrent_calls=concurrency)
+
+    @bee_server.method(indices_parser=INDICES, partitions_message_mode_parser=mode == 'memory')
+    def upload(messages, context):
+        for message in messages:
+            if type(message) is Dir:
+                shutil.rmtree(message.dir) if os.path.isdir(message.dir) else os.remove(message.dir)
+        return buffer_pb2.Empty()
+
+    LocalServer(methods={'Upload': upload}, service=SERVICE, address=address,
+                max_workers=2 * concurrency + 2).serve()
+    bee_server.shutdown()
+
+
+def write_test_message(filename: str, size: int):
+    # Test { t1: size bytes } written by hand, without having it on memory.
+    with open(filename, 'wb') as f:
+        f.write(b'\x0a' + encode_bytes(size))
+        chunk: bytes = os.urandom(min(size, CHUNK_SIZE))
+        for offset in range(0, size, CHUNK_SIZE):
+            f.write(chunk[:min(CHUNK_SIZE, size - offset)])
+
+
+def generate_blocks(size: int, blocks: int, dedup: float) -> Dir:
+    # A filesystem with a block on each branch. The server has the first dedup part of them.
+    filesystem = test_pb2.Filesystem()
+    hashes: List[bytes] = []
+    for i in range(blocks):
+        _hash: bytes = sha3_256(b'benchmark block ' + str(i).encode() + b' ' + str(size).encode()).digest()
+        write_test_message(BENCHMARK_DIR + 'client_blocks/' + _hash.hex(), size // blocks)
+        if i < round(blocks * dedup):
+            os.link(BENCHMARK_DIR + 'client_blocks/' + _hash.hex(), BENCHMARK_DIR + 'server_blocks/' + _hash.hex())
+        block = buffer_pb2.Buffer.Block()
+        block.hashes.append(buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=_hash))
+        filesystem.branch.add(name='block' + str(i), file=block.SerializeToString())
+        hashes.append(_hash)
+    _, cache_dir = build_multiblock(pf_object_with_block_pointers=filesystem, blocks=hashes)
+    return Dir(dir=cache_dir, _type=test_pb2.Filesystem)
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_case(case: Dict, calls: int, transport: str):
+    for d in ('client_blocks/', 'server_blocks/', 'client_cache/'):
+        shutil.rmtree(BENCHMARK_DIR + d, ignore_errors=True)
+        os.makedirs(BENCHMARK_DIR + d)
+    modify_env(cache_dir=BENCHMARK_DIR + 'client_cache/', block_dir=BENCHMARK_DIR + 'client_blocks/')
+    size: int = case['size_kb'] * 1024
+
+    if case['blocks']:
+        message = generate_blocks(size=size, blocks=case['blocks'], dedup=case['dedup'])
+    elif case['mode'] == 'dir':
+        write_test_message(BENCHMARK_DIR + 'client_cache/message', size)
+        message = Dir(dir=BENCHMARK_DIR + 'client_cache/message', _type=test_pb2.Test)
+    else:
+        message = test_pb2.Test(t1=os.urandom(size))
+
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve',
+         'unix:' + tempfile.gettempdir() + '/grpcbb_benchmark_' + str(os.getpid()) + '.sock'
+         if transport == 'unix' else 'localhost:0',
+         '--block-dir', BENCHMARK_DIR + 'server_blocks/', '--modes', case['mode'],
+         '--concurrency', str(case['concurrency'])],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        channel = grpc.insecure_channel(server.stdout.readline().strip(), options=[
+            ('grpc.max_send_message_length', 2 * CHUNK_SIZE),
+            ('grpc.max_receive_message_length', 2 * CHUNK_SIZE),
+        ])
+        method = stream_stub(channel=channel, service=SERVICE, name='Upload')
+
+        def call() -> float:
+            start: float = time.perf_counter()
+            list(client_grpc(method=method, input=message, indices_serializer=INDICES))
+            return time.perf_counter() - start
+
+        # The calls are sent in rounds of concurrency calls. The blocks that the server saves in a round
+        #  are removed before the next one, so every round has the same dedup ratio.
+        seeded = set(os.listdir(BENCHMARK_DIR + 'server_blocks/'))
+        latencies: List[float] = []
+        seconds: float = 0
+        cpu_start: float = sum(resource.getrusage(resource.RUSAGE_SELF)[:2])
+        with futures.ThreadPoolExecutor(max_workers=case['concurrency']) as executor:
+            for sent in range(0, calls, case['concurrency']):
+                start: float = time.perf_counter()
+                latencies.extend(executor.map(lambda i: call(), range(min(case['concurrency'], calls - sent))))
+                seconds += time.perf_counter() - start
+                for block in set(os.listdir(BENCHMARK_DIR + 'server_blocks/')) - seeded:
+                    os.remove(BENCHMARK_DIR + 'server_blocks/' + block)
+        cpu: float = sum(resource.getrusage(resource.RUSAGE_SELF)[:2]) - cpu_start
+        channel.close()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    total: int = size * calls
+    print(json.dumps({
+        **case,
+        'id': case_id(case),
+        'calls': calls,
+        'seconds': round(seconds, 3),
+        'MB/s': round(total / (1024 * 1024) / seconds, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'client_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'server_peak_rss_mb': round(children.ru_maxrss / 1024, 1),
+        'client_cpu_ns_per_byte': round(cpu / total * 1e9, 3),
+        'server_cpu_ns_per_byte': round((children.ru_utime + children.ru_stime) / total * 1e9, 3),
+    }), flush=True)
+
+
+def case_id(case: Dict) -> str:
+    return f"{case['size_kb']}KB-{case['mode']}-{case['blocks']}blocks-{case['dedup']}dedup-{case['concurrency']}c"
+
+
+def get_cases(args) -> List[Dict]:
+    cases: List[Dict] = []
+    for size_kb, mode, blocks, dedup, concurrency in itertools.product(
+            [int(s) for s in args.sizes_kb.split(',')],
+            args.modes.split(','),
+            [int(b) for b in args.blocks.split(',')],
+            [float(d) for d in args.dedup.split(',')],
+            [int(c) for c in args.concurrency.split(',')]
+    ):
+        if mode == 'memory' and size_kb > args.max_memory_mb * 1024:
+            continue  # Too big to be parsed on memory.
+        if not blocks and dedup:
+            continue  # The dedup ratio only applies to blocks.
+        cases.append({'size_kb': size_kb, 'mode': mode, 'blocks': blocks, 'dedup': dedup,
+                      'concurrency': concurrency})
+    return cases
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    # Cases slower, or with a higher p99 latency, than the baseline beyond the tolerance.
+    regressions: List[str] = []
+    previous: Dict[str, Dict] = {r['id']: r for r in baseline}
+    for result in results:
+        base: Optional[Dict] = previous.get(result['id'])
+        if not base:
+            continue
+        if result['MB/s'] < base['MB/s'] * (1 - tolerance):
+            regressions.append(f"{result['id']}: {result['MB/s']} MB/s, baseline {base['MB/s']} MB/s")
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{result['id']}: p99 {result['p99_ms']} ms, baseline {base['p99_ms']} ms")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes-kb', default='1,1024,65536')
+    parser.add_argument('--modes', default='memory,dir')
+    parser.add_argument('--blocks', default='0,4')
+    parser.add_argument('--dedup', default='0,0.5')
+    parser.add_argument('--concurrency', default='1,4')
+    parser.add_argument('--calls', type=int, default=8)
+    parser.add_argument('--transport', choices=['unix', 'tcp'], default='unix')
+    parser.add_argument('--max-memory-mb', type=int, default=1024)
+    parser.add_argument('--output', help='JSON file for the results.')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--case', help='Runs only this case, given as JSON.')
+    parser.add_argument('--serve', help='Runs only the server, on this address.')
+    parser.add_argument('--block-dir')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(address=args.serve, block_dir=args.block_dir, mode=args.modes, concurrency=int(args.concurrency))
+    elif args.case:
+        run_case(case=json.loads(args.case), calls=args.calls, transport=args.transport)
+    else:
+        results: List[Dict] = []
+        for c in get_cases(args):
+            output: str = subprocess.run(
+                [sys.executable, __file__, '--case', json.dumps(c), '--calls', str(args.calls),
+                 '--transport', args.transport],
+                check=True, stdout=subprocess.PIPE, text=True
+            ).stdout
+            print(output, end='', flush=True)
+            results.append(json.loads(output.splitlines()[-1]))
+        os.system('rm -rf ' + BENCHMARK_DIR)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions: List[str] = compare(results=results, baseline=json.load(f), tolerance=args.tolerance)
+            for regression in regressions:
+                print('Regression ' + regression, file=sys.stderr)
+            if regressions:
+                sys.exit(1)
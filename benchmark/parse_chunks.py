@@ -0,0 +1,99 @@
+"""
+Chunks per second of parse_from_buffer on synthetic buffer streams, to measure the cost of each chunk
+ on the receive path without the cost of the chunk bytes.
+
+Each stream is a message of a field with many small chunks, inside blocks nested depth levels (with
+ block_depth set to the depth), parsed on memory or on disk. The cost of each chunk shouldn't depend
+ on the depth.
+
+Usage:
+    python parse_chunks.py --chunks 200000 --chunk-size 64 --depths 0,1,4,16 --modes memory,dir
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from hashlib import sha3_256
+from typing import Dict, List
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import parse_from_buffer
+from grpcbigbuffer.utils import Dir, Enviroment, encode_bytes, modify_env
+
+BENCHMARK_DIR = os.path.abspath('__cache__/benchmark_parse_chunks') + '/'
+
+
+def block_buffer(level: int) -> buffer_pb2.Buffer:
+    # The outer block is the content of the first field, its length is at position 1.
+    block = buffer_pb2.Buffer.Block(previous_lengths_position=[1] if level == 0 else [])
+    block.hashes.append(buffer_pb2.Buffer.Block.Hash(
+        type=Enviroment.hash_type, value=sha3_256(b'benchmark block ' + str(level).encode()).digest()
+    ))
+    return buffer_pb2.Buffer(block=block)
+
+
+def generate_stream(chunks: int, chunk_size: int, depth: int) -> List[buffer_pb2.Buffer]:
+    markers: List[buffer_pb2.Buffer] = [block_buffer(level) for level in range(depth)]
+    chunk: bytes = os.urandom(chunk_size)
+    field: bytes = b'\x0a' + encode_bytes(chunks * chunk_size)
+    return [buffer_pb2.Buffer(head=buffer_pb2.Buffer.Head(index=1), chunk=field)] + markers + \
+        [buffer_pb2.Buffer(chunk=chunk) for _ in range(chunks)] + \
+        markers[::-1] + [buffer_pb2.Buffer(separator=True)]
+
+
+def run_case(case: Dict, chunks: int, chunk_size: int, repeat: int):
+    modify_env(cache_dir=BENCHMARK_DIR + 'cache/', block_dir=BENCHMARK_DIR + 'blocks/',
+               block_depth=max(case['depth'], 1))
+    stream: List[buffer_pb2.Buffer] = generate_stream(chunks=chunks, chunk_size=chunk_size, depth=case['depth'])
+    seconds: List[float] = []
+    for _ in range(repeat):
+        for d in ('cache/', 'blocks/'):
+            shutil.rmtree(BENCHMARK_DIR + d, ignore_errors=True)
+            os.makedirs(BENCHMARK_DIR + d)
+        start: float = time.perf_counter()
+        for output in parse_from_buffer(request_iterator=iter(stream), indices={1: bytes},
+                                        partitions_message_mode=case['mode'] == 'memory'):
+            if type(output) is Dir:
+                shutil.rmtree(output.dir) if os.path.isdir(output.dir) else os.remove(output.dir)
+        seconds.append(time.perf_counter() - start)
+
+    best: float = min(seconds)
+    print(json.dumps({
+        **case,
+        'chunks': chunks,
+        'chunk_size': chunk_size,
+        'seconds': round(best, 4),
+        'chunks/s': round(chunks / best),
+        'us_per_chunk': round(best / chunks * 1e6, 3),
+    }), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=64)
+    parser.add_argument('--depths', default='0,1,4,16')
+    parser.add_argument('--modes', default='memory,dir')
+    parser.add_argument('--repeat', type=int, default=3, help='Replays of each case, the best one is reported.')
+    parser.add_argument('--case', help='Runs only this case, given as JSON.')
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(case=json.loads(args.case), chunks=args.chunks, chunk_size=args.chunk_size, repeat=args.repeat)
+    else:
+        try:
+            for depth, mode in itertools.product([int(d) for d in args.depths.split(',')], args.modes.split(',')):
+                subprocess.run(
+                    [sys.executable, __file__, '--case', json.dumps({'depth': depth, 'mode': mode}),
+                     '--chunks', str(args.chunks), '--chunk-size', str(args.chunk_size),
+                     '--repeat', str(args.repeat)],
+                    check=True
+                )
+        finally:
+            shutil.rmtree(BENCHMARK_DIR, ignore_errors=True)
@@ -0,0 +1,105 @@
+"""
+Compares the partition merger of disk_stream against the in memory reassembly of combine_partitions.
+
+The partitions are the two fields of a compile_pb2.ServiceWithMeta, the service one carrying a big
+ container architecture field. Every method runs on its own process, so the peak RSS is its own.
+
+Usage:
+    python partition_disk_stream.py --size-mb 4096
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, compile_pb2
+from grpcbigbuffer.client import combine_partitions, combine_partitions_to_dir
+from grpcbigbuffer.disk_stream import partition_disk_stream, write_partition_disk_stream, \
+    calculate_hash_of_complete
+from grpcbigbuffer.utils import encode_bytes, CHUNK_SIZE
+
+BENCHMARK_DIR = '__cache__/benchmark_partition_disk_stream/'
+METHODS = ['partition_disk_stream', 'write_partition_disk_stream', 'calculate_hash_of_complete',
+           'combine_partitions_to_dir', 'combine_partitions']
+
+
+def generate_partitions(size_mb: int):
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    metadata = compile_pb2.celaut__pb2.Any.Metadata()
+    metadata.hashtag.tag.extend(['benchmark'])
+    with open(BENCHMARK_DIR + '1', 'wb') as f:
+        f.write(metadata.SerializeToString())
+
+    # Service { container { architecture: size_mb } } written by hand, without having it on memory.
+    architecture: int = size_mb * 1024 * 1024
+    container: int = 1 + len(encode_bytes(architecture)) + architecture
+    with open(BENCHMARK_DIR + '2', 'wb') as f:
+        f.write(b'\x0a' + encode_bytes(container) + b'\x0a' + encode_bytes(architecture))
+        chunk: bytes = os.urandom(CHUNK_SIZE)
+        for _ in range(size_mb):
+            f.write(chunk)
+
+
+def get_partitions():
+    model = []
+    for index in (1, 2):
+        partition = buffer_pb2.Buffer.Head.Partition()
+        partition.index[index].CopyFrom(buffer_pb2.Buffer.Head.Partition())
+        model.append(partition)
+    return [BENCHMARK_DIR + '1', BENCHMARK_DIR + '2'], model
+
+
+def run_method(method: str):
+    dirs, partitions = get_partitions()
+    start: float = time.perf_counter()
+    if method == 'partition_disk_stream':
+        total: int = sum(len(c) for c in partition_disk_stream(dirs=dirs, partitions=partitions))
+    elif method == 'write_partition_disk_stream':
+        total: int = write_partition_disk_stream(dirs=dirs, partitions=partitions, filename=BENCHMARK_DIR + 'merged')
+    elif method == 'calculate_hash_of_complete':
+        calculate_hash_of_complete(dirs=dirs, partitions=partitions)
+        total: int = sum(os.path.getsize(d) for d in dirs)
+    elif method == 'combine_partitions_to_dir':
+        combine_partitions_to_dir(
+            obj_cls=compile_pb2.ServiceWithMeta,
+            partitions_model=tuple(partitions),
+            partitions=tuple(dirs),
+            filename=BENCHMARK_DIR + 'merged'
+        )
+        total: int = os.path.getsize(BENCHMARK_DIR + 'merged')
+    else:
+        message = combine_partitions(
+            obj_cls=compile_pb2.ServiceWithMeta,
+            partitions_model=tuple(partitions),
+            partitions=tuple(dirs)
+        )
+        with open(BENCHMARK_DIR + 'merged', 'wb') as f:
+            f.write(message.SerializeToString())
+        total: int = os.path.getsize(BENCHMARK_DIR + 'merged')
+    seconds: float = time.perf_counter() - start
+    print(json.dumps({
+        'method': method,
+        'seconds': round(seconds, 3),
+        'MB/s': round(total / (1024 * 1024) / seconds, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--method', choices=METHODS)
+    args = parser.parse_args()
+
+    if args.method:
+        run_method(args.method)
+    else:
+        generate_partitions(args.size_mb)
+        for m in METHODS:
+            subprocess.run([sys.executable, __file__, '--method', m], check=True)
+        os.system('rm -rf ' + BENCHMARK_DIR)
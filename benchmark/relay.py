@@ -0,0 +1,116 @@
+"""
+Time and relay memory of a stream through a relay node: cut-through with relay_grpc, against a store
+ and forward relay that parses each message from the stream and serializes it again to the next hop.
+
+The client sends count messages of size MB to the relay, which sends them to a sink that parses them
+ on disk and answers with their count. The relay and the sink run on another process for each case,
+ over Unix sockets. The sink writes the messages to disk, so the peak RSS of that process is of the relay.
+
+Usage:
+    python relay.py --size-mb 64 --count 4 --modes relay,store_and_forward
+"""
+import argparse
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Iterator
+
+import grpc
+
+sys.path.append('../src/')
+sys.path.append('../test/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.client import client_grpc, parse_from_buffer, serialize_to_buffer
+from grpcbigbuffer.relay import relay_grpc
+from grpcbigbuffer.utils import Dir, Signal, FLOW_CONTROL_WINDOW
+from helpers import LocalServer, stream_stub
+
+SERVICE = 'benchmark.Relay'
+
+
+def generate_messages(count: int, size: int) -> Iterator[test_pb2.Test]:
+    for i in range(count):
+        yield test_pb2.Test(t1=bytes([i % 255 + 1]) * size)
+
+
+def serve(address: str, mode: str):
+    def sink(request_iterator, context):
+        call_signal = Signal(window=FLOW_CONTROL_WINDOW)
+        messages: int = 0
+        for message in parse_from_buffer(request_iterator=request_iterator, signal=call_signal,
+                                         indices=test_pb2.Test, partitions_message_mode=False):
+            if isinstance(message, Dir):
+                os.remove(message.dir)
+            messages += 1
+        yield from serialize_to_buffer(message_iterator=iter([str(messages).encode()]), signal=call_signal)
+
+    def forward(request_iterator, context):
+        if mode == 'relay':
+            yield from relay_grpc(method=sink_method, request_iterator=request_iterator)
+            return
+        # Store and forward: each message is received whole before it's sent.
+        call_signal = Signal(window=FLOW_CONTROL_WINDOW)
+        messages = parse_from_buffer(request_iterator=request_iterator, signal=call_signal,
+                                     indices=test_pb2.Test, partitions_message_mode=True)
+        responses = client_grpc(method=sink_method, input=messages, indices_serializer=test_pb2.Test,
+                                indices_parser={0: bytes}, partitions_message_mode_parser=True)
+        yield from serialize_to_buffer(message_iterator=responses, signal=call_signal)
+
+    server = LocalServer(methods={'Sink': sink, 'Forward': forward}, service=SERVICE, address=address)
+    sink_method = server.stub(name='Sink')
+    server.serve()
+    print(round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--count', type=int, default=4, help='Messages of the stream.')
+    parser.add_argument('--modes', default='relay,store_and_forward')
+    parser.add_argument('--serve', help='Runs only the relay and the sink, on this address.')
+    parser.add_argument('--mode', default='relay')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(address=args.serve, mode=args.mode)
+        sys.exit(0)
+
+    for mode in args.modes.split(','):
+        server = subprocess.Popen(
+            [sys.executable, __file__, '--mode', mode, '--serve',
+             'unix:' + tempfile.gettempdir() + '/grpcbb_relay_' + str(os.getpid()) + '.sock'],
+            stdout=subprocess.PIPE, text=True
+        )
+        try:
+            with grpc.insecure_channel(server.stdout.readline().strip()) as channel:
+                size: int = args.size_mb * 1024 * 1024
+                start: float = time.perf_counter()
+                received = list(client_grpc(
+                    method=stream_stub(channel=channel, service=SERVICE, name='Forward'),
+                    input=generate_messages(count=args.count, size=size),
+                    indices_serializer=test_pb2.Test,
+                    indices_parser={0: bytes},
+                    partitions_message_mode_parser=True
+                ))
+                seconds: float = time.perf_counter() - start
+            if int(received[0]) != args.count:
+                raise Exception('gRPCbb benchmark error: ' + received[0].decode() + ' messages received of '
+                                + str(args.count))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            relay_rss_mb: float = float(server.stdout.readline())
+            server.wait()
+        print(json.dumps({
+            'mode': mode,
+            'message_mb': args.size_mb,
+            'count': args.count,
+            'seconds': round(seconds, 3),
+            'MB/s': round(args.count * size / seconds / 1e6, 1),
+            'relay_peak_rss_mb': relay_rss_mb,
+        }), flush=True)
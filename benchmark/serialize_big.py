@@ -0,0 +1,82 @@
+"""
+Time to first chunk, total time and peak memory of serialize_to_buffer on a big message on memory,
+ against a SerializeToString of the whole message.
+
+The message is a test_pb2.Test with a bytes field of size MB (bytes), or with as many submessages of
+ element-size bytes (repeated). Each case runs on its own process, so its peak RSS is its own.
+
+Usage:
+    python serialize_big.py --size-mb 512 --shapes bytes,repeated --element-size 4096
+"""
+import argparse
+import itertools
+import json
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.client import serialize_to_buffer
+
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def generate_message(shape: str, size: int, element_size: int) -> test_pb2.Test:
+    if shape == 'bytes':
+        return test_pb2.Test(t1=b'\x00' * size)
+    message = test_pb2.Test()
+    element: bytes = b'\x00' * element_size
+    for _ in range(size // element_size):
+        message.t4.add(t1=element)
+    return message
+
+
+def run_case(case: Dict, size: int, element_size: int):
+    message: test_pb2.Test = generate_message(shape=case['shape'], size=size, element_size=element_size)
+    base_rss: float = peak_rss_mb()
+    start: float = time.perf_counter()
+    first: float = 0
+    sent: int = 0
+    if case['path'] == 'serialize_to_string':
+        sent = len(message.SerializeToString())
+        first = time.perf_counter() - start
+    else:
+        for buffer in serialize_to_buffer(message_iterator=message, indices=test_pb2.Test):
+            if not first and buffer.chunk:
+                first = time.perf_counter() - start
+            sent += len(buffer.chunk)
+    seconds: float = time.perf_counter() - start
+    print(json.dumps({
+        **case,
+        'message_mb': round(sent / 1024 / 1024, 1),
+        'first_chunk_ms': round(first * 1000, 2),
+        'seconds': round(seconds, 3),
+        'MB/s': round(sent / seconds / 1e6, 1),
+        'peak_rss_over_message_mb': round(peak_rss_mb() - base_rss, 1),
+    }), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--shapes', default='bytes,repeated')
+    parser.add_argument('--element-size', type=int, default=4096, help='Bytes of each submessage of repeated.')
+    parser.add_argument('--paths', default='serialize_to_string,serialize_to_buffer')
+    parser.add_argument('--case', help='Runs only this case, given as JSON.')
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(case=json.loads(args.case), size=args.size_mb * 1024 * 1024, element_size=args.element_size)
+    else:
+        for shape, path in itertools.product(args.shapes.split(','), args.paths.split(',')):
+            subprocess.run(
+                [sys.executable, __file__, '--case', json.dumps({'shape': shape, 'path': path}),
+                 '--size-mb', str(args.size_mb), '--element-size', str(args.element_size)],
+                check=True
+            )
@@ -0,0 +1,116 @@
+"""
+Messages per second of a stream of many small messages, sent one Buffer each or packed in batches.
+
+Each case serializes count messages of the given size with serialize_to_buffer and parses them with
+ parse_from_buffer, on the same process (pipe) or through a stream call to a server on another process
+ over a Unix socket (grpc), that parses them and answers with their count. Messages parsed on memory.
+
+Usage:
+    python small_messages.py --sizes 16,256,4096 --count 200000 --transports pipe,grpc
+"""
+import argparse
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator
+
+import grpc
+
+sys.path.append('../src/')
+sys.path.append('../test/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.client import parse_from_buffer, serialize_to_buffer
+from grpcbigbuffer.utils import Signal, FLOW_CONTROL_WINDOW
+from helpers import LocalServer, small_message, stream_stub
+
+SERVICE = 'benchmark.SmallMessages'
+
+
+def generate_messages(count: int, size: int) -> Iterator[test_pb2.Test]:
+    message: test_pb2.Test = small_message(os.urandom(size - 1))
+    return (message for _ in range(count))
+
+
+def serve(address: str):
+    def count(request_iterator, context):
+        call_signal = Signal(window=FLOW_CONTROL_WINDOW)
+        messages: int = sum(1 for _ in parse_from_buffer(request_iterator=request_iterator, signal=call_signal,
+                                                         indices=test_pb2.Test, partitions_message_mode=True))
+        yield from serialize_to_buffer(message_iterator=iter([str(messages).encode()]), signal=call_signal)
+
+    LocalServer(methods={'Count': count}, service=SERVICE, address=address, max_workers=2).serve()
+
+
+def run_pipe(count: int, size: int, batch: bool) -> int:
+    return sum(1 for _ in parse_from_buffer(
+        request_iterator=serialize_to_buffer(message_iterator=generate_messages(count=count, size=size),
+                                             indices=test_pb2.Test, batch=batch),
+        indices=test_pb2.Test,
+        partitions_message_mode=True
+    ))
+
+
+def run_grpc(method, count: int, size: int, batch: bool) -> int:
+    call_signal = Signal(window=FLOW_CONTROL_WINDOW)
+    outputs = list(parse_from_buffer(
+        request_iterator=method(serialize_to_buffer(message_iterator=generate_messages(count=count, size=size),
+                                                    signal=call_signal, indices=test_pb2.Test, batch=batch)),
+        signal=call_signal,
+        indices={0: bytes},
+        partitions_message_mode=True
+    ))
+    return int(outputs[0])
+
+
+def report(case: Dict, count: int, size: int, received: int, seconds: float):
+    if received != count:
+        raise Exception('gRPCbb benchmark error: ' + str(received) + ' messages received of ' + str(count))
+    print(json.dumps({
+        **case,
+        'size': size,
+        'count': count,
+        'seconds': round(seconds, 3),
+        'messages/s': round(count / seconds),
+        'MB/s': round(count * size / seconds / 1e6, 1),
+    }), flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='16,256,4096', help='Payload bytes of the messages.')
+    parser.add_argument('--count', type=int, default=200000, help='Messages of each stream.')
+    parser.add_argument('--transports', default='pipe,grpc')
+    parser.add_argument('--serve', help='Runs only the server, on this address.')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(address=args.serve)
+        sys.exit(0)
+
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve',
+         'unix:' + tempfile.gettempdir() + '/grpcbb_small_messages_' + str(os.getpid()) + '.sock'],
+        stdout=subprocess.PIPE, text=True
+    ) if 'grpc' in args.transports.split(',') else None
+    try:
+        channel = grpc.insecure_channel(server.stdout.readline().strip()) if server else None
+        method = stream_stub(channel=channel, service=SERVICE, name='Count') if channel else None
+        for transport, size, batch in itertools.product(
+                args.transports.split(','), [int(s) for s in args.sizes.split(',')], (False, True)):
+            start: float = time.perf_counter()
+            received: int = run_pipe(count=args.count, size=size, batch=batch) if transport == 'pipe' else \
+                run_grpc(method=method, count=args.count, size=size, batch=batch)
+            report(case={'transport': transport, 'batch': batch}, count=args.count, size=size,
+                   received=received, seconds=time.perf_counter() - start)
+        if channel:
+            channel.close()
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
@@ -0,0 +1,120 @@
+"""
+Latency of small calls: plain unary gRPC, client_grpc, and a BeeCodec call, against an echo server on
+ another process over a Unix socket or loopback TCP. A stream call with a single buffer and no parser,
+ the cost of a stream stream call on gRPC, is measured too.
+
+The stream methods of the server parse and serialize with parse_from_buffer and serialize_to_buffer
+ (bee), or with a BeeCodec (codec), so each client path is measured against its own server side.
+
+Usage:
+    python small_rpc.py --sizes 16,256,1024 --calls 2000
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import grpc
+
+sys.path.append('../src/')
+sys.path.append('../test/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.client import client_grpc, parse_from_buffer, serialize_to_buffer
+from grpcbigbuffer.codec import BeeCodec
+from helpers import LocalServer, stream_stub
+
+SERVICE = 'benchmark.Small'
+CODEC = BeeCodec(indices_parser=test_pb2.Test, partitions_message_mode_parser=True, indices_serializer=test_pb2.Test)
+
+
+def serve(address: str):
+    def bee(request_iterator, context):
+        messages: List = list(parse_from_buffer(request_iterator=request_iterator, indices=test_pb2.Test,
+                                                partitions_message_mode=True))
+        yield from serialize_to_buffer(message_iterator=messages[0], indices=test_pb2.Test)
+
+    def codec(request_iterator, context):
+        messages: List = list(CODEC.parse(request_iterator=request_iterator))
+        yield from CODEC.serialize(input=messages[0])
+
+    LocalServer(methods={
+        'Unary': grpc.unary_unary_rpc_method_handler(
+            lambda request, context: request,
+            request_deserializer=test_pb2.Test.FromString,
+            response_serializer=test_pb2.Test.SerializeToString
+        ),
+        'Stream': lambda request_iterator, context: iter(list(request_iterator)),
+        'Bee': bee,
+        'Codec': codec,
+    }, service=SERVICE, address=address, max_workers=4).serve()
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure(call: Callable[[], None], calls: int, warmup: int) -> Dict:
+    for _ in range(warmup):
+        call()
+    latencies: List[float] = []
+    for _ in range(calls):
+        start: float = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return {
+        'calls/s': round(calls / sum(latencies)),
+        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='16,256,1024', help='Payload bytes of the messages.')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--transport', choices=['unix', 'tcp'], default='unix')
+    parser.add_argument('--serve', help='Runs only the server, on this address.')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(address=args.serve)
+        sys.exit(0)
+
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve',
+         'unix:' + tempfile.gettempdir() + '/grpcbb_small_rpc_' + str(os.getpid()) + '.sock'
+         if args.transport == 'unix' else 'localhost:0'],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        with grpc.insecure_channel(server.stdout.readline().strip()) as channel:
+            unary = channel.unary_unary('/' + SERVICE + '/Unary', request_serializer=test_pb2.Test.SerializeToString,
+                                        response_deserializer=test_pb2.Test.FromString)
+            stream, bee, codec = [stream_stub(channel=channel, service=SERVICE, name=name)
+                                  for name in ('Stream', 'Bee', 'Codec')]
+
+            for size in [int(s) for s in args.sizes.split(',')]:
+                message = test_pb2.Test(t1=os.urandom(size))
+                paths: Dict[str, Callable[[], None]] = {
+                    'unary': lambda: unary(message),
+                    'stream': lambda: list(stream(iter([buffer_pb2.Buffer(chunk=message.SerializeToString(),
+                                                                          separator=True)]))),
+                    'client_grpc': lambda: list(client_grpc(method=bee, input=message, indices_parser=test_pb2.Test,
+                                                            partitions_message_mode_parser=True,
+                                                            indices_serializer=test_pb2.Test)),
+                    'codec': lambda: list(CODEC.call(method=codec, input=message)),
+                }
+                for path, call in paths.items():
+                    print(json.dumps({'size': size, 'path': path, 'calls': args.calls,
+                                      **measure(call=call, calls=args.calls, warmup=args.warmup)}), flush=True)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
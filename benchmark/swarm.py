@@ -0,0 +1,116 @@
+"""
+Download time of the blocks of an object from one peer and from several at once, with swarm_download.
+
+Each peer runs on its own process, over a Unix socket, and serves all the blocks through block_servicer,
+ limited to peer-mb-s MB/s (if given) like the uplink of a node of a cluster. The blocks are generated
+ once on a temporary directory shared by the peers, and removed from the registry of the downloader
+ after each case.
+
+Usage:
+    python swarm.py --blocks 32 --block-mb 16 --peers 1,2,4 --peer-mb-s 50
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from hashlib import sha3_256
+from typing import List
+
+import grpc
+
+sys.path.append('../src/')
+sys.path.append('../test/')
+
+from grpcbigbuffer.swarm import block_servicer, swarm_download
+from grpcbigbuffer.utils import Enviroment, METADATA_FILE_NAME
+from helpers import LocalServer, stream_stub
+
+SERVICE = 'benchmark.Swarm'
+
+
+def serve(address: str, block_dir: str, rate: float):
+    servicer = block_servicer(block_dir=block_dir)
+
+    def blocks(request_iterator, context):
+        for buffer in servicer(request_iterator, context):
+            if rate:
+                time.sleep(len(buffer.chunk) / rate)
+            yield buffer
+
+    LocalServer(methods={'Blocks': blocks}, service=SERVICE, address=address).serve()
+
+
+def generate_object(directory: str, blocks: int, size: int) -> List[str]:
+    # Blocks of random content on the directory, and the _.json of an object made of them.
+    block_ids: List[str] = []
+    for _ in range(blocks):
+        content: bytes = os.urandom(size)
+        block_ids.append(sha3_256(content).hexdigest())
+        with open(directory + block_ids[-1], 'wb') as f:
+            f.write(content)
+    with open(directory + METADATA_FILE_NAME, 'w') as f:
+        json.dump([[block_id, [1]] for block_id in block_ids], f)
+    return block_ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocks', type=int, default=32)
+    parser.add_argument('--block-mb', type=int, default=16)
+    parser.add_argument('--peers', default='1,2,4', help='Number of peers of each case.')
+    parser.add_argument('--downloads-per-peer', type=int, default=2)
+    parser.add_argument('--peer-mb-s', type=float, default=0, help='Upload MB/s of each peer, 0 without limit.')
+    parser.add_argument('--serve', help='Runs only a peer, on this address.')
+    parser.add_argument('--block-dir')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(address=args.serve, block_dir=args.block_dir, rate=args.peer_mb_s * 1e6)
+        sys.exit(0)
+
+    directory: str = tempfile.mkdtemp(prefix='grpcbb_swarm_') + '/'
+    os.makedirs(Enviroment.block_dir, exist_ok=True)
+    os.makedirs(Enviroment.cache_dir, exist_ok=True)
+    servers: List[subprocess.Popen] = []
+    try:
+        block_ids: List[str] = generate_object(directory=directory, blocks=args.blocks,
+                                               size=args.block_mb * 1024 * 1024)
+        for i in range(max(int(p) for p in args.peers.split(','))):
+            servers.append(subprocess.Popen(
+                [sys.executable, __file__, '--block-dir', directory, '--peer-mb-s', str(args.peer_mb_s), '--serve',
+                 'unix:' + tempfile.gettempdir() + '/grpcbb_swarm_' + str(os.getpid()) + '_' + str(i) + '.sock'],
+                stdout=subprocess.PIPE, text=True
+            ))
+        channels: List[grpc.Channel] = [grpc.insecure_channel(server.stdout.readline().strip()) for server in servers]
+        methods = [stream_stub(channel=channel, service=SERVICE, name='Blocks') for channel in channels]
+
+        for peers in [int(p) for p in args.peers.split(',')]:
+            start: float = time.perf_counter()
+            downloaded: List[str] = swarm_download(methods=methods[:peers], manifest=directory,
+                                                   downloads_per_peer=args.downloads_per_peer)
+            seconds: float = time.perf_counter() - start
+            if len(downloaded) != len(block_ids):
+                raise Exception('gRPCbb benchmark error: ' + str(len(downloaded)) + ' blocks downloaded of '
+                                + str(len(block_ids)))
+            for block_id in block_ids:
+                os.remove(Enviroment.block_dir + block_id)
+            print(json.dumps({
+                'peers': peers,
+                'blocks': args.blocks,
+                'block_mb': args.block_mb,
+                'peer_mb_s': args.peer_mb_s,
+                'seconds': round(seconds, 3),
+                'MB/s': round(args.blocks * args.block_mb * 1024 * 1024 / seconds / 1e6, 1),
+            }), flush=True)
+        for channel in channels:
+            channel.close()
+    finally:
+        for server in servers:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+        shutil.rmtree(directory)
@@ -1,10 +1,13 @@
 import json
+import mmap
 import os.path
+import time
 import warnings
+from contextlib import contextmanager, nullcontext
 from hashlib import sha3_256
 from io import BufferedReader
 from itertools import zip_longest
-from typing import Any, List, Dict, Union, Tuple
+from typing import Any, Callable, List, Dict, Optional, Union, Tuple
 from grpcbigbuffer import buffer_pb2
 from google.protobuf.message import Message, DecodeError
 from google._upb._message import RepeatedCompositeContainer
@@ -13,6 +16,41 @@ from grpcbigbuffer.client import generate_random_dir, block_exists, move_to_bloc
     get_hash_from_block
 from grpcbigbuffer.utils import Enviroment, CHUNK_SIZE, METADATA_FILE_NAME, WITHOUT_BLOCK_POINTERS_FILE_NAME, \
     get_file_hash, create_lengths_tree, encode_bytes
+from grpcbigbuffer.wire import WireSizes, field_bytes, write_wire
+
+
+class BuildStats(object):
+    """
+    Seconds spent on each phase of build_multiblock and create_block, and their counters: bytes hashed,
+     block pointers found, messages sized and files written.
+    The hook, if any, receives the name and the seconds of each phase when it ends.
+    """
+
+    def __init__(self, hook: Optional[Callable[[str, float], None]] = None):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.hook: Optional[Callable[[str, float], None]] = hook
+
+    @contextmanager
+    def phase(self, name: str):
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed: float = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0) + elapsed
+            if self.hook:
+                self.hook(name, elapsed)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {'phases': dict(self.phases), 'counters': dict(self.counters)}
+
+
+def phase(stats: Optional[BuildStats], name: str):
+    return stats.phase(name) if stats else nullcontext()
 
 
 def is_block(bytes_obj: bytes, blocks: List[bytes]) -> bool:
@@ -70,16 +108,21 @@ def search_on_message_real(
         blocks: List[bytes],
         container: List[Tuple[str, List[int]]],
         real_lengths: Dict[int, Tuple[int, int, bool]],
+        stats: Optional[BuildStats] = None,
+        sizes: Optional[WireSizes] = None
 ):
+    if sizes is None:
+        sizes = WireSizes(message=message)
     position: int = initial_position
     real_position: int = real_initial_position
     for field, value in message.ListFields():
         if isinstance(value, RepeatedCompositeContainer):
             for element in value:
                 position += 1
+                size: int = sizes.of(element)
                 if position not in real_lengths.keys():
-                    position += len(encode_bytes(element.ByteSize())) + element.ByteSize()
-                    real_position += 1 + len(encode_bytes(element.ByteSize())) + element.ByteSize()
+                    position += len(encode_bytes(size)) + size
+                    real_position += 1 + len(encode_bytes(size)) + size
                     continue
                 try:
                     message_size = real_lengths[position][0]
@@ -89,20 +132,23 @@ def search_on_message_real(
                 search_on_message_real(
                     message=element,
                     pointers=pointers + [real_position + 1],
-                    initial_position=position + len(encode_bytes(element.ByteSize())),
+                    initial_position=position + len(encode_bytes(size)),
                     real_initial_position=real_position + 1 + len(encode_bytes(message_size)),
                     blocks=blocks,
                     container=container,
-                    real_lengths=real_lengths
+                    real_lengths=real_lengths,
+                    stats=stats,
+                    sizes=sizes
                 )
-                position += len(encode_bytes(element.ByteSize())) + element.ByteSize()
+                position += len(encode_bytes(size)) + size
                 real_position += 1 + len(encode_bytes(message_size)) + message_size
 
         elif isinstance(value, Message):
             position += 1
+            size: int = sizes.of(value)
             if position not in real_lengths.keys():
-                position += len(encode_bytes(value.ByteSize())) + value.ByteSize()
-                real_position += 1 + len(encode_bytes(value.ByteSize())) + value.ByteSize()
+                position += len(encode_bytes(size)) + size
+                real_position += 1 + len(encode_bytes(size)) + size
                 continue
             try:
                 message_size = real_lengths[position][0]
@@ -112,13 +158,15 @@ def search_on_message_real(
             search_on_message_real(
                 message=value,
                 pointers=pointers + [real_position + 1],
-                initial_position=position + len(encode_bytes(value.ByteSize())),
+                initial_position=position + len(encode_bytes(size)),
                 real_initial_position=real_position + 1 + len(encode_bytes(message_size)),
                 blocks=blocks,
                 container=container,
-                real_lengths=real_lengths
+                real_lengths=real_lengths,
+                stats=stats,
+                sizes=sizes
             )
-            position += len(encode_bytes(value.ByteSize())) + value.ByteSize()
+            position += len(encode_bytes(size)) + size
             real_position += 1 + len(encode_bytes(message_size)) + message_size
 
         elif type(value) == bytes and is_block(value, blocks):
@@ -134,7 +182,7 @@ def search_on_message_real(
             except KeyError:
                 raise Exception(
                     'gRPCbb block builder error, real lengths not in ' + str(position) + '. ' + str(real_lengths))
-            position += len(encode_bytes(block.ByteSize())) + block.ByteSize()
+            position += len(encode_bytes(len(value))) + len(value)
             real_position += 1 + len(encode_bytes(block_length)) + block_length
 
         elif type(value) == bytes or type(value) == str:
@@ -143,13 +191,9 @@ def search_on_message_real(
 
         else:
             try:
-                temp_message = type(message)()
-                temp_message.CopyFrom(message)
-                for field_name, _ in temp_message.ListFields():
-                    if field_name.index != field.index:
-                        temp_message.ClearField(field_name.name)
-                position += temp_message.ByteSize()
-                real_position += temp_message.ByteSize()
+                size: int = len(field_bytes(message=message, field=field))
+                position += size
+                real_position += size
             except Exception as e:
                 raise Exception('gRPCbb block builder error obtaining the length of a primitive value :' + str(e))
 
@@ -159,35 +203,45 @@ def search_on_message(
         pointers: List[int],
         initial_position: int,
         blocks: List[bytes],
-        container: Dict[str, List[List[int]]]
+        container: Dict[str, List[List[int]]],
+        stats: Optional[BuildStats] = None,
+        sizes: Optional[WireSizes] = None
 ):
     """
        Search_on_message makes a tree search of the protobuf object (attr. message) and stores all the buffer block
         identifier instances with its indexes (ascendant order) on the container dictionary.
         It allows to know where the buffer needs to be changed when the buffer block substitute the block identifier.
        """
+    if sizes is None:
+        sizes = WireSizes(message=message)
     position: int = initial_position
     for field, value in message.ListFields():
         if isinstance(value, RepeatedCompositeContainer):
             for element in value:
+                size: int = sizes.of(element)
                 search_on_message(
                     message=element,
                     pointers=pointers + [position + 1],
-                    initial_position=position + 1 + len(encode_bytes(element.ByteSize())),
+                    initial_position=position + 1 + len(encode_bytes(size)),
                     blocks=blocks,
-                    container=container
+                    container=container,
+                    stats=stats,
+                    sizes=sizes
                 )
-                position += 1 + len(encode_bytes(element.ByteSize())) + element.ByteSize()
+                position += 1 + len(encode_bytes(size)) + size
 
         elif isinstance(value, Message):
+            size: int = sizes.of(value)
             search_on_message(
                 message=value,
                 pointers=pointers + [position + 1],
-                initial_position=position + 1 + len(encode_bytes(value.ByteSize())),
+                initial_position=position + 1 + len(encode_bytes(size)),
                 blocks=blocks,
-                container=container
+                container=container,
+                stats=stats,
+                sizes=sizes
             )
-            position += 1 + len(encode_bytes(value.ByteSize())) + value.ByteSize()
+            position += 1 + len(encode_bytes(size)) + size
 
         elif type(value) == bytes and is_block(value, blocks):
             block = buffer_pb2.Buffer.Block()
@@ -199,20 +253,17 @@ def search_on_message(
                 container[_block_hash] = [_list_of_pointers]
             else:
                 container[_block_hash].append(_list_of_pointers)
+            if stats:
+                stats.count('pointers_found')
 
-            position += 1 + len(encode_bytes(block.ByteSize())) + block.ByteSize()
+            position += 1 + len(encode_bytes(len(value))) + len(value)
 
         elif type(value) == bytes or type(value) == str:
             position += 1 + len(encode_bytes(len(value))) + len(value)
 
         else:
             try:
-                temp_message = type(message)()
-                temp_message.CopyFrom(message)
-                for field_name, _ in temp_message.ListFields():
-                    if field_name.index != field.index:
-                        temp_message.ClearField(field_name.name)
-                position += temp_message.ByteSize()
+                position += len(field_bytes(message=message, field=field))
             except Exception as e:
                 raise Exception('gRPCbb block builder error obtaining the length of a primitive value :' + str(e))
 
@@ -304,11 +355,13 @@ def generate_buffer(buffer: bytes, lengths: Dict[int, Tuple[int, int, bool]]) ->
     return list_of_bytes + [buffer[i:]]
 
 
-def generate_id(buffers: List[bytes], blocks: List[bytes]) -> bytes:
+def generate_id(buffers: List[bytes], blocks: List[bytes], stats: Optional[BuildStats] = None) -> bytes:
     hash_id = sha3_256()
     for buffer, block in zip_longest(buffers, blocks):
         if buffer:
             hash_id.update(buffer)
+            if stats:
+                stats.count('bytes_hashed', len(buffer))
         if block:
             with BufferedReader(open(Enviroment.block_dir + block.hex(), 'rb')) as f:
                 while True:
@@ -317,6 +370,8 @@ def generate_id(buffers: List[bytes], blocks: List[bytes]) -> bytes:
                     if len(piece) == 0:
                         break
                     hash_id.update(piece)
+                    if stats:
+                        stats.count('bytes_hashed', len(piece))
     return hash_id.digest()
 
 
@@ -326,83 +381,122 @@ def purify_buffer(buff: bytes) -> bytes:
 
 def build_multiblock(
         pf_object_with_block_pointers: Any,
-        blocks: List[bytes]
+        blocks: List[bytes],
+        stats: Optional[BuildStats] = None
 ) -> Tuple[bytes, str]:
+    """
+    Builds the multiblock directory of a message whose bytes fields have block pointers.
+    With stats, the seconds of each phase and the counters of the build are accumulated on it.
+    """
+    with phase(stats, 'wire_sizes'):
+        sizes = WireSizes(message=pf_object_with_block_pointers)
+    if stats:
+        stats.count('messages_sized', len(sizes.sizes))
+
     container: Dict[str, List[List[int]]] = {}
-    search_on_message(
-        message=pf_object_with_block_pointers,
-        pointers=[],
-        initial_position=0,
-        blocks=blocks,
-        container=container
-    )
-
-    tree: Dict[int, Union[Dict, str]] = create_lengths_tree(
-        pointer_container=container
-    )
-
-    # no importa para duplicidad
-    real_lengths: Dict[int, Tuple[int, int, bool]] = compute_real_lengths(
-        tree=tree,
-        buffer=pf_object_with_block_pointers.SerializeToString()
-    )
-
-    # no importa para duplicidad
-    new_buff: List[bytes] = generate_buffer(
-        buffer=pf_object_with_block_pointers.SerializeToString(),
-        lengths=real_lengths
-    )
-
-    object_id: bytes = generate_id(
-        buffers=new_buff,
-        blocks=blocks
-    )
+    with phase(stats, 'search_on_message'):
+        search_on_message(
+            message=pf_object_with_block_pointers,
+            pointers=[],
+            initial_position=0,
+            blocks=blocks,
+            container=container,
+            stats=stats,
+            sizes=sizes
+        )
+
+    with phase(stats, 'create_lengths_tree'):
+        tree: Dict[int, Union[Dict, str]] = create_lengths_tree(
+            pointer_container=container
+        )
+
     cache_dir: str = generate_random_dir() + '/'
+    with phase(stats, 'serialize'):
+        # The message is written as it's serialized, and the buffer is mapped from the file.
+        with open(cache_dir + WITHOUT_BLOCK_POINTERS_FILE_NAME, 'wb') as f:
+            size: int = write_wire(message=pf_object_with_block_pointers, f=f, sizes=sizes)
+        with open(cache_dir + WITHOUT_BLOCK_POINTERS_FILE_NAME, 'rb') as f:
+            buffer: Union[bytes, mmap.mmap] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    try:
+        # no importa para duplicidad
+        with phase(stats, 'compute_real_lengths'):
+            real_lengths: Dict[int, Tuple[int, int, bool]] = compute_real_lengths(
+                tree=tree,
+                buffer=buffer
+            )
+
+        # no importa para duplicidad
+        with phase(stats, 'generate_buffer'):
+            new_buff: List[bytes] = generate_buffer(
+                buffer=buffer,
+                lengths=real_lengths
+            )
+    finally:
+        if size:
+            buffer.close()
+
+    with phase(stats, 'generate_id'):
+        object_id: bytes = generate_id(
+            buffers=new_buff,
+            blocks=blocks,
+            stats=stats
+        )
     _json: List[Union[
         int,
         Tuple[str, List[int]]
     ]] = []
 
     container_real_lengths: List[Tuple[str, List[int]]] = []
-    search_on_message_real(
-        message=pf_object_with_block_pointers,
-        pointers=[],
-        initial_position=0,
-        real_initial_position=0,
-        blocks=blocks,
-        container=container_real_lengths,
-        real_lengths=real_lengths
-    )
-
-    for i, (b1, b2) in enumerate(zip_longest(new_buff, container_real_lengths)):
-        _json.append(i + 1)
-        with open(cache_dir + str(i + 1), 'wb') as f:
-            f.write(b1)
-
-        if b2:
-            _json.append((b2[0], b2[1]))
-
-    with open(cache_dir + METADATA_FILE_NAME, 'w') as f:
-        json.dump(_json, f)
-
-    with open(cache_dir + WITHOUT_BLOCK_POINTERS_FILE_NAME, 'wb') as f:
-        f.write(pf_object_with_block_pointers.SerializeToString())
+    with phase(stats, 'search_on_message_real'):
+        search_on_message_real(
+            message=pf_object_with_block_pointers,
+            pointers=[],
+            initial_position=0,
+            real_initial_position=0,
+            blocks=blocks,
+            container=container_real_lengths,
+            real_lengths=real_lengths,
+            stats=stats,
+            sizes=sizes
+        )
+
+    with phase(stats, 'write_partitions'):
+        for i, (b1, b2) in enumerate(zip_longest(new_buff, container_real_lengths)):
+            _json.append(i + 1)
+            with open(cache_dir + str(i + 1), 'wb') as f:
+                f.write(b1)
+
+            if b2:
+                _json.append((b2[0], b2[1]))
+
+        with open(cache_dir + METADATA_FILE_NAME, 'w') as f:
+            json.dump(_json, f)
+        if stats:
+            stats.count('files_written', len(new_buff) + 2)
 
     return object_id, cache_dir
 
 
-def create_block(file_path: str, copy: bool = False) -> Tuple[bytes, buffer_pb2.Buffer.Block]:
-    file_hash: str = get_file_hash(file_path=file_path)
-    if not block_exists(block_id=file_hash):
-        if copy and not copy_to_block_dir(
+def create_block(file_path: str, copy: bool = False, stats: Optional[BuildStats] = None) \
+        -> Tuple[bytes, buffer_pb2.Buffer.Block]:
+    with phase(stats, 'hash_file'):
+        file_hash: str = get_file_hash(file_path=file_path)
+    if stats:
+        stats.count('bytes_hashed', os.path.getsize(file_path))
+    with phase(stats, 'move_to_block_dir'):
+        if not block_exists(block_id=file_hash):
+            if copy and not copy_to_block_dir(
+                    file_hash=file_hash,
+                    file_path=file_path
+            ) or \
+                    not copy and not move_to_block_dir(
                 file_hash=file_hash,
                 file_path=file_path
-        ) or \
-                not copy and not move_to_block_dir(
-            file_hash=file_hash,
-            file_path=file_path
-        ):
-            raise Exception('gRPCbb error creating block, file could not be moved.')
+            ):
+                raise Exception('gRPCbb error creating block, file could not be moved.')
+            if stats and copy:
+                stats.count('files_written')
 
     file_hash: bytes = bytes.fromhex(file_hash)
 
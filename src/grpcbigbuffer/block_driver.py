@@ -1,11 +1,16 @@
 import json
 import os.path
-from typing import Union, List, Tuple, Dict, Generator
+from bisect import bisect_right
+from typing import Union, List, Tuple, Dict, Generator, Optional, Type, Set, BinaryIO
 
+from google.protobuf.message import Message
+from google.protobuf.message_factory import GetMessageClass
+
+from grpcbigbuffer.disk_stream import scan_records
 from grpcbigbuffer.validate_lengths_tree import validate_lengths_tree
 from grpcbigbuffer.buffer_pb2 import Buffer
 from grpcbigbuffer.utils import BLOCK_LENGTH, METADATA_FILE_NAME, WITHOUT_BLOCK_POINTERS_FILE_NAME, Enviroment, \
-    create_lengths_tree, encode_bytes, get_varint_at_position, get_pruned_block_length
+    create_lengths_tree, encode_bytes, get_varint_at_position, get_pruned_block_length, FIELD_INDEX_FILE_NAME
 
 
 def compute_wbp_lengths(tree: Dict[int, Union[Dict, str]], file_list: List[str]) -> Dict[int, int]:
@@ -114,25 +119,26 @@ def regenerate_buffer(lengths: Dict[int, int], buffer: List[Union[bytes, str]])
             yield block_buff
 
 
-def generate_wbp_file(dirname: str):
+def read_wbp_lengths(dirname: str) \
+        -> Tuple[List[Union[int, List]], List[str], Dict[int, Union[Dict, str]], Dict[int, int]]:
+    """
+    Reads the _.json of a multiblock directory. Returns it, the files it lists, the lengths tree and
+     the wbp length of each length varint of the real layout that changes on the wbp file.
+    """
     with open(dirname + '/' + METADATA_FILE_NAME, 'r') as f:
         _json: List[Union[
             int,
             List[str, List[int]]
         ]] = json.load(f)
 
-    buffer: List[Union[bytes, str]] = []
     file_list: List[str] = []
     for e in _json:
         if type(e) == int:
             file_list.append(dirname + '/' + str(e))
-            with open(dirname + '/' + str(e), 'rb') as file:
-                buffer.append(file.read())
         else:
             if type(e) != list or type(e[0]) != str:
                 raise Exception('gRPCbb: Invalid block on _.json file.')
             file_list.append(Enviroment.block_dir + e[0])
-            buffer.append(Enviroment.block_dir + e[0])
 
     blocks: Dict[str, List[List[int]]] = {}
     for _t in _json:
@@ -146,8 +152,146 @@ def generate_wbp_file(dirname: str):
 
     tree: Dict[int, Union[Dict, str]] = create_lengths_tree(blocks)
 
-    recalculated_lengths: Dict[int, int] = compute_wbp_lengths(tree=tree, file_list=file_list)
+    return _json, file_list, tree, compute_wbp_lengths(tree=tree, file_list=file_list)
+
+
+def generate_wbp_file(dirname: str):
+    _json, file_list, _, recalculated_lengths = read_wbp_lengths(dirname=dirname)
+
+    buffer: List[Union[bytes, str]] = []
+    for e, file in zip(_json, file_list):
+        if type(e) == int:
+            with open(file, 'rb') as f:
+                buffer.append(f.read())
+        else:
+            buffer.append(file)
 
     with open(dirname + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME, 'wb') as f:
         for c in regenerate_buffer(recalculated_lengths, buffer):
             f.write(c)
+
+
+class ConcatenatedFile(object):
+    # Read only file over the concatenation of several files, enough to scan its records.
+    def __init__(self, file_list: List[str]):
+        self.file_list: List[str] = file_list
+        self.sizes: List[int] = [os.path.getsize(file) for file in file_list]
+        self.starts: List[int] = [sum(self.sizes[:i]) for i in range(len(file_list))]
+        self.size: int = sum(self.sizes)
+        self.position: int = 0
+        self.files: Dict[int, BinaryIO] = {}  # Opened on the first read of each one, until close.
+
+    def seek(self, position: int):
+        self.position = position
+
+    def read(self, n: int) -> bytes:
+        data: bytes = b''
+        i: int = bisect_right(self.starts, self.position) - 1
+        while len(data) < n and 0 <= i < len(self.file_list) and self.position < self.size:
+            if self.position >= self.starts[i] + self.sizes[i]:  # Empty files.
+                i += 1
+                continue
+            if i not in self.files:
+                self.files[i] = open(self.file_list[i], 'rb')
+            self.files[i].seek(self.position - self.starts[i])
+            piece: bytes = self.files[i].read(min(n - len(data), self.starts[i] + self.sizes[i] - self.position))
+            data += piece
+            self.position += len(piece)
+            i += 1
+        return data
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def index_fields(
+        file,
+        offset: int,
+        length: int,
+        message_cls: Optional[Type[Message]] = None,
+        depth: int = 1,
+        wbp_lengths: Optional[Dict[int, int]] = None,
+        leaves: Optional[Set[int]] = None,
+        wbp_offset: Optional[int] = None
+) -> Tuple[Dict, Dict]:
+    """
+    Field number -> [record start, value start, record end, sub index] of each record, up to depth
+     levels. The sub index is only given for message fields, so without the message class only the
+     top level is indexed.
+    With the wbp lengths, the file is the real layout and the index of the same records on the wbp file
+     is given too, moved by the lengths that change. The blocks (the leaves) are not indexed inside.
+    """
+    real: Dict[str, List[List[Union[int, Dict]]]] = {}
+    wbp: Dict[str, List[List[Union[int, Dict]]]] = {}
+    shift: int = (offset if wbp_offset is None else wbp_offset) - offset  # From the real layout to wbp.
+    for field, start, value_start, end in scan_records(file, offset, length):
+        wbp_record: List[Union[int, Dict]] = [start + shift, value_start + shift, end + shift]
+        length_position: int = value_start - len(encode_bytes(end - value_start))
+        if wbp_lengths and length_position in wbp_lengths:
+            wbp_record[1] += len(encode_bytes(wbp_lengths[length_position])) - len(encode_bytes(end - value_start))
+            wbp_record[2] = wbp_record[1] + wbp_lengths[length_position]
+
+        real_record: List[Union[int, Dict]] = [start, value_start, end]
+        descriptor = message_cls.DESCRIPTOR.fields_by_number.get(field) if message_cls else None
+        if depth > 1 and descriptor and descriptor.message_type and \
+                not (leaves and length_position in leaves):
+            sub_real, sub_wbp = index_fields(
+                file, value_start, end - value_start, GetMessageClass(descriptor.message_type), depth - 1,
+                wbp_lengths, leaves, wbp_record[1]
+            )
+            real_record.append(sub_real)
+            wbp_record.append(sub_wbp)
+        real.setdefault(str(field), []).append(real_record)
+        wbp.setdefault(str(field), []).append(wbp_record)
+        shift = wbp_record[2] - end
+    return real, wbp
+
+
+def generate_field_index(dirname: str, message_cls: Optional[Type[Message]] = None, depth: int = 1):
+    """
+    Writes the field index of a multiblock directory up to depth levels, with the records of its message
+     on the wbp file and on the real layout, which is the concatenation of the files listed on _.json.
+    """
+    if not (isinstance(message_cls, type) and issubclass(message_cls, Message)):
+        message_cls = None
+        depth = 1
+
+    with open(dirname + '/' + METADATA_FILE_NAME, 'r') as f:
+        _json: List[Union[int, List]] = json.load(f)
+    file_list: List[str] = [
+        dirname + '/' + str(e) if type(e) == int else Enviroment.block_dir + e[0] for e in _json
+    ]
+
+    real: Optional[Dict] = None
+    files: List[List[Union[int, str]]] = []
+    if all(os.path.isfile(file) for file in file_list):
+        # One walk of the real layout, the wbp records are moved by the lengths it already has.
+        _, _, tree, wbp_lengths = read_wbp_lengths(dirname=dirname)
+        leaves: Set[int] = set()
+        nodes: List[Dict[int, Union[Dict, str]]] = [tree]
+        while nodes:
+            for position, value in nodes.pop().items():
+                if isinstance(value, dict):
+                    nodes.append(value)
+                else:
+                    leaves.add(position)
+        with ConcatenatedFile(file_list=file_list) as concatenated:
+            real, wbp = index_fields(concatenated, 0, concatenated.size, message_cls, depth, wbp_lengths, leaves)
+        files = [[e if type(e) == int else e[0], os.path.getsize(file)] for e, file in zip(_json, file_list)]
+
+    else:  # Blocks of blocks are directories, only the wbp file is indexed.
+        wbp_file: str = dirname + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME
+        with open(wbp_file, 'rb') as f:
+            wbp, _ = index_fields(f, 0, os.path.getsize(wbp_file), message_cls, depth)
+
+    with open(dirname + '/' + FIELD_INDEX_FILE_NAME + '.tmp', 'w') as f:
+        f.write(json.dumps({'depth': depth, 'files': files, 'wbp': wbp, 'real': real}))  # dump encodes in python.
+    os.replace(dirname + '/' + FIELD_INDEX_FILE_NAME + '.tmp', dirname + '/' + FIELD_INDEX_FILE_NAME)
@@ -0,0 +1,205 @@
+import os
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import generate_random_file, remove_file, SkippedBlocks, block_announcement
+from grpcbigbuffer.utils import Signal
+
+
+class BroadcastStream(object):
+    """
+    One of the consumers of a Broadcast, with its own cursor and signal, so the blocks announced by its
+     receiver are skipped only on it. When it lags behind the ring of the broadcast, the buffers that it
+     still needs are appended to its spill file.
+    """
+
+    def __init__(self, broadcast: 'Broadcast', signal: Signal):
+        self.broadcast: Broadcast = broadcast
+        self.signal: Signal = signal
+        self.cursor: int = 0
+        self.closed: bool = False
+        self.skipped = SkippedBlocks(signal=signal)
+        self.announced: List[str] = []  # Blocks announced by the parser of the call, not sent yet.
+        # The spill file is written by the stream that reads the source, and read by this one.
+        self.spill_lock = threading.Lock()
+        self.spill_file: Optional[str] = None
+        self.spill_read: int = 0
+        self.spill_write: int = 0
+        self.spilled: int = 0  # Buffers on the spill file, not read yet.
+        self.first: bool = signal.exist
+        self.pending: Optional[buffer_pb2.Buffer] = None  # Waiting for the credits of the peer.
+
+    def write_spill(self, buffer: bytes):
+        with self.spill_lock:
+            if self.closed:
+                return
+            if not self.spill_file:
+                self.spill_file = generate_random_file()
+            with open(self.spill_file, 'ab') as f:
+                f.write(len(buffer).to_bytes(4, byteorder='big') + buffer)
+            self.spill_write += 4 + len(buffer)
+            self.spilled += 1
+
+    def read_spill(self) -> buffer_pb2.Buffer:
+        with self.spill_lock:
+            with open(self.spill_file, 'rb') as f:
+                f.seek(self.spill_read)
+                size: int = int.from_bytes(f.read(4), byteorder='big')
+                buffer = buffer_pb2.Buffer.FromString(f.read(size))
+            self.spill_read += 4 + size
+            self.spilled -= 1
+            if self.spill_read == self.spill_write:
+                self._remove_spill()
+        return buffer
+
+    def _remove_spill(self):
+        if self.spill_file:
+            remove_file(self.spill_file)
+        self.spill_file, self.spill_read, self.spill_write, self.spilled = None, 0, 0, 0
+
+    def remove_spill(self):
+        with self.spill_lock:
+            self._remove_spill()
+
+    def __iter__(self):
+        return self
+
+    def next_buffer(self) -> buffer_pb2.Buffer:
+        while True:
+            self.announced.extend(self.signal.take_announced())
+            if self.announced:
+                return block_announcement(block_id=self.announced.pop(0))
+            buffer: buffer_pb2.Buffer = self.broadcast.get(self)
+            if not self.skipped.skip(buffer):
+                return buffer
+
+    def __next__(self) -> buffer_pb2.Buffer:
+        # Like send_with_credits, the buffers of the ring are shared so the first one is copied.
+        if self.pending is None:
+            try:
+                self.pending = self.next_buffer()
+            except StopIteration:
+                if self.signal.release():
+                    return buffer_pb2.Buffer(credit=0)
+                raise
+            if self.first:
+                self.first = False
+                marked = buffer_pb2.Buffer()
+                marked.CopyFrom(self.pending)
+                marked.credit = self.signal.take_grant() or 0
+                marked.accepts_batch = True
+                self.pending = marked
+        credit: Optional[int] = self.signal.acquire(len(self.pending.chunk))
+        if credit:
+            return buffer_pb2.Buffer(credit=credit)
+        buffer, self.pending = self.pending, None
+        return buffer
+
+    def close(self):
+        self.broadcast.close(self)
+
+
+class Broadcast(object):
+    """
+    Fans out a buffer stream to several consumers, reading each buffer of the source once. The buffers
+     are kept on a ring until every consumer has sent them. When the ring is full the oldest buffer is
+     spilled to the disk cursors of the consumers that still need it, so slow consumers don't stop the
+     fast ones, or, without spill, the fast consumers wait for them.
+    The source is read, and the spill files written, by one consumer at a time without holding the lock
+     of the ring, so the others keep sending the buffers that they have meanwhile.
+    """
+
+    def __init__(self, source: Iterator[buffer_pb2.Buffer], capacity: int = 16, spill: bool = True):
+        self.source: Iterator[buffer_pb2.Buffer] = iter(source)
+        self.capacity: int = capacity
+        self.spill: bool = spill
+        self.ring: Dict[int, buffer_pb2.Buffer] = {}
+        self.base: int = 0  # Oldest buffer on the ring.
+        self.head: int = 0  # Next buffer to read from the source.
+        self.reading: bool = False  # A consumer is reading the source.
+        self.done: bool = False
+        self.error: Optional[BaseException] = None
+        self.streams: List[BroadcastStream] = []
+        self.condition = threading.Condition()
+
+    def stream(self, signal: Optional[Signal] = None) -> BroadcastStream:
+        with self.condition:
+            if self.head > 0:
+                raise Exception('gRPCbb broadcast error: the streams must be created before the broadcast starts.')
+            self.streams.append(BroadcastStream(broadcast=self, signal=signal if signal else Signal(exist=False)))
+            return self.streams[-1]
+
+    def collect(self):
+        # Drops the buffers that every open stream has already sent.
+        while self.base < self.head and all(s.cursor > self.base for s in self.streams if not s.closed):
+            del self.ring[self.base]
+            self.base += 1
+        self.condition.notify_all()
+
+    def read(self, evicted: Optional[buffer_pb2.Buffer], lagging: List[BroadcastStream]):
+        # Out of the lock: spills the evicted buffer to the streams that still need it, and reads the next one.
+        buffer: Optional[buffer_pb2.Buffer] = None
+        try:
+            if evicted is not None:
+                serialized: bytes = evicted.SerializeToString()
+                for s in lagging:
+                    s.write_spill(serialized)
+            buffer = next(self.source)
+        except StopIteration:
+            pass
+        except BaseException as e:
+            with self.condition:
+                self.error = e
+        with self.condition:
+            if buffer is not None:
+                self.ring[self.head] = buffer
+                self.head += 1
+            elif not self.error:
+                self.done = True
+            self.reading = False
+            self.condition.notify_all()
+
+    def get(self, stream: BroadcastStream) -> buffer_pb2.Buffer:
+        while True:
+            read: bool = False
+            evicted: Optional[buffer_pb2.Buffer] = None
+            lagging: List[BroadcastStream] = []
+            with self.condition:
+                while True:
+                    if stream.cursor < self.base:
+                        if stream.spilled:
+                            break
+                    elif stream.cursor < self.head:
+                        buffer: buffer_pb2.Buffer = self.ring[stream.cursor]
+                        stream.cursor += 1
+                        self.collect()
+                        return buffer
+                    elif self.error:
+                        raise self.error
+                    elif self.done:
+                        raise StopIteration
+                    elif not self.reading and (self.head - self.base < self.capacity or self.spill):
+                        self.reading, read = True, True
+                        if self.head - self.base >= self.capacity:
+                            evicted = self.ring.pop(self.base)
+                            lagging = [s for s in self.streams if not s.closed and s.cursor <= self.base]
+                            self.base += 1
+                        break
+                    # The buffer is being spilled or read by another stream, or the ring is full without spill.
+                    self.condition.wait()
+
+            if read:
+                self.read(evicted=evicted, lagging=lagging)
+                continue
+            buffer: buffer_pb2.Buffer = stream.read_spill()
+            with self.condition:
+                stream.cursor += 1
+                self.collect()
+            return buffer
+
+    def close(self, stream: BroadcastStream):
+        with self.condition:
+            stream.closed = True
+            self.collect()
+        stream.remove_spill()
@@ -0,0 +1,143 @@
+import itertools
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+
+import grpc
+from google.protobuf.message import Message
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.broadcast import Broadcast, BroadcastStream
+from grpcbigbuffer.client import parse_from_buffer, serialize_to_buffer
+from grpcbigbuffer.utils import Signal, Enviroment, CHUNK_SIZE, FLOW_CONTROL_WINDOW
+
+# Channel arguments for streams of CHUNK_SIZE buffers: messages a bit bigger than a chunk, a stream
+#  window of some chunks so the sender doesn't wait for each window update, and keepalive pings so
+#  long transfers through proxies and load balancers aren't closed as idle. The pings are only sent
+#  during calls and not more often than the 5 minutes that gRPC servers allow by default, or they
+#  close the connection (GOAWAY too_many_pings).
+CHANNEL_OPTIONS: List[Tuple[str, Any]] = [
+    ('grpc.max_send_message_length', 2 * CHUNK_SIZE),
+    ('grpc.max_receive_message_length', 2 * CHUNK_SIZE),
+    ('grpc.http2.lookahead_bytes', 4 * CHUNK_SIZE),
+    ('grpc.http2.bdp_probe', 1),
+    ('grpc.keepalive_time_ms', 300000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+
+class ChannelPool(object):
+    """
+    Channels by target, created on first use and reused by all the calls. Each target has up to
+     size channels (HTTP/2 connections) used round robin, so the streams of many concurrent calls
+     are multiplexed over a few connections.
+    """
+
+    def __init__(
+            self,
+            size: int = 1,
+            options: Optional[List[Tuple[str, Any]]] = None,
+            credentials: Optional[grpc.ChannelCredentials] = None
+    ):
+        self.size: int = size
+        self.options: List[Tuple[str, Any]] = list({**dict(CHANNEL_OPTIONS), **dict(options or [])}.items())
+        self.credentials: Optional[grpc.ChannelCredentials] = credentials
+        self.channels: Dict[str, List[grpc.Channel]] = {}
+        self.next: Dict[str, itertools.count] = {}
+        self.stubs: Dict[Tuple[int, Union[type, str]], Any] = {}
+        self.lock = threading.Lock()
+
+    def channel(self, target: str) -> grpc.Channel:
+        with self.lock:
+            channels: List[grpc.Channel] = self.channels.setdefault(target, [])
+            i: int = next(self.next.setdefault(target, itertools.count())) % self.size
+            if i >= len(channels):
+                channels.append(
+                    grpc.secure_channel(target, self.credentials, options=self.options) if self.credentials
+                    else grpc.insecure_channel(target, options=self.options)
+                )
+            return channels[i]
+
+    def stub(self, target: str, stub_cls: type):
+        channel: grpc.Channel = self.channel(target)
+        with self.lock:
+            return self.stubs.setdefault((id(channel), stub_cls), stub_cls(channel))
+
+    def method(self, target: str, method: str):
+        """
+        A stream stream Bee-RPC method (like '/package.Service/Method') for client_grpc, without the
+         generated stub.
+        """
+        channel: grpc.Channel = self.channel(target)
+        with self.lock:
+            return self.stubs.setdefault((id(channel), method), channel.stream_stream(
+                method,
+                request_serializer=buffer_pb2.Buffer.SerializeToString,
+                response_deserializer=buffer_pb2.Buffer.FromString
+            ))
+
+    def close(self):
+        with self.lock:
+            for channels in self.channels.values():
+                for channel in channels:
+                    channel.close()
+            self.channels, self.next, self.stubs = {}, {}, {}
+
+
+def broadcast_grpc(
+        methods: List[Callable],
+        input=None,
+        timeout=None,
+        indices_parser: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+        partitions_message_mode_parser: Union[bool, list, dict] = None,
+        indices_serializer: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+        mem_manager=None,
+        capacity: int = 16,
+        spill: bool = True,
+        debug: Callable[[str], None] = lambda s: None
+) -> List[Union[List, Exception]]:
+    """
+    Calls every method, like client_grpc, with the same input. The input is serialized once, so its
+     files are read once for all the peers, and shared through a Broadcast of capacity buffers.
+    Returns the outputs of each call, or its exception.
+    """
+    if not indices_parser:
+        indices_parser = buffer_pb2.Empty
+        partitions_message_mode_parser = True
+    if not partitions_message_mode_parser: partitions_message_mode_parser = False
+    if not mem_manager: mem_manager = Enviroment.mem_manager
+    signals: List[Signal] = [Signal(window=FLOW_CONTROL_WINDOW) for _ in methods]
+    broadcast = Broadcast(
+        source=serialize_to_buffer(
+            message_iterator=input if input else buffer_pb2.Empty(),
+            indices=dict(indices_serializer) if type(indices_serializer) is dict else indices_serializer,
+            mem_manager=mem_manager,
+            debug=debug
+        ),
+        capacity=capacity,
+        spill=spill
+    )
+    streams: List[BroadcastStream] = [broadcast.stream(signal=signal) for signal in signals]
+    results: List[Union[List, Exception]] = [[] for _ in methods]
+
+    def call(i: int):
+        try:
+            results[i] = list(parse_from_buffer(
+                request_iterator=methods[i](streams[i], timeout=timeout),
+                signal=signals[i],
+                indices=dict(indices_parser) if type(indices_parser) is dict else indices_parser,
+                partitions_message_mode=dict(partitions_message_mode_parser)
+                if type(partitions_message_mode_parser) is dict else partitions_message_mode_parser,
+                debug=debug
+            ))
+        except Exception as e:
+            results[i] = e
+        finally:
+            streams[i].close()
+
+    threads: List[threading.Thread] = [threading.Thread(target=call, args=(i,)) for i in range(len(methods))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
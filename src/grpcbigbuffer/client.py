@@ -3,18 +3,27 @@ import itertools
 import json
 import os
 import shutil
+import time
 import typing
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
 from typing import Callable, Generator, Union, List, Dict, Type
 
+from google.protobuf.descriptor import FieldDescriptor
 from google.protobuf.message import DecodeError, Message
+from google.protobuf.message_factory import GetMessageClass
 from google._upb._message import RepeatedCompositeContainer
 
 from grpcbigbuffer import buffer_pb2
 from grpcbigbuffer.block_driver import generate_wbp_file, WITHOUT_BLOCK_POINTERS_FILE_NAME, METADATA_FILE_NAME
-from grpcbigbuffer.reader import read_block, read_multiblock_directory, read_from_registry, block_exists, read_bee_file
-from grpcbigbuffer.utils import Enviroment, MAX_DIR, Signal, EmptyBufferException, Dir, CHUNK_SIZE
+from grpcbigbuffer.disk_stream import write_partition_disk_stream, scan_records
+from grpcbigbuffer.instrumentation import Instrumentation, measure_stream, measure_serialization
+from grpcbigbuffer.reader import read_block, read_multiblock_directory, read_from_registry, block_exists, \
+    read_bee_file, BeeFileIndex, read_registry_ranges, scan_bee_records, get_bee_file_data_range, read_bee_index
+from grpcbigbuffer.utils import Enviroment, MAX_DIR, Signal, EmptyBufferException, Dir, CHUNK_SIZE, BEE_FILE_MAGIC, \
+    encode_bytes, copy_file_range, MemoryBudgetExceeded, FLOW_CONTROL_WINDOW, BATCH_RECORD_OVERHEAD
+from grpcbigbuffer.wire import WireSizes, iter_wire_chunks, small_byte_size
 
 
 ## Block driver ##
@@ -90,9 +99,99 @@ def copy_to_block_dir(file_hash: str, file_path: str) -> bool:
     return False
 
 
-def signal_block_buffer_stream(hash: str):
+def signal_block_buffer_stream(hash: str, signal: Signal):
     # Receiver sends the Buffer with block attr. for stops the block buffer stream.
-    pass  # Sends Buffer(block=Block())
+    signal.announce(block_id=hash)
+
+
+def block_announcement(block_id: str) -> buffer_pb2.Buffer:
+    # The block with the signal, so it's not taken for a block of the reverse stream.
+    return buffer_pb2.Buffer(
+        block=buffer_pb2.Buffer.Block(
+            hashes=[buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=bytes.fromhex(block_id))]
+        ),
+        signal=True
+    )
+
+
+def is_control_buffer(buffer: buffer_pb2.Buffer) -> bool:
+    # Buffers that only carry a signal, a credit or a block announcement for the reverse stream.
+    return (buffer.HasField('credit') or buffer.HasField('signal')) and not (
+            buffer.HasField('chunk') or buffer.HasField('separator') or buffer.HasField('head') or
+            buffer.HasField('block') and not buffer.signal
+    )
+
+
+class SkippedBlocks(object):
+    """
+    Leaves out of a sent stream the content of the blocks that the peer has announced on the signal,
+     from the buffer that opens the block, or from the next one if the announcement comes meanwhile,
+     until the block buffer that closes it, which is sent like the one that opens it.
+    """
+
+    def __init__(self, signal: Signal):
+        self.signal: Signal = signal
+        self.blocks: List[str] = []  # Open blocks, the outermost first.
+        self.skipping: typing.Optional[str] = None
+
+    def skip(self, buffer: buffer_pb2.Buffer) -> bool:
+        block_id: typing.Optional[str] = get_hash_from_block(buffer.block) if buffer.HasField('block') else None
+        if block_id:
+            if self.blocks and self.blocks[-1] == block_id:
+                self.blocks.pop()
+                if self.skipping == block_id:
+                    self.skipping = None
+                    return False
+            else:
+                self.blocks.append(block_id)
+                if self.skipping is None and block_id in self.signal.peer_blocks:
+                    self.skipping = block_id
+                    return False
+            return self.skipping is not None
+        if self.skipping is None and self.blocks and self.signal.peer_blocks:
+            self.skipping = next((b for b in self.blocks if b in self.signal.peer_blocks), None)
+        return self.skipping is not None
+
+
+def send_with_credits(
+        buffers,
+        signal: Signal,
+        instrumentation: typing.Optional[Instrumentation] = None
+) -> Generator[buffer_pb2.Buffer, None, None]:
+    """
+    Sends the buffers as the credits granted by the peer allow it, and the grants of the parser of
+     the call between them. The first buffer carries a credit, so the peer knows that this side reads them,
+     and says that this side decodes batches.
+    The blocks that the parser of the call has found on the registry are announced to the peer, and the
+     content of those announced by the peer is not sent.
+    """
+    first: bool = signal.exist
+    skipped = SkippedBlocks(signal=signal)
+    for buffer in buffers:
+        for block_id in signal.take_announced():
+            yield block_announcement(block_id=block_id)
+        if skipped.skip(buffer):
+            if instrumentation:
+                instrumentation.count('unsent_block_bytes', len(buffer.chunk))
+            continue
+        if first:
+            buffer.credit = signal.take_grant() or 0
+            buffer.accepts_batch = True
+            first = False
+        while True:
+            if instrumentation:
+                start: float = time.perf_counter()
+            credit: typing.Optional[int] = signal.acquire(len(buffer.chunk))
+            if instrumentation:
+                instrumentation.observe('signal_wait_seconds', time.perf_counter() - start)
+            if not credit:
+                break
+            yield buffer_pb2.Buffer(credit=credit)
+        yield buffer
+    for block_id in signal.take_announced():
+        yield block_announcement(block_id=block_id)
+    if signal.release():
+        yield buffer_pb2.Buffer(credit=0)
 
 
 def get_hash_from_block(block: buffer_pb2.Buffer.Block,
@@ -163,98 +262,293 @@ def i_read_multiblock_directory(directory: str, delete_directory: bool = False,
         yield i
 
 
-def stop_generator(iterator, block_id):
-    for b in iterator:
-        if b.HasField('block') and get_hash_from_block(b.block) == block_id:
-            b.ClearField('block')
-            yield b
+class BufferStream(object):
+    """
+    The buffers of a received stream, read once each by the parser. The signals and credits of the peer
+     are applied to the signal of the call as they arrive, and the control buffers that only carry them
+     aren't given to the parser. Buffers read while recording can be rewound to be read again.
+    """
+
+    def __init__(
+            self,
+            request_iterator,
+            signal: Signal,
+            instrumentation: typing.Optional[Instrumentation] = None
+    ):
+        self.iterator = iter(request_iterator)
+        self.signal: Signal = signal
+        self.instrumentation: typing.Optional[Instrumentation] = instrumentation
+        self.pending: List[buffer_pb2.Buffer] = []  # Given back, the next one last.
+        self.recorded: typing.Optional[List[buffer_pb2.Buffer]] = None
+        self.received_bytes: int = 0
+        self.start: float = time.perf_counter()
+
+    def next(self) -> typing.Optional[buffer_pb2.Buffer]:
+        # None once the stream ends.
+        if self.pending:
+            buffer: buffer_pb2.Buffer = self.pending.pop()
+        else:
+            for buffer in self.iterator:
+                if buffer.HasField('credit') or buffer.signal:
+                    if buffer.signal and buffer.HasField('block'):
+                        self.signal.peer_has(block_id=get_hash_from_block(buffer.block))
+                    elif buffer.signal:
+                        self.signal.change()
+                    if buffer.HasField('credit'):
+                        self.signal.grant(buffer.credit)
+                    if buffer.accepts_batch:
+                        self.signal.peer_reads_batches = True
+                    if is_control_buffer(buffer):
+                        continue
+                length: int = len(buffer.chunk)
+                self.signal.receive(length)
+                if self.instrumentation and buffer.HasField('chunk'):
+                    self.received_bytes += length
+                    self.instrumentation.count('received_bytes', length)
+                    self.instrumentation.count('received_chunks')
+                break
+            else:
+                return None
+        if self.recorded is not None:
+            self.recorded.append(buffer)
+        return buffer
+
+    def push(self, buffer: buffer_pb2.Buffer):
+        self.pending.append(buffer)
+
+    def start_recording(self):
+        self.recorded = []
+
+    def stop_recording(self):
+        self.recorded = None
+
+    def rewind(self):
+        # The recorded buffers are read again.
+        self.pending.extend(reversed(self.recorded))
+        self.recorded = None
+
+    def close(self):
+        elapsed: float = time.perf_counter() - self.start
+        if self.instrumentation and self.received_bytes and elapsed > 0:
+            self.instrumentation.observe('receive_throughput', self.received_bytes / elapsed)
+
+
+def feed_message(stream: BufferStream, sink):
+    """
+    Reads the buffers of a message from the stream and dispatches each one to the sink: its chunk,
+     the block markers that open and close a block, and the end of the message.
+    The open blocks are kept on a stack, up to Enviroment.block_depth levels, so the cost of each
+     chunk doesn't depend on the nesting.
+    """
+    blocks: List[str] = []
+    while True:
+        buffer: typing.Optional[buffer_pb2.Buffer] = stream.next()
+        if buffer is None:
+            raise Exception('AbortedIteration')
+
+        if buffer.HasField('block'):
+            block_id: str = get_hash_from_block(buffer.block)
+            if block_id:
+                if blocks and blocks[-1] == block_id:
+                    blocks.pop()
+                    sink.close_block(block_id)
+                elif block_id in blocks:
+                    raise Exception('gRPCbb: IntersectionError: Intersections between blocks are not allowed.')
+                elif len(blocks) < Enviroment.block_depth:
+                    blocks.append(block_id)
+                    sink.open_block(block_id, buffer.block)
+            if buffer.chunk:
+                sink.write(buffer.chunk)
+            continue
+
+        if buffer.HasField('chunk'):
+            if buffer.chunk:
+                sink.write(buffer.chunk)
+        elif not buffer.HasField('head'):
+            break
+        if buffer.separator:
             break
+
+    if blocks:
+        raise Exception('gRPCbb: the message ended inside the block ' + blocks[-1])
+
+
+class MessageChunks(object):
+    """
+    Sink of feed_message that keeps the chunks of a message on memory, within the memory budget.
+    The content of the blocks that are on the registry is read from it, and their chunks are skipped.
+    """
+
+    def __init__(self, mem, spill: bool = False, signal: typing.Optional[Signal] = None,
+                 instrumentation: typing.Optional[Instrumentation] = None):
+        self.mem = mem
+        self.spill: bool = spill
+        self.signal: Signal = signal if signal else Signal(exist=False)
+        self.instrumentation: typing.Optional[Instrumentation] = instrumentation
+        self.chunks: List[bytes] = []
+        self.skipping: typing.Optional[str] = None
+
+    def append(self, chunk: bytes):
+        # Memory managers without grow() only account the memory asked on enter.
+        if hasattr(self.mem, 'grow') and not self.mem.grow(len(chunk), spill=self.spill):
+            raise MemoryBudgetExceeded()
+        self.chunks.append(chunk)
+
+    def write(self, chunk: bytes):
+        if self.skipping:
+            if self.instrumentation:
+                self.instrumentation.count('deduplicated_bytes', len(chunk))
         else:
-            yield b
+            self.append(chunk)
 
+    def open_block(self, block_id: str, block: buffer_pb2.Buffer.Block):
+        if not self.skipping and block_exists(block_id=block_id):
+            self.skipping = block_id
+            signal_block_buffer_stream(block_id, signal=self.signal)
+            if self.instrumentation:
+                self.instrumentation.count('blocks_skipped')
+            for c in read_block(block_id=block_id):
+                if type(c) is bytes:
+                    self.append(c)
 
-def save_chunks_to_block(
-        block_buffer: buffer_pb2.Buffer,
-        buffer_iterator,
-        signal: Signal = None,
-        _json: List[Union[
-            int,
-            typing.Tuple[str, List[int]]
-        ]] = None,
-        debug: Callable[[str], None] = lambda s: None,
-):
-    try:
-        block_id: str = get_hash_from_block(block_buffer.block)
-        if _json:
-            _json.append(
-                (block_id, list(block_buffer.block.previous_lengths_position))
-            )
-        if not block_exists(block_id):  # Second com probation of that.
-            save_chunks_to_file(
-                prev=block_buffer.chunk if block_buffer.HasField('chunk') else None,
-                buffer_iterator=stop_generator(buffer_iterator, block_id),
-                filename=Enviroment.block_dir + block_id,
-                signal=signal
-            )
+    def close_block(self, block_id: str):
+        if block_id == self.skipping:
+            self.skipping = None
+
+
+class MessageDir(object):
+    """
+    Sink of feed_message that writes a message to the parts of a multiblock directory. The blocks
+     that aren't on the registry are written to it, the others are skipped.
+    """
+
+    def __init__(
+            self,
+            dirname: str,
+            signal: Signal,
+            instrumentation: typing.Optional[Instrumentation] = None
+    ):
+        self.dirname: str = dirname
+        self.signal: Signal = signal
+        self.instrumentation: typing.Optional[Instrumentation] = instrumentation
+        self._json: List[Union[int, typing.Tuple[str, List[int]]]] = []
+        self.part: int = 0
+        self.block_id: typing.Optional[str] = None  # The outermost open block.
+        self.block_file: typing.Optional[str] = None  # Its file on the registry, while it's written.
+        self.file = None
+        self.open_part()
+
+    def open_part(self):
+        self.part += 1
+        self._json.append(self.part)
+        self.signal.wait()
+        self.file = open(self.dirname + '/' + str(self.part), 'wb')
+
+    def write(self, chunk: bytes):
+        if not self.file:
+            if self.instrumentation:
+                self.instrumentation.count('deduplicated_bytes', len(chunk))
+        elif self.instrumentation:
+            start: float = time.perf_counter()
+            self.file.write(chunk)
+            self.instrumentation.observe('disk_write_seconds', time.perf_counter() - start)
         else:
-            for buffer in buffer_iterator:
-                if buffer.HasField('block') and \
-                        get_hash_from_block(buffer.block) == block_id:
-                    break
-    except Exception as e:
-        debug(f"Exception saving chunks to block {_json}: {e}")
-        raise e
-
-
-def save_chunks_to_file(
-    buffer_iterator,
-    filename: str,
-    signal: Signal = None,
-    _json: List[Union[
-        int,
-        typing.Tuple[str, List[int]]
-    ]] = None,
-    prev: typing.Optional[bytes] = None,
-    debug: Callable[[str], None] = lambda s: None,
-) -> bool:
-    if not signal: signal = Signal(exist=False)
-    signal.wait()
-    debug(f"Save chunks to the file {filename} start")
-    try:
-        with open(filename, 'wb') as f:
-            signal.wait()
-            if prev:
-                f.write(prev)
-                del prev
-
-            for buffer in buffer_iterator:
-                if buffer.HasField('block'):
-                    save_chunks_to_block(
-                        block_buffer=buffer,
-                        buffer_iterator=buffer_iterator,
-                        signal=signal,
-                        _json=_json,
-                        debug=debug
-                    )
-                    return False
-                f.write(buffer.chunk)
-            debug(f"Save chunks to the file {filename} ends")
-            return True
-    except Exception as e:
-        debug(f"Exception saving chunks to file {filename}: {e}")
-        raise e  # TODO Should be return False ??
+            self.file.write(chunk)
+
+    def open_block(self, block_id: str, block: buffer_pb2.Buffer.Block):
+        if self.block_id:
+            return  # Its content is part of the outer block.
+        self.block_id = block_id
+        self._json.append((block_id, list(block.previous_lengths_position)))
+        self.file.close()
+        self.file = None
+        if block_exists(block_id):
+            signal_block_buffer_stream(block_id, signal=self.signal)
+            if self.instrumentation:
+                self.instrumentation.count('blocks_skipped')
+        else:
+            self.signal.wait()
+            self.block_file = Enviroment.block_dir + block_id
+            self.file = open(self.block_file, 'wb')
+
+    def close_block(self, block_id: str):
+        if block_id != self.block_id:
+            return
+        if self.file:
+            self.file.close()
+        self.block_id, self.block_file = None, None
+        self.open_part()
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        # A block written partially is removed from the registry.
+        if self.file:
+            self.file.close()
+        if self.block_file:
+            remove_file(self.block_file)
+
+
+class PartitionPlan:
+    """
+    Navigation of a partition model over a message type, compiled once: the descriptor, class and
+     sub plan of each field of the model, and the chain of single index partitions to follow.
+    """
+
+    def __init__(self, object_cls: Type[Message], partition: buffer_pb2.Buffer.Head.Partition):
+        self.object_cls: Type[Message] = object_cls
+        # Field number -> (field descriptor, field class, sub plan or None if all the field is on the partition)
+        self.fields: Dict[int, typing.Tuple[FieldDescriptor, type, typing.Optional[PartitionPlan]]] = {}
+        for index, sub_partition in partition.index.items():
+            field: typing.Optional[FieldDescriptor] = object_cls.DESCRIPTOR.fields_by_number.get(index)
+            if not field:
+                raise Exception('gRPCbb partition error: ' + object_cls.DESCRIPTOR.full_name +
+                                ' has not the field ' + str(index))
+            field_cls: type = GetMessageClass(field.message_type) if field.message_type \
+                else type(field.default_value)
+            if len(sub_partition.index) > 0 and not field.message_type:
+                raise Exception('gRPCbb partition error: ' + field.full_name + ' is not a message.')
+            self.fields[index] = (
+                field, field_cls,
+                PartitionPlan(field_cls, sub_partition) if len(sub_partition.index) > 0 else None
+            )
+
+        # A single index partition contains only the value of its field.
+        self.chain: List[FieldDescriptor] = []
+        self.anchor: typing.Optional[PartitionPlan] = self
+        self.anchor_cls: type = object_cls
+        while self.anchor and len(self.anchor.fields) == 1:
+            field, field_cls, sub_plan = next(iter(self.anchor.fields.values()))
+            self.chain.append(field)
+            self.anchor, self.anchor_cls = sub_plan, field_cls
+
+    def prune(self, obj: Message):
+        for field, value in obj.ListFields():
+            if field.number not in self.fields:
+                obj.ClearField(field.name)
+                continue
+            sub_plan: typing.Optional[PartitionPlan] = self.fields[field.number][2]
+            if sub_plan and field.label == FieldDescriptor.LABEL_REPEATED:
+                for element in value:
+                    sub_plan.prune(element)
+            elif sub_plan:
+                sub_plan.prune(value)
+
+
+partition_plans: Dict[typing.Tuple[type, bytes], PartitionPlan] = {}
+
+
+def get_partition_plan(object_cls: Type[Message], partition: buffer_pb2.Buffer.Head.Partition) -> PartitionPlan:
+    key: typing.Tuple[type, bytes] = (object_cls, partition.SerializeToString(deterministic=True))
+    if key not in partition_plans:
+        partition_plans[key] = PartitionPlan(object_cls=object_cls, partition=partition)
+    return partition_plans[key]
 
 
 def get_subclass(partition, object_cls):
-    return get_subclass(
-        object_cls=type(
-            getattr(
-                object_cls(),
-                object_cls.DESCRIPTOR.fields_by_number[list(partition.index.keys())[0]].name
-            )
-        ),
-        partition=list(partition.index.values())[0]
-    ) if len(partition.index) == 1 else object_cls
+    return get_partition_plan(object_cls=object_cls, partition=partition).anchor_cls \
+        if len(partition.index) == 1 else object_cls
 
 
 def copy_message(obj, field_name, message):  # TODO for list too.
@@ -271,31 +565,11 @@ def copy_message(obj, field_name, message):  # TODO for list too.
 def get_submessage(partition, obj, say_if_not_change=False):
     if len(partition.index) == 0:
         return False if say_if_not_change else obj
-    if len(partition.index) == 1:
-        for field in obj.DESCRIPTOR.fields:
-            if field.index + 1 not in partition.index:
-                obj.ClearField(field.name)
-        return get_submessage(
-            partition=list(partition.index.values())[0],
-            obj=getattr(obj, obj.DESCRIPTOR.fields[list(partition.index.keys())[0] - 1].name)
-        )
-    for field in obj.DESCRIPTOR.fields:
-        if field.index + 1 in partition.index:
-            try:
-                submessage = get_submessage(
-                    partition=partition.index[field.index + 1],
-                    obj=getattr(obj, field.name),
-                    say_if_not_change=True
-                )
-                if not submessage: continue  # Anything to prune.
-                copy_message(
-                    obj=obj, field_name=field.name,
-                    message=submessage
-                )
-            except:
-                pass
-        else:
-            obj.ClearField(field.name)
+    plan: PartitionPlan = get_partition_plan(object_cls=type(obj), partition=partition)
+    for field in plan.chain:
+        obj = getattr(obj, field.name)
+    if plan.anchor:
+        plan.anchor.prune(obj)
     return obj
 
 
@@ -305,23 +579,27 @@ def put_submessage(partition, message, obj):
             obj=obj, field_name=None,
             message=message
         )
-    if len(partition.index) == 1:
-        p = list(partition.index.values())[0]
-        if len(p.index) == 1:
-            field_name = obj.DESCRIPTOR.fields[list(partition.index.keys())[0] - 1].name
-            return copy_message(
-                obj=obj, field_name=field_name,
-                message=put_submessage(
-                    partition=p,
-                    obj=getattr(obj, field_name),
-                    message=message,
-                )
-            )
+    plan: PartitionPlan = get_partition_plan(object_cls=type(obj), partition=partition)
+    container = obj
+    for field in plan.chain[:-1]:
+        container = getattr(container, field.name)
+
+    if plan.chain and not plan.chain[-1].message_type:
+        setattr(container, plan.chain[-1].name,
+                message.decode('utf-8') if plan.anchor_cls is str and type(message) is bytes else message)
+    elif plan.anchor:
+        # The partition only has some fields of the message, merge them with the other partitions.
+        target = getattr(container, plan.chain[-1].name) if plan.chain else container
+        if type(message) is bytes:
+            target.MergeFromString(message)
         else:
-            return copy_message(
-                obj=obj, field_name=obj.DESCRIPTOR.fields[list(partition.index.keys())[0] - 1].name,
-                message=message
-            )
+            target.MergeFrom(message)
+    else:
+        copy_message(
+            obj=container, field_name=plan.chain[-1].name,
+            message=message
+        )
+    return obj
 
 
 def combine_partitions(
@@ -337,8 +615,7 @@ def combine_partitions(
         elif type(partition) is str and os.path.isdir(partition):
             with open(partition + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME, 'rb') as f:
                 partition: bytes = f.read()
-        elif not (hasattr(partition, 'SerializeToString') or not type(
-                partition) is bytes):  # TODO check.   'not type(partition) is bytes' could affect on partitions to buffer()
+        elif not (hasattr(partition, 'SerializeToString') or type(partition) is bytes):
             raise Exception('Partitions to buffer error.')
         obj = put_submessage(
             partition=partitions_model[i],
@@ -348,13 +625,72 @@ def combine_partitions(
     return obj
 
 
+def combine_partitions_to_dir(
+        obj_cls: Type[Message],
+        partitions_model: tuple,
+        partitions: typing.Tuple[Union[str, Dir, bytes, Message]],
+        filename: typing.Optional[str] = None
+) -> Dir:
+    """
+    Merges the partitions on a single file, copying the partition files with disk_stream instead of
+     loading them on memory. The message is only parsed when it's asked for, with parse_dir.
+    """
+    if not filename:
+        filename = generate_random_file()
+    dirs: List[str] = []
+    temporal_files: List[str] = []
+    try:
+        for partition in partitions:
+            if type(partition) is Dir:
+                partition: str = partition.dir
+            if type(partition) is str and os.path.isfile(partition):
+                dirs.append(partition)
+            elif type(partition) is str and os.path.isdir(partition):
+                dirs.append(partition + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME)
+            elif hasattr(partition, 'SerializeToString') or type(partition) is bytes:
+                temporal_files.append(generate_random_file())
+                with open(temporal_files[-1], 'wb') as f:
+                    f.write(message_to_bytes(partition))
+                dirs.append(temporal_files[-1])
+            else:
+                raise Exception('Partitions to buffer error.')
+
+        write_partition_disk_stream(
+            dirs=dirs,
+            partitions=list(partitions_model),
+            filename=filename
+        )
+    finally:
+        for file in temporal_files:
+            remove_file(file)
+    return Dir(dir=filename, _type=obj_cls)
+
+
+def parse_dir(_dir: Dir, fields: typing.Optional[List[int]] = None) -> Message:
+    """
+    Parses the message of a Dir. If fields are given only those top level fields are read from disk.
+    """
+    filename: str = _dir.dir + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME if os.path.isdir(_dir.dir) else _dir.dir
+    message: Message = _dir.type()
+    with open(filename, 'rb') as f:
+        if fields is None:
+            message.ParseFromString(f.read())
+        else:
+            for field, start, _, end in scan_records(f, 0, os.path.getsize(filename)):
+                if field in fields:
+                    f.seek(start)
+                    message.MergeFromString(f.read(end - start))
+    return message
+
+
 def parse_from_buffer(
         request_iterator,
         signal: Signal = None,
         indices: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
-        partitions_message_mode: Union[bool, Dict[int, bool]] = False,  # Write on disk by default.
+        partitions_message_mode: Union[bool, None, Dict[int, typing.Optional[bool]]] = False,  # Write on disk by default, None chooses by the memory budget.
         mem_manager=None,
         debug: Callable[[str], None] = lambda s: None,
+        instrumentation: typing.Optional[Instrumentation] = None,
 ):
     try:
         debug("Starting parse_from_buffer")
@@ -367,6 +703,8 @@ def parse_from_buffer(
         if not mem_manager:
             debug("mem_manager not provided, using Enviroment.mem_manager")
             mem_manager = Enviroment.mem_manager
+        if instrumentation is None:
+            instrumentation = Enviroment.instrumentation
         if type(indices) is not dict:
             debug(f"Indices is not a dict, checking if it's a subclass of Message: {indices}")
             if issubclass(indices, Message):
@@ -380,8 +718,8 @@ def parse_from_buffer(
         indices.update({0: bytes})
         debug(f"Updated indices: {indices}")
 
-        if type(partitions_message_mode) is bool:
-            debug(f"partitions_message_mode is bool, creating dict for all indices: {indices.keys()}")
+        if type(partitions_message_mode) is bool or partitions_message_mode is None:
+            debug(f"partitions_message_mode is bool or None, creating dict for all indices: {indices.keys()}")
             partitions_message_mode = {i: partitions_message_mode for i in indices}
         elif type(partitions_message_mode) is dict:
             debug("partitions_message_mode is dict, updating missing keys")
@@ -403,116 +741,27 @@ def parse_from_buffer(
         raise Exception(f'Parse from buffer error: Partitions or Indices are not correct. '
                         f'{partitions_message_mode} - {indices} - {str(e)}')
 
-    def parser_iterator(
-            request_iterator_obj,
-            signal_obj: Signal = None,
-            blocks: List[str] = None
-    ) -> Generator[buffer_pb2.Buffer, None, None]:
-        debug("Starting parser_iterator")
-        if not signal_obj:
-            debug("signal_obj not provided, creating new Signal")
-            signal_obj = Signal(exist=False)
-        _break: bool = True
-        while _break:
-            try:
-                debug("Fetching next buffer_obj")
-                buffer_obj = next(request_iterator_obj)
-                debug(f"Buffer_obj fetched with len: {len(buffer_obj)}")
-            except StopIteration:
-                debug("StopIteration in parser_iterator")
-                raise Exception('AbortedIteration')
-
-            if buffer_obj.HasField('signal') and buffer_obj.signal:
-                debug("Field 'signal' detected, changing signal_obj state")
-                signal_obj.change()
-
-            if not blocks and buffer_obj.HasField('block') or \
-                    blocks and buffer_obj.HasField('block') and len(blocks) < Enviroment.block_depth:
-                debug("Block handling detected")
-                block_hash: str = get_hash_from_block(buffer_obj.block)
-                debug(f"Block hash calculated: {block_hash}")
-
-                if block_hash:
-                    if blocks and block_hash in blocks:
-                        debug(f"Block {block_hash} already exists in blocks")
-                        if blocks.pop() == block_hash:
-                            debug(f"Block {block_hash} removed from blocks")
-                            break
-                        else:
-                            debug("Error: Block intersections are not allowed")
-                            raise Exception('gRPCbb: IntersectionError: Intersections between blocks are not allowed.')
-                    else:
-                        debug(f"Adding block {block_hash} to blocks")
-                        if not blocks:
-                            blocks = [block_hash]
-                        else:
-                            blocks.append(block_hash)
-
-                        if block_exists(block_hash):
-                            debug(f"Block {block_hash} exists, signaling stop")
-                            signal_block_buffer_stream(block_hash)  # Send the sub-buffer stop signal
-
-                        debug(f"Yielding buffer_obj for block {block_hash}")
-                        yield buffer_obj
-                        debug("Recursively iterating into sub-block")
-                        for block_chunk in parser_iterator(
-                                request_iterator_obj=request_iterator_obj,
-                                signal_obj=signal_obj,
-                                blocks=blocks
-                        ):
-                            yield block_chunk
-
-            if buffer_obj.HasField('chunk'):
-                debug("Yielding normal chunk")
-                yield buffer_obj
-            elif not buffer_obj.HasField('head'):
-                debug("Buffer has no 'head', ending iteration")
-                break
-            if buffer_obj.HasField('separator') and buffer_obj.separator:
-                debug("Separator detected, ending iteration")
-                break
-
-    def parse_message(message_field, _request_iterator, _signal: Signal):
+    def parse_message(message_field, stream: BufferStream, spill: bool = False):
         debug(f"Starting parse_message for message_field: {message_field}")
-        all_buffer: bytes = b''
-        in_block: typing.Optional[str] = None
-        for b in parser_iterator(
-                request_iterator_obj=_request_iterator,
-                signal_obj=_signal,
-        ):
-            debug(f"Processing element in parse_message: {b}")
-            if b.HasField('block'):
-                block_id: str = get_hash_from_block(block=b.block)
-                debug(f"Block detected: {block_id}")
-                if block_id == in_block:
-                    debug(f"Exiting block {block_id}")
-                    in_block = None
-                elif not in_block and block_exists(block_id=block_id):
-                    debug(f"Entering existing block {block_id}")
-                    in_block = block_id
-                    debug("Reading existing blocks")
-                    all_buffer += b''.join([c for c in read_block(block_id=block_id) if type(c) is bytes])
-                    continue
-
-            if not in_block:
-                debug(f"Adding chunk of size {len(b.chunk)}")
-                all_buffer += b.chunk
-                debug(f"Total buffer size: {len(all_buffer)}")
-
-        debug(f"Finished accumulating buffer. Total size: {len(all_buffer)}")
-        if len(all_buffer) == 0:
-            debug("Empty buffer, raising EmptyBufferException")
-            raise EmptyBufferException()
+        with mem_manager(len=0) as mem:
+            sink = MessageChunks(mem=mem, spill=spill, signal=signal, instrumentation=instrumentation)
+            feed_message(stream=stream, sink=sink)
+            all_buffer: bytes = b''.join(sink.chunks)
+            del sink
+            debug(f"Finished accumulating buffer. Total size: {len(all_buffer)}")
+            if len(all_buffer) == 0:
+                debug("Empty buffer, raising EmptyBufferException")
+                raise EmptyBufferException()
+            return decode_message(message_field=message_field, all_buffer=all_buffer)
+
+    def decode_message(message_field, all_buffer: bytes):
         if message_field is str:
-            debug("Converting buffer to string")
             return all_buffer.decode('utf-8')
         elif inspect.isclass(message_field) and issubclass(message_field, Message):
-            debug(f"Parsing protobuf message: {message_field}")
             message = message_field()
             message.ParseFromString(all_buffer)
             return message
         else:
-            debug(f"Attempting to convert to primitive type: {message_field}")
             try:
                 return message_field(all_buffer)
             except Exception as e:
@@ -522,46 +771,47 @@ def parse_from_buffer(
                     'partition ' + str(
                         message_field) + str(e))
 
-    def save_to_dir(_request_iterator, _signal) -> str:
-        debug("Starting save_to_dir")
+    def parse_batch(buffer: buffer_pb2.Buffer) -> Generator:
+        # The small messages packed on the chunk, each one as if it came on its own buffer.
+        batch = buffer_pb2.Buffer.Batch.FromString(buffer.chunk)
+        debug(f"Parsing a batch of {len(batch.messages)} messages")
+        for index, all_buffer in zip(batch.indices, batch.messages):
+            if index not in indices:
+                raise Exception(
+                    'Parse from buffer error: batch index is not correct ' + str(index) + str(indices.keys()))
+            message_field = indices[index]
+            if not all_buffer:
+                if message_field == buffer_pb2.Empty:
+                    yield buffer_pb2.Empty()
+                continue
+            mode = partitions_message_mode[index]
+            if mode is None or mode:
+                yield decode_message(message_field=message_field, all_buffer=all_buffer)
+            else:
+                filename: str = generate_random_file()
+                with open(filename, 'wb') as f:
+                    f.write(all_buffer)
+                yield Dir(dir=filename, _type=message_field)
+
+    def save_to_dir(stream: BufferStream) -> str:
         dirname = generate_random_dir()
-        debug(f"Temporary directory created: {dirname}")
-        _i: int = 1
-        _json: List[Union[int, typing.Tuple[str, List[int]]]] = []
+        debug(f"Starting save_to_dir on {dirname}")
+        sink = MessageDir(dirname=dirname, signal=signal, instrumentation=instrumentation)
         try:
-            while True:
-                debug(f"Saving part {_i}")
-                _json.append(_i)
-                debug(f"Calling save_chunks_to_file for part {_i}")
-                if save_chunks_to_file(
-                        filename=dirname + '/' + str(_i),
-                        buffer_iterator=parser_iterator(
-                            request_iterator_obj=_request_iterator,
-                            signal_obj=_signal
-                        ),
-                        signal=_signal,
-                        _json=_json,
-                        debug=debug
-                ):
-                    debug(f"save_chunks_to_file signaled completion for part {_i}")
-                    break
-                _i += 1
-
-        except StopIteration:
-            debug("StopIteration in save_to_dir")
-            pass
-
+            feed_message(stream=stream, sink=sink)
+            sink.close()
         except Exception as e:
             debug(f"Exception in save_to_dir: {str(e)}, removing directory {dirname}")
+            sink.abort()
             remove_dir(dir=dirname)
             raise e
 
-        if len(_json) < 2:
+        if len(sink._json) < 2:
             debug("Single file detected, converting to standalone file")
             filename: str = generate_random_file()
             try:
-                debug(f"Moving {dirname}/1 to {filename}")
                 shutil.move(dirname + '/1', filename)
+                remove_dir(dir=dirname)
                 return filename
             except FileNotFoundError:
                 debug(f"Error: File {dirname}/1 not found")
@@ -570,100 +820,117 @@ def parse_from_buffer(
         else:
             debug(f"Writing metadata to {dirname}/{METADATA_FILE_NAME}")
             with open(dirname + '/' + METADATA_FILE_NAME, 'w') as f:
-                json.dump(_json, f)
+                json.dump(sink._json, f)
 
             debug("Generating WBP file")
             generate_wbp_file(dirname)
 
             return dirname  # separator break.
 
-    def iterate_message(message_field, mode: bool, _signal: Signal, _request_iterator):
+    def iterate_message(message_field, mode: typing.Optional[bool], stream: BufferStream):
+        if mode is None:
+            debug(f"Iterate_message: mode=auto, message_field={message_field}")
+            if Enviroment.memory_budget.has_headroom(CHUNK_SIZE):
+                # Parse on memory while the memory budget allows it, then spill the message to disk.
+                stream.start_recording()
+                try:
+                    message = parse_message(message_field=message_field, stream=stream, spill=True)
+                    stream.stop_recording()
+                    return message
+                except MemoryBudgetExceeded:
+                    debug(f"Spilling to disk after {len(stream.recorded)} buffers")
+                    stream.rewind()
+                except BaseException:
+                    stream.stop_recording()
+                    raise
+            mode = False
+
         debug(f"Iterate_message: mode={'parse' if mode else 'save'}, message_field={message_field}")
         if mode:
-            debug("Parse mode: parsing message in memory")
-            return parse_message(
-                message_field=message_field,
-                _request_iterator=_request_iterator,
-                _signal=_signal,
-            )
+            return parse_message(message_field=message_field, stream=stream)
         else:
-            debug("Save mode: saving to directory")
             return Dir(
-                dir=save_to_dir(
-                    _request_iterator=_request_iterator,
-                    _signal=_signal
-                ),
+                dir=save_to_dir(stream=stream),
                 _type=message_field
             )
 
     debug("Starting main iteration over request_iterator")
-    for buffer in request_iterator:
-        debug(f"Processing buffer: {buffer}")
-        if buffer.HasField('head'):
-            debug(f"Field 'head' detected with index {buffer.head.index}")
-            if buffer.head.index not in indices:
-                debug(f"Error: index {buffer.head.index} not found in indices {indices.keys()}")
-                raise Exception(
-                    'Parse from buffer error: buffer head index is not correct ' + str(buffer.head.index) + str(
-                        indices.keys()))
+    stream = BufferStream(request_iterator=request_iterator, signal=signal, instrumentation=instrumentation)
+    try:
+        while True:
+            buffer: typing.Optional[buffer_pb2.Buffer] = stream.next()
+            if buffer is None:
+                break
+            if buffer.batch:
+                yield from parse_batch(buffer=buffer)
+                continue
+            if buffer.HasField('head'):
+                index: int = buffer.head.index
+                if index not in indices:
+                    debug(f"Error: index {index} not found in indices {indices.keys()}")
+                    raise Exception(
+                        'Parse from buffer error: buffer head index is not correct ' + str(index) + str(
+                            indices.keys()))
+            else:
+                index: int = 1 if 1 in indices else 0  # Does not've more than one index and more than one partition too.
+            debug(f"Processing index {index}")
+            stream.push(buffer)
             try:
-                debug(f"Processing index {buffer.head.index}")
                 result = iterate_message(
-                    message_field=indices[buffer.head.index],
-                    mode=partitions_message_mode[buffer.head.index],
-                    _signal=signal,
-                    _request_iterator=itertools.chain([buffer], request_iterator),
+                    message_field=indices[index],
+                    mode=partitions_message_mode[index],
+                    stream=stream
                 )
-                debug(f"Yielding result for index {buffer.head.index}")
-                yield result
             except EmptyBufferException:
-                debug("EmptyBufferException caught")
-                if indices[1] == buffer_pb2.Empty:
-                    debug("Yielding buffer_pb2.Empty()")
+                debug(f"EmptyBufferException for index {index}")
+                if indices[index] == buffer_pb2.Empty:
                     yield buffer_pb2.Empty()
-                else:
-                    debug("Continuing without yield")
-                    continue
+                continue
+            yield result
+    finally:
+        stream.close()
 
-        elif 1 in indices:  # Does not've more than one index and more than one partition too.
-            debug("Processing default index 1")
-            try:
-                result = iterate_message(
-                    message_field=indices[1],
-                    mode=partitions_message_mode[1],
-                    _signal=signal,
-                    _request_iterator=itertools.chain([buffer], request_iterator),
-                )
-                debug("Yielding result for index 1")
-                yield result
-            except EmptyBufferException:
-                debug("EmptyBufferException for index 1")
-                if indices[1] == buffer_pb2.Empty:
-                    yield buffer_pb2.Empty()
-                else:
-                    continue
 
-        elif 0 in indices:  # always true
-            debug("Processing default index 0")
-            try:
-                result = iterate_message(
-                    message_field=indices[0],
-                    mode=partitions_message_mode[0],
-                    _signal=signal,
-                    _request_iterator=itertools.chain([buffer], request_iterator),
-                )
-                debug("Yielding result for index 0")
-                yield result
-            except EmptyBufferException:
-                debug("EmptyBufferException for index 0")
-                if indices[0] == buffer_pb2.Empty:
-                    yield buffer_pb2.Empty()
-                else:
-                    continue
+def get_serializer_indices(
+        message_iterator,
+        indices: Union[Message, Dict[int, Union[Type[bytes], Message]]],
+        debug: Callable[[str], None] = lambda s: None
+) -> typing.Tuple[Dict[type, int], typing.Iterator]:
+    """
+    Returns the indices by message type, and the message iterator (the first message could be
+     extracted to know its type).
+    """
+    debug(f"Initial indices: {indices}")
 
+    if type(indices) is not dict:
+        if issubclass(indices, Message):
+            indices = {1: indices}
+            debug(f"indices is a Message subclass, updated to: {indices}")
         else:
-            debug(f"Error: Invalid indices: {indices}")
-            raise Exception('Parse from buffer error: index are not correct ' + str(indices))
+            raise Exception("Indices must be a dict or a Message subclass")
+
+    indices.update({0: bytes})
+    debug(f"indices updated with 0: bytes: {indices}")
+
+    if not hasattr(message_iterator, '__iter__'):
+        message_iterator = itertools.chain([message_iterator])
+        debug("message_iterator is not iterable, converted to itertools.chain")
+
+    if len(indices) == 1:  # Only 've {0: bytes}
+        first_message = next(message_iterator)  # Extract the first message to send.
+        debug(f"First message of type: {type(first_message).__name__}")
+        if type(first_message) is Dir and first_message.type != bytes:  # If the message is Dir and it's not bytes
+            indices.update({1: first_message.type})
+            debug(f"first_message is a Dir, indices updated: {indices}")
+        elif issubclass(type(first_message), Message):  # If the message is a proto Message type
+            indices.update({1: type(first_message)})
+            debug(f"first_message is a Message subclass, indices updated: {indices}")
+        message_iterator = itertools.chain([first_message], message_iterator)
+        debug("message_iterator updated with first_message")
+
+    indices = {e[1]: e[0] for e in indices.items()}
+    debug(f"Final indices: {indices}")
+    return indices, message_iterator
 
 
 def serialize_to_buffer(
@@ -671,7 +938,9 @@ def serialize_to_buffer(
         signal=None,
         indices: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
         mem_manager=None,
-        debug: Callable[[str], None] = lambda s: None  # Debug function
+        debug: Callable[[str], None] = lambda s: None,  # Debug function
+        instrumentation: typing.Optional[Instrumentation] = None,
+        batch: typing.Optional[bool] = None  # Pack small messages, None if the peer decodes batches.
 ) -> Generator[buffer_pb2.Buffer, None, None]:  # method: indice
     try:
         debug("Entering serialize_to_buffer")  # Log entry
@@ -688,37 +957,14 @@ def serialize_to_buffer(
         if not mem_manager:
             mem_manager = Enviroment.mem_manager
             debug("mem_manager is None, initialized to Enviroment.mem_manager")
+        if instrumentation is None:
+            instrumentation = Enviroment.instrumentation
 
-        debug(f"Initial indices: {indices}")
-
-        if type(indices) is not dict:
-            if issubclass(indices, Message):
-                indices = {1: indices}
-                debug(f"indices is a Message subclass, updated to: {indices}")
-            else:
-                raise Exception("Indices must be a dict or a Message subclass") 
-
-        indices.update({0: bytes})
-        debug(f"indices updated with 0: bytes: {indices}")
-
-        if not hasattr(message_iterator, '__iter__'):
-            message_iterator = itertools.chain([message_iterator])
-            debug("message_iterator is not iterable, converted to itertools.chain")
-
-        if len(indices) == 1:  # Only 've {0: bytes}
-            first_message = next(message_iterator)  # Extract the first message to send.
-            debug(f"First message: {first_message}")
-            if type(first_message) is Dir and first_message.type != bytes:  # If the message is Dir and it's not bytes
-                indices.update({1: first_message.type})
-                debug(f"first_message is a Dir, indices updated: {indices}")
-            elif issubclass(type(first_message), Message):  # If the message is a proto Message type
-                indices.update({1: type(first_message)})
-                debug(f"first_message is a Message subclass, indices updated: {indices}")
-            message_iterator = itertools.chain([first_message], message_iterator)
-            debug("message_iterator updated with first_message")
-
-        indices = {e[1]: e[0] for e in indices.items()}
-        debug(f"Final indices: {indices}")
+        indices, message_iterator = get_serializer_indices(
+            message_iterator=message_iterator,
+            indices=indices,
+            debug=debug
+        )
 
     except Exception as e:
         error_message = f'Serialzie to buffer error: Indices are not correct {str(indices)} - {str(e)}'
@@ -730,15 +976,11 @@ def serialize_to_buffer(
         yield buffer_pb2.Buffer(
             head=_head
         )
-        for _b in read_from_registry(
-                filename=filedir,
-                signal=_signal
-        ):
-            _signal.wait()
-            try:
-                yield _b
-            finally:
-                _signal.wait()
+        yield from read_from_registry(
+            filename=filedir,
+            signal=_signal,
+            instrumentation=instrumentation
+        )
         yield buffer_pb2.Buffer(
             separator=True
         )
@@ -749,14 +991,22 @@ def serialize_to_buffer(
             _head: buffer_pb2.Buffer.Head = None,
             _mem_manager=Enviroment.mem_manager,
     ) -> Generator[buffer_pb2.Buffer, None, None]:
-        debug(f"Sending message: {_message}")
-        message_bytes = message_to_bytes(message=_message)
-        if len(message_bytes) < CHUNK_SIZE and (
-                not isinstance(_message, Message) or
-                isinstance(_message, Message) and not contain_blocks(message=_message)
-        ):
-            _signal.wait()
-            try:
+        debug(f"Sending message of type: {type(_message).__name__}")
+        sizes: typing.Optional[WireSizes] = None
+        if isinstance(_message, Message):
+            # The sizes of the submessages are only computed for the messages that are chunked.
+            size: typing.Optional[int] = small_byte_size(message=_message)
+            if size is None:
+                sizes = WireSizes(message=_message)
+                size = sizes.total
+        else:
+            message_bytes = message_to_bytes(message=_message)
+            size: int = len(message_bytes)
+
+        if size < CHUNK_SIZE and (not isinstance(_message, Message) or not contain_blocks(message=_message)):
+            with _mem_manager(len=size):
+                if isinstance(_message, Message):
+                    message_bytes = _message.SerializeToString()
                 yield buffer_pb2.Buffer(
                     chunk=bytes(message_bytes),
                     head=_head,
@@ -765,58 +1015,83 @@ def serialize_to_buffer(
                     chunk=bytes(message_bytes),
                     separator=True
                 )
-            finally:
-                _signal.wait()
+            return
 
-        else:
-            try:
-                if _head:
-                    yield buffer_pb2.Buffer(
-                        head=_head
-                    )
-            finally:
+        if _head:
+            yield buffer_pb2.Buffer(
+                head=_head
+            )
+
+        # Only a chunk of the serialized message is held on memory at once.
+        chunks = iter_wire_chunks(message=_message, sizes=sizes) if isinstance(_message, Message) else \
+            (memoryview(message_bytes)[i:i + CHUNK_SIZE] for i in range(0, size, CHUNK_SIZE))
+        if instrumentation:
+            chunks = measure_serialization(chunks=chunks, instrumentation=instrumentation)
+        with _mem_manager(len=min(size, CHUNK_SIZE)):
+            for chunk in chunks:
                 _signal.wait()
+                yield buffer_pb2.Buffer(chunk=bytes(chunk))
 
-            _signal.wait()
-            file = generate_random_file()
-            with open(file, 'wb') as f, _mem_manager(len=len(message_bytes)):
-                f.write(message_bytes)
-            try:
-                yield from read_from_registry(
-                    filename=file,
-                    signal=_signal
-                )
-            finally:
-                remove_file(file)
+        yield buffer_pb2.Buffer(
+            separator=True
+        )
 
-            try:
-                yield buffer_pb2.Buffer(
-                    separator=True
+    def send_batch(_indices: List[int], _messages: List[bytes]) -> buffer_pb2.Buffer:
+        debug(f"Sending a batch of {len(_messages)} messages")
+        return buffer_pb2.Buffer(
+            chunk=buffer_pb2.Buffer.Batch(indices=_indices, messages=_messages).SerializeToString(),
+            batch=True
+        )
+
+    def send_messages() -> Generator[buffer_pb2.Buffer, None, None]:
+        # Small messages are packed on the chunk of a batch buffer, up to a chunk, while the peer decodes them.
+        batch_indices: List[int] = []
+        batch_messages: List[bytes] = []
+        batch_size: int = 0
+        for message in message_iterator:
+            debug(f"Processing message of type: {type(message).__name__}") # Log each message being processed
+            if type(message) is not Dir and (batch or batch is None and signal.peer_reads_batches) and \
+                    (message.ByteSize() if isinstance(message, Message) else len(message)) \
+                    < CHUNK_SIZE - BATCH_RECORD_OVERHEAD and \
+                    (not isinstance(message, Message) or not contain_blocks(message=message)):
+                message_bytes = message_to_bytes(message=message)
+                if len(message_bytes) < CHUNK_SIZE - BATCH_RECORD_OVERHEAD:
+                    if batch_size + len(message_bytes) + BATCH_RECORD_OVERHEAD > CHUNK_SIZE:
+                        yield send_batch(_indices=batch_indices, _messages=batch_messages)
+                        batch_indices, batch_messages, batch_size = [], [], 0
+                    batch_indices.append(indices[type(message)])
+                    batch_messages.append(bytes(message_bytes))
+                    batch_size += len(message_bytes) + BATCH_RECORD_OVERHEAD
+                    continue
+            if batch_messages:
+                yield send_batch(_indices=batch_indices, _messages=batch_messages)
+                batch_indices, batch_messages, batch_size = [], [], 0
+
+            if type(message) is Dir:
+                debug(f"Message is a Dir, sending file: {message.dir}")
+                yield from send_file(
+                    _head=buffer_pb2.Buffer.Head(
+                        index=indices[message.type]
+                    ),
+                    filedir=message.dir,
+                    _signal=signal
                 )
-            finally:
-                _signal.wait()
+            else:
+                debug("Message is not a Dir, sending message")
+                yield from send_message(
+                    _signal=signal,
+                    _message=message,
+                    _head=buffer_pb2.Buffer.Head(
+                        index=indices[type(message)]
+                    ),
+                    _mem_manager=mem_manager,
+                )
+        if batch_messages:
+            yield send_batch(_indices=batch_indices, _messages=batch_messages)
 
-    for message in message_iterator:
-        debug(f"Processing message: {message}") # Log each message being processed
-        if type(message) is Dir:
-            debug(f"Message is a Dir, sending file: {message.dir}")
-            yield from send_file(
-                _head=buffer_pb2.Buffer.Head(
-                    index=indices[message.type]
-                ),
-                filedir=message.dir,
-                _signal=signal
-            )
-        else:
-            debug(f"Message is not a Dir, sending message: {message}")
-            yield from send_message(
-                _signal=signal,
-                _message=message,
-                _head=buffer_pb2.Buffer.Head(
-                    index=indices[type(message)]
-                ),
-                _mem_manager=mem_manager,
-            )
+    buffers = send_with_credits(buffers=send_messages(), signal=signal, instrumentation=instrumentation)
+    yield from measure_stream(buffers=buffers, instrumentation=instrumentation, direction='sent') \
+        if instrumentation else buffers
     debug("Exiting serialize_to_buffer") # Log exit
 
 
@@ -828,7 +1103,8 @@ def client_grpc(
         partitions_message_mode_parser: Union[bool, list, dict] = None,
         indices_serializer: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
         mem_manager=None,
-        debug: Callable[[str], None]=lambda s: None
+        debug: Callable[[str], None]=lambda s: None,
+        batch_serializer: typing.Optional[bool] = None
 ):  # indice: method
     if not indices_parser:
         indices_parser = buffer_pb2.Empty
@@ -836,7 +1112,7 @@ def client_grpc(
     if not partitions_message_mode_parser: partitions_message_mode_parser = False
     if not indices_serializer: indices_serializer = {}
     if not mem_manager: mem_manager = Enviroment.mem_manager
-    signal = Signal()
+    signal = Signal(window=FLOW_CONTROL_WINDOW)
     yield from parse_from_buffer(
         request_iterator=method(
             serialize_to_buffer(
@@ -844,7 +1120,8 @@ def client_grpc(
                 signal=signal,
                 indices=indices_serializer,
                 mem_manager=mem_manager,
-                debug=debug
+                debug=debug,
+                batch=batch_serializer
             ),
             timeout=timeout
         ),
@@ -855,17 +1132,137 @@ def client_grpc(
     )
 
 
+# A bee record is a buffer without its chunk, and the chunk apart, on memory or as a (filename, offset, length) range.
+BeeRecord = typing.Tuple[buffer_pb2.Buffer, typing.Optional[Union[bytes, memoryview, typing.Tuple[str, int, int]]]]
+
+
+def get_bee_records(message, index: int) -> Generator[BeeRecord, None, None]:
+    """
+    Yields the same buffers that serialize_to_buffer sends for the message, without copying the
+     chunks of in memory messages or reading the chunks of Dir files.
+    """
+    head = buffer_pb2.Buffer.Head(index=index)
+    if type(message) is Dir:
+        yield buffer_pb2.Buffer(head=head), None
+        for c in read_registry_ranges(filename=message.dir):
+            yield (buffer_pb2.Buffer(), c) if type(c) is tuple else (buffer_pb2.Buffer(block=c), None)
+        yield buffer_pb2.Buffer(separator=True), None
+
+    else:
+        message_bytes = memoryview(message_to_bytes(message=message))
+        if len(message_bytes) < CHUNK_SIZE and (
+                not isinstance(message, Message) or not contain_blocks(message=message)
+        ):
+            yield buffer_pb2.Buffer(head=head, separator=True), message_bytes
+        else:
+            yield buffer_pb2.Buffer(head=head), None
+            for i in range(0, len(message_bytes), CHUNK_SIZE):
+                yield buffer_pb2.Buffer(), message_bytes[i:i + CHUNK_SIZE]
+            yield buffer_pb2.Buffer(separator=True), None
+
+
+def get_bee_record_layout(record: BeeRecord) -> typing.Tuple[bytes, typing.Optional[int], bytes]:
+    """
+    Returns the length prefix with the chunk tag and length, the chunk length and the serialized
+     rest of the buffer. The chunk is the first field of a serialized buffer, so it goes between them.
+    """
+    buff, chunk = record
+    suffix: bytes = buff.SerializeToString()
+    if chunk is None:
+        return len(suffix).to_bytes(4, byteorder='big'), None, suffix
+    chunk_length: int = chunk[2] if type(chunk) is tuple else len(chunk)
+    chunk_header: bytes = b'\x0a' + encode_bytes(chunk_length)
+    return (len(chunk_header) + chunk_length + len(suffix)).to_bytes(4, byteorder='big') + chunk_header, \
+        chunk_length, suffix
+
+
+class BeeFileWriter:
+    """
+    Writes at a given offset of a file descriptor. The data is batched on a list of buffers written
+     with a single pwritev call, and file ranges are copied with copy_file_range. Since each writer
+     has its own offset, several writers can fill different parts of the same file in parallel.
+    """
+
+    def __init__(self, fd: int, offset: int, buffer_size: int = 16 * CHUNK_SIZE):
+        self.fd: int = fd
+        self.offset: int = offset
+        self.buffer_size: int = buffer_size
+        self.pending: List[Union[bytes, memoryview]] = []
+        self.pending_size: int = 0
+        self.sources: Dict[str, int] = {}
+
+    def write(self, data: Union[bytes, memoryview]):
+        if len(data) == 0:
+            return
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.buffer_size or len(self.pending) >= 1024:  # 1024 is the usual IOV_MAX.
+            self.flush()
+
+    def write_range(self, filename: str, offset: int, length: int):
+        self.flush()
+        if filename not in self.sources:
+            self.sources[filename] = os.open(filename, os.O_RDONLY)
+        self.offset += copy_file_range(self.sources[filename], self.fd, offset, length, dst_offset=self.offset)
+
+    def write_record(self, record: BeeRecord):
+        prefix, chunk_length, suffix = get_bee_record_layout(record=record)
+        self.write(prefix)
+        chunk = record[1]
+        if type(chunk) is tuple:
+            self.write_range(*chunk)
+        elif chunk is not None:
+            self.write(chunk)
+        self.write(suffix)
+
+    def flush(self):
+        while self.pending:
+            if hasattr(os, 'pwritev'):
+                n: int = os.pwritev(self.fd, self.pending, self.offset)
+            else:
+                n: int = os.pwrite(self.fd, b''.join(self.pending), self.offset)
+            self.offset += n
+            while n > 0:
+                if len(self.pending[0]) <= n:
+                    n -= len(self.pending.pop(0))
+                else:
+                    self.pending[0] = memoryview(self.pending[0])[n:]
+                    n = 0
+        self.pending_size = 0
+
+    def close(self):
+        self.flush()
+        for fd in self.sources.values():
+            os.close(fd)
+        self.sources = {}
+
+
+def write_bee_records(fd: int, offset: int, records: List[BeeRecord]):
+    writer = BeeFileWriter(fd=fd, offset=offset)
+    try:
+        for record in records:
+            writer.write_record(record=record)
+    finally:
+        writer.close()
+
+
 def write_to_file(
         path: str,
         file_name: str,
         input=None,
         indices: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
         mem_manager=None,
-        extension: str="bee"
+        extension: str="bee",
+        version: int = 1,
+        workers: int = 1
 ) -> str:
     """
     Writes serialized data to a binary file with a `.bee` extension.
     Each serialized message is prefixed by its length (4 bytes, big-endian).
+    Version 2 files start with a magic number and end with a json index of the messages, chunks
+    and blocks, followed by its length (8 bytes, big-endian) and the magic number again.
+    The buffers are the same that serialize_to_buffer generates, but their writes are batched and
+    the chunks of Dir inputs are copied from their files with copy_file_range.
     Args:
         path (str): The directory path where the file will be created.
         file_name (str): The name of the output file (without the `.bee` extension).
@@ -875,6 +1272,9 @@ def write_to_file(
                              serialization. Defaults to `None`.
         mem_manager (optional): A memory manager for resource handling during 
                                  serialization. Defaults to `None`.
+        version (int, optional): The `.bee` format version, 1 or 2. Defaults to 1, which older readers can read.
+        workers (int, optional): Number of input messages written in parallel, each one on its own
+                                 range of the file. Defaults to 1.
     Returns:
         str: The full path to the output `.bee` file that was created.
     """
@@ -884,31 +1284,212 @@ def write_to_file(
     # Ensure the output directory exists
     os.makedirs(path, exist_ok=True)
 
-    # Open the output file in write-binary mode
-    with open(output_file, 'wb') as f:
-        for buff in serialize_to_buffer(
-                message_iterator=input if input else buffer_pb2.Empty(),
-                indices=indices,
-                mem_manager=mem_manager
-            ):
-            # Serialize the buffer
-            serialized_data = buff.SerializeToString()
-            
-            # Get the size of the serialized data
-            size = len(serialized_data)
-            
-            # Write the size as a 4-byte big-endian integer
-            f.write(size.to_bytes(4, byteorder='big'))
-            
-            # Write the serialized message
-            f.write(serialized_data)
+    if not mem_manager: mem_manager = Enviroment.mem_manager
+    indices, message_iterator = get_serializer_indices(
+        message_iterator=input if input else buffer_pb2.Empty(),
+        indices=indices if indices else {}
+    )
+
+    bee_index = BeeFileIndex()
+    fd: int = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        offset: int = 0
+        if version == 2:
+            offset += os.pwrite(fd, BEE_FILE_MAGIC, offset)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            jobs = []
+            for message in message_iterator:
+                records: List[BeeRecord] = list(get_bee_records(
+                    message=message,
+                    index=indices[message.type if type(message) is Dir else type(message)]
+                ))
+                # The offset of each message is known before writing it, from its record sizes.
+                start: int = offset
+                buffered: int = 0  # The chunks of Dir inputs are copied between files, not held on memory.
+                for record in records:
+                    prefix, chunk_length, suffix = get_bee_record_layout(record=record)
+                    size: int = len(prefix) - 4 + (chunk_length or 0) + len(suffix)
+                    bee_index.add(buff=record[0], offset=offset, size=size, chunk_length=chunk_length)
+                    offset += 4 + size
+                    buffered += 4 + size - (chunk_length if type(record[1]) is tuple else 0)
+
+                if workers > 1:
+                    jobs.append(executor.submit(write_bee_records, fd, start, records))
+                else:
+                    with mem_manager(len=buffered):
+                        write_bee_records(fd=fd, offset=start, records=records)
+            for job in jobs:
+                job.result()
+
+        if version == 2:
+            # Write the index footer
+            index_data: bytes = json.dumps(bee_index.to_dict()).encode('utf-8')
+            writer = BeeFileWriter(fd=fd, offset=offset)
+            writer.write(index_data)
+            writer.write(len(index_data).to_bytes(8, byteorder='big'))
+            writer.write(BEE_FILE_MAGIC)
+            writer.close()
+    finally:
+        os.close(fd)
 
     return output_file
 
 
+def record_to_file(request_iterator, filename: str) -> Generator[buffer_pb2.Buffer, None, None]:
+    """
+    Passes the buffers of a stream through while appending them to a v1 `.bee` file, with their block
+     markers, signals and credits as they were received, so the stream can be replayed later with
+     read_bee_file.
+    """
+    with open(filename, 'ab') as f:
+        for buffer in request_iterator:
+            serialized: bytes = buffer.SerializeToString()
+            f.write(len(serialized).to_bytes(4, byteorder='big') + serialized)
+            yield buffer
+
+
+class BeeFileImporter:
+    """
+    Saves the messages of a `.bee` file as the Dir objects that parse_from_buffer saves: part files,
+     the _.json metadata and blocks on the block directory. The chunks are copied from the file
+     with copy_file_range, only the control buffers (head, block and separator) are parsed.
+    """
+
+    def __init__(self, filename: str, indices: Dict[int, Union[Type[bytes], Message]]):
+        self.fd: int = os.open(filename, os.O_RDONLY)
+        self.indices: Dict[int, Union[Type[bytes], Message]] = indices
+        self.dirname: typing.Optional[str] = None
+        self.message_field = None
+        self._json: List[Union[int, typing.Tuple[str, List[int]]]] = []
+        self.out: typing.Optional[int] = None  # Part or block file descriptor, None if skipping an existing block.
+        self.block: typing.Optional[str] = None
+        self.block_file: typing.Optional[str] = None  # Moved to the registry once the block is closed.
+
+    def open_part(self):
+        self._json.append(len([e for e in self._json if type(e) is int]) + 1)
+        self.out = os.open(self.dirname + '/' + str(self._json[-1]), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def close_out(self):
+        if self.out is not None:
+            os.close(self.out)
+        self.out = None
+
+    def remove_block_file(self):
+        if self.block_file and os.path.isfile(self.block_file):
+            remove_file(self.block_file)
+        self.block_file = None
+
+    def start(self, index: int):
+        if index not in self.indices:
+            raise Exception('Parse from buffer error: buffer head index is not correct ' + str(index) + str(
+                self.indices.keys()))
+        self.message_field = self.indices[index]
+        self.dirname = generate_random_dir()
+        self._json = []
+        self.open_part()
+
+    def end(self) -> Dir:
+        self.close_out()
+        if self.block:
+            self.remove_block_file()
+            dirname, self.dirname = self.dirname, None
+            remove_dir(dir=dirname)
+            raise Exception('gRPCbb error: the bee file message ends inside the block ' + self.block)
+        dirname, self.dirname = self.dirname, None
+        if len(self._json) < 2:
+            filename: str = generate_random_file()
+            shutil.move(dirname + '/1', filename)
+            remove_dir(dir=dirname)
+            return Dir(dir=filename, _type=self.message_field)
+        with open(dirname + '/' + METADATA_FILE_NAME, 'w') as f:
+            json.dump(self._json, f)
+        generate_wbp_file(dirname)
+        return Dir(dir=dirname, _type=self.message_field)
+
+    def on_block(self, block: buffer_pb2.Buffer.Block):
+        block_id: typing.Optional[str] = get_hash_from_block(block)
+        if not block_id:
+            return
+        if not self.block:
+            self.close_out()
+            self._json.append((block_id, list(block.previous_lengths_position)))
+            self.block = block_id
+            if not block_exists(block_id):
+                self.block_file = generate_random_file()
+                self.out = os.open(self.block_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        elif block_id == self.block:
+            self.close_out()
+            if self.block_file:
+                move_to_block_dir(file_hash=block_id, file_path=self.block_file)
+                self.remove_block_file()  # If the block was added to the registry meanwhile.
+            self.block = None
+            self.open_part()
+        # Blocks inside a block are part of its content.
+
+    def on_record(self, control: typing.Optional[buffer_pb2.Buffer], chunk: typing.Optional[typing.Tuple[int, int]]) \
+            -> typing.Optional[Dir]:
+        if control and control.HasField('head') and self.dirname:
+            raise Exception('gRPCbb error: bee file message without separator.')
+        if not self.dirname:
+            self.start(index=control.head.index if control and control.HasField('head')
+                       else 1 if 1 in self.indices else 0)
+
+        if control and control.HasField('block'):
+            self.on_block(block=control.block)
+
+        if self.out is not None:
+            if chunk:
+                copy_file_range(self.fd, self.out, chunk[0], chunk[1])
+            elif control and control.HasField('chunk'):
+                os.write(self.out, control.chunk)
+
+        if control and control.HasField('separator') and control.separator:
+            return self.end()
+        return None
+
+    def close(self):
+        self.close_out()
+        os.close(self.fd)
+        self.remove_block_file()
+        if self.dirname:
+            remove_dir(dir=self.dirname)
+
+
+def import_bee_file(
+        filename: str,
+        indices: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+        message: typing.Optional[int] = None
+) -> Generator[Dir, None, None]:
+    """
+    Same as read_from_file, without building a buffer object per chunk: the chunks are found on the
+     wire and copied from the `.bee` file to the part and block files of each Dir.
+    """
+    if not indices:
+        indices = buffer_pb2.Empty
+    indices = dict(indices) if type(indices) is dict else {1: indices}
+    indices.update({0: bytes})
+
+    if message is None:
+        start, end = get_bee_file_data_range(filename=filename)
+    else:
+        _message: Dict = read_bee_index(filename=filename)['messages'][message]
+        start, end = _message['start'], _message['end']
+
+    importer = BeeFileImporter(filename=filename, indices=indices)
+    try:
+        for _, _, control, chunk in scan_bee_records(filename=filename, start=start, end=end):
+            _dir: typing.Optional[Dir] = importer.on_record(control=control, chunk=chunk)
+            if _dir:
+                yield _dir
+    finally:
+        importer.close()
+
+
 def read_from_file(
         path: str,
-        indices: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None
+        indices: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+        message: typing.Optional[int] = None
 ) -> Generator[Dir, None, None]:        
     """
     Reads serialized data from a binary file with a `.bee` extension.
@@ -921,6 +1502,8 @@ def read_from_file(
         path (str): The full path to the `.bee` file to read.
         indices (optional): A mapping or protocol buffer message for guiding 
                             the deserialization. Defaults to `None`.
+        message (int, optional): Position of the only message to read, v2 files seek
+                                 straight to it. Defaults to `None`, all of them.
 
     Returns:
         Generator[Dir, None, None]: A generator that yields `Dir` objects parsed 
@@ -931,8 +1514,5 @@ def read_from_file(
         ...     print(dir_obj)
     """
 
-    yield from parse_from_buffer(
-            request_iterator=read_bee_file(filename=path),
-            indices=indices,
-            partitions_message_mode=False  # Always false means always yield a Dir.
-        )
+    # Same Dir objects that parse_from_buffer(read_bee_file(path)) yields, without parsing the chunks.
+    yield from import_bee_file(filename=path, indices=indices, message=message)
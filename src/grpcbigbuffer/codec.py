@@ -0,0 +1,148 @@
+import inspect
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Type, Union
+
+from google.protobuf.message import Message
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import BufferStream, parse_from_buffer, serialize_to_buffer
+from grpcbigbuffer.instrumentation import Instrumentation
+from grpcbigbuffer.utils import Signal, Enviroment, CHUNK_SIZE, FLOW_CONTROL_WINDOW
+
+
+class BeeCodec(object):
+    """
+    The indices and partition modes of a method signature, normalised once, to serialize and parse the
+     messages of many calls.
+    Messages smaller than a chunk are sent as a single buffer with their head, chunk and separator, and
+     single buffer messages are decoded straight into their class. Anything else goes through
+     serialize_to_buffer and parse_from_buffer.
+    """
+
+    def __init__(
+            self,
+            indices_parser: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+            partitions_message_mode_parser: Union[bool, None, Dict[int, Optional[bool]]] = None,
+            indices_serializer: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+            mem_manager=None,
+            debug: Callable[[str], None] = lambda s: None
+    ):
+        # Same defaults as client_grpc.
+        if not indices_parser:
+            indices_parser = buffer_pb2.Empty
+            partitions_message_mode_parser = True
+        if not partitions_message_mode_parser: partitions_message_mode_parser = False
+        self.indices: Dict[int, Any] = normalize_indices(indices_parser)
+        if type(partitions_message_mode_parser) is dict:
+            self.partitions_message_mode: Dict[int, Optional[bool]] = {
+                i: partitions_message_mode_parser.get(i, False) for i in self.indices
+            }
+        else:
+            self.partitions_message_mode: Dict[int, Optional[bool]] = {
+                i: partitions_message_mode_parser for i in self.indices
+            }
+        self.default_index: int = 1 if 1 in self.indices else 0
+
+        self.indices_serializer: Dict[int, Any] = normalize_indices(indices_serializer) \
+            if indices_serializer else {0: bytes}
+        self.serializer_index: Dict[type, int] = {cls: i for i, cls in self.indices_serializer.items()}
+        # Like serialize_to_buffer, without indices the message type is the index 1.
+        self.learn_index: bool = len(self.indices_serializer) == 1
+        self.mem_manager = mem_manager
+        self.debug: Callable[[str], None] = debug
+
+    def small_buffer(self, message) -> Optional[buffer_pb2.Buffer]:
+        # The single buffer of a message smaller than a chunk, or None.
+        if isinstance(message, Message):
+            index: Optional[int] = self.serializer_index.get(type(message))
+            if index is None and self.learn_index:
+                index = 1
+            if index is None:
+                return None
+            chunk: bytes = message.SerializeToString()
+        elif type(message) is bytes:
+            index, chunk = 0, message
+        else:
+            return None
+        if len(chunk) >= CHUNK_SIZE:
+            return None
+        return buffer_pb2.Buffer(chunk=chunk, head=buffer_pb2.Buffer.Head(index=index), separator=True)
+
+    def serialize(self, input=None, signal: Optional[Signal] = None) -> Iterator[buffer_pb2.Buffer]:
+        if input is None:
+            input = buffer_pb2.Empty()
+        buffer: Optional[buffer_pb2.Buffer] = self.small_buffer(input)
+        if buffer:
+            return iter([buffer])
+        return serialize_to_buffer(
+            message_iterator=input,
+            signal=signal,
+            indices=dict(self.indices_serializer),
+            mem_manager=self.mem_manager,
+            debug=self.debug
+        )
+
+    def small_message(self, buffer: buffer_pb2.Buffer) -> Optional[List]:
+        # The message of a single buffer, as a list that is empty if it's skipped, or None.
+        if not buffer.separator or buffer.HasField('block'):
+            return None
+        index: int = buffer.head.index if buffer.HasField('head') else self.default_index
+        if index not in self.indices or self.partitions_message_mode[index] is False:
+            return None
+        message_field = self.indices[index]
+        if not buffer.chunk:
+            return [buffer_pb2.Empty()] if message_field is buffer_pb2.Empty else []
+        if inspect.isclass(message_field) and issubclass(message_field, Message):
+            return [message_field.FromString(buffer.chunk)]
+        if message_field is str:
+            return [buffer.chunk.decode('utf-8')]
+        return [message_field(buffer.chunk)]
+
+    def parse(
+            self,
+            request_iterator,
+            signal: Optional[Signal] = None,
+            instrumentation: Optional[Instrumentation] = None
+    ) -> Generator[Any, None, None]:
+        if not signal:
+            signal = Signal(exist=False)
+        if instrumentation is None:
+            instrumentation = Enviroment.instrumentation
+        stream = BufferStream(request_iterator=request_iterator, signal=signal)
+        while True:
+            buffer: Optional[buffer_pb2.Buffer] = stream.next()
+            if buffer is None:
+                return
+            messages: Optional[List] = self.small_message(buffer)
+            if messages is None:
+                break
+            if instrumentation:
+                instrumentation.count('received_bytes', len(buffer.chunk))
+                instrumentation.count('received_chunks')
+            yield from messages
+
+        # The signals and credits were already applied by the stream.
+        stream.push(buffer)
+        yield from parse_from_buffer(
+            request_iterator=iter(stream.next, None),
+            indices=dict(self.indices),
+            partitions_message_mode=dict(self.partitions_message_mode),
+            mem_manager=self.mem_manager,
+            debug=self.debug,
+            instrumentation=instrumentation
+        )
+
+    def call(self, method, input=None, timeout=None) -> Generator[Any, None, None]:
+        # Like client_grpc, with the signature of the codec.
+        signal = Signal(window=FLOW_CONTROL_WINDOW)
+        yield from self.parse(
+            request_iterator=method(self.serialize(input=input, signal=signal), timeout=timeout),
+            signal=signal
+        )
+
+
+def normalize_indices(indices: Union[Message, Dict[int, Union[Type[bytes], Message]]]) -> Dict[int, Any]:
+    if type(indices) is not dict:
+        if not (inspect.isclass(indices) and issubclass(indices, Message)):
+            raise Exception('gRPCbb codec error: indices must be a dict or a Message subclass.')
+        indices = {1: indices}
+    return {**indices, 0: bytes}
@@ -1,12 +1,10 @@
 import hashlib
-from io import BytesIO
 
-from typing import Generator, List, Dict, Tuple
+from typing import Generator, List, Dict, Tuple, Union, Optional, BinaryIO
 import os
 
 from grpcbigbuffer import buffer_pb2
-import numpy as np
-from grpcbigbuffer.utils import encode_bytes
+from grpcbigbuffer.utils import encode_bytes, copy_file_range, CHUNK_SIZE
 
 
 ################
@@ -35,36 +33,39 @@ def sort(d):
     return sorted(d.items())
 
 
-def get_parsers(l):
-    r = []
-    f = []
+def check_sorted_list(l) -> bool:
     n = []
     aux = None
     for e in l:
         if e[1] != aux:
             aux = e[1]
             if e[1] in n:
-                f.append(e[1])
+                return False
             else:
                 n.append(e[1])
+    return True
 
-        if len(r) == 0 or r[-1][0] != e[1]:
-            r.append((e[1], [e[0]]))
-        else:
-            r[-1][1].append(e[0])
-    return r, f
 
+def get_leaves(
+        partition: buffer_pb2.Buffer.Head.Partition,
+        prefix: Tuple[int, ...] = ()
+) -> List[Tuple[int, ...]]:
+    if len(partition.index) == 0:
+        return [prefix]
+    leaves: List[Tuple[int, ...]] = []
+    for index, sub_partition in partition.index.items():
+        leaves.extend(get_leaves(sub_partition, prefix + (index,)))
+    return leaves
 
-def check_sorted_list(l) -> bool:
-    n = []
-    aux = None
-    for e in l:
-        if e[1] != aux:
-            aux = e[1]
-            if e[1] in n:
-                return False
-            else:
-                n.append(e[1])
+
+def check_overlaps(
+        partitions: List[buffer_pb2.Buffer.Head.Partition]
+) -> bool:
+    # Two partitions can't contain the same field, or a field and one of its sub fields.
+    leaves: List[Tuple[int, ...]] = sorted(leaf for p in partitions for leaf in get_leaves(p))
+    for leaf, next_leaf in zip(leaves, leaves[1:]):
+        if next_leaf[:len(leaf)] == leaf:
+            return False
     return True
 
 
@@ -72,11 +73,14 @@ def reorg_partitions(
         dirs: List[str],
         partitions: List[buffer_pb2.Buffer.Head.Partition]
 ):
-    partitions = {dirs[i]: p for i, p in enumerate(partitions)}
-    dict = to_dict(partitions=partitions)
-    sorted_list = sort(dict)
-    sorted_and_grouped, list_for_parse = get_parsers(sorted_list)
-    # ...
+    """
+    Reorganises the partitions on the field order of the merged message, returning the stream plan.
+    Partitions whose fields are interleaved with the fields of others are read by seeking to each one
+     of their records, so any valid partition model is streamed without reassembling it on memory.
+    """
+    if not check_overlaps(partitions):
+        raise Exception('Partition model not correct.')
+    return plan_partition_stream(dirs=dirs, partitions=partitions)
 
 
 def validate_partitions(
@@ -105,13 +109,11 @@ def calculate_hash_of_complete(
             hash_id.update(chunk)
 
     else:
-        f = open(dirs[0], 'rb')
-        while True:
-            data = f.read()
-            if not data:
-                break
-            hash_id.update(data)
-        f.close()
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(dirs[0], 'rb', buffering=0) as f:
+            while n := f.readinto(buffer):
+                hash_id.update(view[:n])
 
     return hash_id.hexdigest()
 
@@ -120,300 +122,268 @@ def calculate_hash_of_complete(
 ### Streaming ###
 #################
 
-def shifting(bitlist: str) -> int:
-    out = 0
-    for bit in bitlist:
-        out = (out << 1) | int(bit)
-    return out
+# A stream plan is a list of segments. Each segment is a header (bytes) or a range of a partition
+#  file given as (partition position, offset, length).
+Segment = Union[bytes, Tuple[int, int, int]]
 
 
 # returns varint encoded tag based upon field number and wire type
-def get_tag(field_num: int) -> bytes:
-    return (
-        shifting(''.join([
-            str(i) for i in
-            np.unpackbits(
-                np.array(
-                    [[field_num]], dtype=np.uint8
-                ), axis=1
-            ).tolist()[0] + [0, 1, 0]
-        ]))
-    ).to_bytes(1, byteorder='little')
-
-
-def get_field(tag: bytes) -> int:
-    return decode_bytes(
-        shifting(
-            ''.join([
-                str(i) for i in
-                np.unpackbits(
-                    np.array(
-                        [[
-                            decode_bytes(tag)
-                        ]], dtype=np.uint8
-                    ), axis=1
-                ).tolist()[0][:-3]
-            ])
-        ).to_bytes(1, byteorder='little')
-    )
-
-
-def decode_bytes(buf):
-    """Read a varint from from `buf` bytes"""
-
-    def decode_stream(stream):
-        """Read a varint from `stream`"""
-
-        def _read_one(stream):
-            """Read a byte from the file (as an integer)
-            raises EOFError if the stream ends while reading bytes.
-            """
-            c = stream.read(1)
-            if c == b'':
-                raise EOFError("Unexpected EOF while reading bytes")
-            return ord(c)
-
-        shift = 0
-        result = 0
-        while True:
-            i = _read_one(stream)
-            result |= (i & 0x7f) << shift
-            shift += 7
-            if not (i & 0x80):
-                break
-
-        return result
-
-    return decode_stream(BytesIO(buf))
-
-
-class Partition:
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.file = open(file_path, 'r+b')
-        self.size = os.path.getsize(file_path)
-
-    def next_index(self) -> Tuple[int, int]:
-        index: bytes | None = None
-        arr: bytes = b''
-        while b := self.file.read(1):
-
-            if not index:
-                index: bytes = b
-            else:
-                arr += b
-                if np.unpackbits(
-                        np.array(
-                            [[
-                                np.frombuffer(b, dtype=np.uint8)
-                            ]], dtype=np.uint8
-                        ), axis=1
-                ).tolist()[0][0][0] == 0: break
-
-        return get_field(index), decode_bytes(arr)
-
-    def read(self):
-        while chunk := self.file.read(1024 * 10):
-            yield chunk
-
-
-class Index:
-    def __init__(self, index: int):
-
-        self.index: int = index
-        self.on_multiple_partitions: bool = False
-        self.alone_on_all_partitions: bool = True
-        self.schema: List[Index] | None = None
-        self.schema_d: Dict[int, Index] = {}
-        self.file_partitions: List[Partition] = []
-        self.is_alone_on_partition: List[bool] = []
-        self.size = None
-        self.pruned_bytes = 0
-        self.name: str = str(self.index)
-
-    def add_partition(self, partition: Partition, alone_on_it: bool):
-        if self.signed(): raise Exception('Error, signed.')
-
-        if len(self.file_partitions) == 1:
-            self.on_multiple_partitions = True
-        if alone_on_it is False:
-            self.alone_on_all_partitions = False
-
-        self.is_alone_on_partition.append(alone_on_it)
-        self.file_partitions.append(partition)
-
-    def add_indexes(self,
-                    buf_partition: buffer_pb2.Buffer.Head.Partition,
-                    dir_partition: Partition
-                    ):
-        if self.signed(): raise Exception('Error, signed.')
-        if len(buf_partition.index) > 0:
-            only_one: bool = len(buf_partition.index) == 1
-            for index, sub_partition in buf_partition.index.items():
-                if index not in self.schema_d.keys():
-                    self.schema_d[index] = Index(index=index)
-
-                index_obj: Index = self.schema_d[index]
-
-                index_obj.add_partition(
-                    partition=dir_partition,
-                    alone_on_it=only_one
-                )
-
-                index_obj.add_indexes(
-                    buf_partition=sub_partition,
-                    dir_partition=dir_partition
+def get_tag(field_num: int, wire_type: int = 2) -> bytes:
+    return encode_bytes(field_num << 3 | wire_type)
+
+
+def read_varint(file: BinaryIO, position: int) -> Tuple[int, int]:
+    """
+    Returns the varint found at the position of the file and the position just after it.
+    """
+    file.seek(position)
+    result: int = 0
+    shift: int = 0
+    for i, byte in enumerate(file.read(10)):
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position + i + 1
+        shift += 7
+    raise Exception('Partition disk stream error, malformed varint at position ' + str(position))
+
+
+def scan_records(file: BinaryIO, offset: int, length: int) -> Generator[Tuple[int, int, int, int], None, None]:
+    """
+    Walks the top level records of the message stored on the file range, yielding the field number,
+     the record start, the value start and the record end. Values are skipped, not read.
+    """
+    position: int = offset
+    end: int = offset + length
+    while position < end:
+        key, value_start = read_varint(file, position)
+        wire_type: int = key & 0x07
+        if wire_type == 0:
+            _, record_end = read_varint(file, value_start)
+        elif wire_type == 1:
+            record_end: int = value_start + 8
+        elif wire_type == 2:
+            size, value_start = read_varint(file, value_start)
+            record_end: int = value_start + size
+        elif wire_type == 5:
+            record_end: int = value_start + 4
+        else:
+            raise Exception('Partition disk stream error, unsupported wire type ' + str(wire_type))
+        if record_end > end:
+            raise Exception('Partition disk stream error, record out of the partition range.')
+        yield key >> 3, position, value_start, record_end
+        position = record_end
+
+
+class FieldNode:
+    """
+    Node of the merged message. Its content comes from a value range of a partition file, from
+     the complete records found while scanning the parent, or from its children.
+    """
+
+    def __init__(self):
+        self.children: Dict[int, FieldNode] = {}
+        # (partition position, offset, length, partition model or None if the value is complete)
+        self.values: List[Tuple[int, int, int, Optional[buffer_pb2.Buffer.Head.Partition]]] = []
+        # (partition position, [(record start, value start, record end)], partition model or None)
+        self.records: List[Tuple[int, List[Tuple[int, int, int]], Optional[buffer_pb2.Buffer.Head.Partition]]] = []
+        self.size: int = 0
+
+    def has_header(self) -> bool:
+        # Records are copied as they are, they already contain their tag and length.
+        return len(self.records) == 0
+
+    def resolve(self, files: List[BinaryIO]) -> int:
+        """
+        Computes the content size, scanning only the ranges that share the node with other sources.
+        """
+        if len(self.values) + len(self.records) == 1 and not self.children:
+            self.size = self.values[0][2] if self.values else \
+                sum(end - start for start, _, end in self.records[0][1])
+            return self.size
+
+        for partition, spans, model in self.records:
+            if len(spans) != 1:
+                raise Exception('Partition disk stream error, repeated field split over several partitions.')
+            _, value_start, end = spans[0]
+            self.values.append((partition, value_start, end - value_start, model))
+        self.records = []
+
+        for partition, offset, length, model in self.values:
+            found: Dict[int, List[Tuple[int, int, int]]] = {}
+            for field, start, value_start, end in scan_records(files[partition], offset, length):
+                found.setdefault(field, []).append((start, value_start, end))
+            for field, spans in found.items():
+                if model is not None and field not in model.index:
+                    continue  # The partition does not claim this field.
+                sub_model = model.index[field] if model is not None else None
+                self.children.setdefault(field, FieldNode()).records.append(
+                    (partition, spans, sub_model if sub_model is not None and len(sub_model.index) > 0 else None)
                 )
+        self.values = []
 
-    def signed(self) -> bool:
-        return self.schema is not None
-
-    def sign(self):
-        if self.signed(): raise Exception('Error, signed.')
-        self.schema = list(self.schema_d.values())
-        self.schema_d = None
-        for index in self.schema:
-            try:
-                index.sign()
-            except Exception as e:
-                raise Exception(str(index.index) + ' ' + str(e))
-
-        self.name = str(self.index) + '-' + str(len(self.schema)) + '-' + str(len(self.file_partitions)) + \
-                    '-' + str(self.on_multiple_partitions) + '-' + str(self.alone_on_all_partitions)
-
-    def get_size(self) -> int:
-        if not self.size:
-            self.compute_size()
+        self.size = 0
+        for field, child in self.children.items():
+            size: int = child.resolve(files)
+            self.size += size + len(get_tag(field)) + len(encode_bytes(size)) if child.has_header() else size
         return self.size
 
-    def get_pruned_bytes(self) -> int:
-        if not self.size:
-            self.compute_size()
-        return self.pruned_bytes
-
-    def compute_size(self):
-        if not self.on_multiple_partitions and self.alone_on_all_partitions:
-            self.size = self.file_partitions[0].size
-            return
-
-        elif self.on_multiple_partitions and False not in self.is_alone_on_partition:
-            total_size = sum([p.size for p in self.file_partitions])
-
-        elif self.on_multiple_partitions:  # and not self.alone_on_all_partitions
-            total_size = 0
-            pruned_bytes = 0
-            for i, partition in enumerate(self.file_partitions):
-                alone_on_it: bool = self.is_alone_on_partition[i]
-                if not alone_on_it:
-                    index, size = partition.next_index()
-                    if index != self.index:
-                        raise Exception('Partition disk stream error. Unexpected index ' \
-                                        + str(index) + ' instead of ' + str(self.index))
-                    pruned_bytes += len(encode_bytes(size)) + 1
-                    if size == 0: continue
-
-                    total_size += size
-
-                else:
-                    total_size += partition.size
-            self.pruned_bytes = pruned_bytes
-
-        else:  # not self.on_multiple_partitions and not self.alone_on_all_partitions
-            raise Exception('Partition disk stream error.')  # No debería llegar hasta aqui.
-
-        if total_size > 0:
-            for i in self.schema:
-                if i.on_multiple_partitions:
-                    total_size += len(encode_bytes(i.get_size())) + 1
-                    total_size -= i.get_pruned_bytes()
-
-        self.size = total_size
-
-    def generate(self) -> Generator[bytes, None, None]:
-        if self.alone_on_all_partitions and not self.on_multiple_partitions:
-            size: int = os.path.getsize(self.file_partitions[0].file_path)
-            yield get_tag(self.index)
-            yield encode_bytes(size)
-            for i in self.file_partitions[0].read():
-                yield i
-
-        elif self.on_multiple_partitions:  # and (alone_on_all_partitions or not_alone_on_all_partitions)
-            size: int = self.get_size()
-            if size > 0:
-                yield get_tag(self.index)
-                yield encode_bytes(size)
-                for i in self.schema:
-                    for c in i.generate():
-                        yield c
-
-        else:  # not alone_on_all_partitions and not on_multiple_partitions
-            # Partitions should be readen only on the first index on them. The rest index are not
-            #  going to generate anything.
-            for i in self.file_partitions[0].read():
-                yield i
-
-
-def reorg_by_indexes(
-        dirs: List[str],
-        partitions: List[buffer_pb2.Buffer.Head.Partition]
-) -> List[Index]:
-    # Not needed. if len(dirs) != len(partitions):  raise Exception('Partition disk stream error, incompatible inputs.')
+    def emit(self, plan: List[Segment]):
+        if self.values:
+            partition, offset, length, _ = self.values[0]
+            add_segment(plan, (partition, offset, length))
+        elif self.records:
+            partition, spans, _ = self.records[0]
+            for start, _, end in spans:
+                add_segment(plan, (partition, start, end - start))
+        else:
+            for field in sorted(self.children):
+                child: FieldNode = self.children[field]
+                if child.has_header():
+                    add_segment(plan, get_tag(field) + encode_bytes(child.size))
+                child.emit(plan)
+
+
+def add_segment(plan: List[Segment], segment: Segment):
+    # Coalesces adjacent headers, and contiguous ranges of the same partition file.
+    if len(segment) == 0 or type(segment) is tuple and segment[2] == 0:
+        return
+    if plan and type(segment) is bytes and type(plan[-1]) is bytes:
+        plan[-1] += segment
+    elif plan and type(segment) is tuple and type(plan[-1]) is tuple and \
+            plan[-1][0] == segment[0] and plan[-1][1] + plan[-1][2] == segment[1]:
+        plan[-1] = (segment[0], plan[-1][1], plan[-1][2] + segment[2])
+    else:
+        plan.append(segment)
 
-    partition_obj_arr: List[Partition] = [Partition(file_path=d) for d in dirs]
 
-    index_obj_d: Dict[int, Index] = {}
+def build_partition_tree(
+        dirs: List[str],
+        partitions: List[buffer_pb2.Buffer.Head.Partition]
+) -> FieldNode:
+    root = FieldNode()
     for i, partition in enumerate(partitions):
-        only_one: bool = len(partition.index) == 1
-        for index, sub_partition in partition.index.items():
-            if index not in index_obj_d.keys():
-                index_obj_d[index] = Index(index=index)
-
-            index_obj: Index = index_obj_d[index]
-
-            index_obj.add_partition(
-                partition=partition_obj_arr[i],
-                alone_on_it=only_one
-            )
-            index_obj.add_indexes(
-                buf_partition=sub_partition,
-                dir_partition=partition_obj_arr[i]
-            )
-
-    index_obj_arr: List[Index] = list(index_obj_d.values())
-    for index in index_obj_arr: index.sign()
-    return index_obj_arr
+        # A chain of single index partitions means that the file only contains the value of the last field.
+        node: FieldNode = root
+        while len(partition.index) == 1:
+            field, partition = next(iter(partition.index.items()))
+            node = node.children.setdefault(field, FieldNode())
+        node.values.append(
+            (i, 0, os.path.getsize(dirs[i]), partition if len(partition.index) > 0 else None)
+        )
+    return root
 
 
-def partition_disk_stream(
+def plan_partition_stream(
+        dirs: List[str],
+        partitions: List[buffer_pb2.Buffer.Head.Partition]
+) -> List[Segment]:
+    """
+    Plans every header of the merged message up front, so the stream is only a list of
+     large file ranges with the headers between them.
+    """
+    files: List[BinaryIO] = [open(d, 'rb') for d in dirs]
+    try:
+        root: FieldNode = build_partition_tree(dirs=dirs, partitions=partitions)
+        root.resolve(files)
+        plan: List[Segment] = []
+        root.emit(plan)
+        return plan
+    finally:
+        for f in files:
+            f.close()
+
+
+def read_plan(
+        dirs: List[str],
+        plan: List[Segment],
+        chunk_size: int = CHUNK_SIZE
+) -> Generator[memoryview, None, None]:
+    # Each chunk is a new buffer, so the consumer can keep the views it receives.
+    files: List[BinaryIO] = [open(d, 'rb', buffering=0) for d in dirs]
+    try:
+        chunk = bytearray(chunk_size)
+        position: int = 0
+        for segment in plan:
+            if type(segment) is bytes:
+                data = memoryview(segment)
+                while data:
+                    n: int = min(len(data), chunk_size - position)
+                    chunk[position:position + n] = data[:n]
+                    position += n
+                    data = data[n:]
+                    if position == chunk_size:
+                        yield memoryview(chunk)
+                        chunk, position = bytearray(chunk_size), 0
+            else:
+                partition, offset, length = segment
+                f: BinaryIO = files[partition]
+                f.seek(offset)
+                while length:
+                    n: int = f.readinto(memoryview(chunk)[position:position + min(length, chunk_size - position)])
+                    if not n:
+                        raise Exception('Partition disk stream error, unexpected end of ' + dirs[partition])
+                    position += n
+                    length -= n
+                    if position == chunk_size:
+                        yield memoryview(chunk)
+                        chunk, position = bytearray(chunk_size), 0
+        if position:
+            yield memoryview(chunk)[:position]
+    finally:
+        for f in files:
+            f.close()
+
+
+def check_partition_inputs(
         dirs: List[str],
         partitions: List[buffer_pb2.Buffer.Head.Partition]
-) -> Generator[bytes, None, None]:
+):
     if len(dirs) != len(partitions):
         raise Exception('Partition disk stream error, incompatible inputs.')
 
-    if len(partitions) < 2:
-        raise Exception('Partition disk stream error, multiple partitions needed.')
+    if len(partitions) < 1:
+        raise Exception('Partition disk stream error, partitions needed.')
 
-    if not validate_partitions(partitions):
-        # TODO reorg_partitions to a correct form.
-        raise Exception('Partition model not correct.')
 
-    #
-    # Agrupa particiones para no repetir cabeceras.
-    #
-    # Calcula el tamaño de las cabeceras en función
-    #   de lo que ocupa en todas las particiones
-    #   donde se encuentra.
-    #
-    # Cuando se lee una partición cuyo mensaje
-    #   ya se ha comenzado no debe añadir su cabecera
-    #   y, en caso de no ser el principal, eliminarla a
-    #   partir de su identificador y longitud del mensaje.
-    #
-
-    for index in reorg_by_indexes(
-            dirs=dirs,
-            partitions=partitions
-    ):
-        for b in index.generate():
-            yield b
+def partition_disk_stream(
+        dirs: List[str],
+        partitions: List[buffer_pb2.Buffer.Head.Partition],
+        chunk_size: int = CHUNK_SIZE
+) -> Generator[memoryview, None, None]:
+    check_partition_inputs(dirs=dirs, partitions=partitions)
+    yield from read_plan(
+        dirs=dirs,
+        plan=reorg_partitions(dirs=dirs, partitions=partitions),
+        chunk_size=chunk_size
+    )
+
+
+def write_partition_disk_stream(
+        dirs: List[str],
+        partitions: List[buffer_pb2.Buffer.Head.Partition],
+        filename: str
+) -> int:
+    """
+    Writes the merged message to the file, copying the partition ranges with copy_file_range/sendfile.
+    Returns the number of bytes written.
+    """
+    check_partition_inputs(dirs=dirs, partitions=partitions)
+    plan: List[Segment] = reorg_partitions(dirs=dirs, partitions=partitions)
+    files: List[int] = [os.open(d, os.O_RDONLY) for d in dirs]
+    out: int = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    written: int = 0
+    try:
+        for segment in plan:
+            if type(segment) is bytes:
+                data = memoryview(segment)
+                while data:
+                    data = data[os.write(out, data):]
+                written += len(segment)
+            else:
+                partition, offset, length = segment
+                written += copy_file_range(files[partition], out, offset, length)
+    finally:
+        os.close(out)
+        for fd in files:
+            os.close(fd)
+    return written
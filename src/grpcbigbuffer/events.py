@@ -0,0 +1,328 @@
+import struct
+from typing import Dict, Generator, List, Optional, Tuple, Type, Union
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.message import Message
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import BufferStream, get_hash_from_block, signal_block_buffer_stream
+from grpcbigbuffer.instrumentation import Instrumentation
+from grpcbigbuffer.reader import block_exists, read_block
+from grpcbigbuffer.utils import Enviroment, Signal
+
+# Kinds of the events of a message, in the order they're found on the stream.
+HEAD = 'head'  # value: the index of the message.
+FIELD_START = 'field_start'  # value: the length of the submessage or bytes field.
+FIELD_END = 'field_end'
+SCALAR = 'scalar'  # value: the decoded number, bool or enum of a field (of each one, if packed).
+CHUNK = 'chunk'  # value: bytes of a bytes or string field, or of the message if its index is bytes.
+BLOCK_START = 'block_start'  # value: the hash of the block.
+BLOCK_END = 'block_end'
+MESSAGE_END = 'message_end'
+
+VARINT, FIXED64, LENGTH_DELIMITED, START_GROUP, END_GROUP, FIXED32 = 0, 1, 2, 3, 4, 5
+
+SIGNED_VARINTS = (FieldDescriptor.TYPE_INT32, FieldDescriptor.TYPE_INT64, FieldDescriptor.TYPE_ENUM)
+ZIGZAG_VARINTS = (FieldDescriptor.TYPE_SINT32, FieldDescriptor.TYPE_SINT64)
+FIXED_FORMATS: Dict[int, str] = {
+    FieldDescriptor.TYPE_DOUBLE: '<d', FieldDescriptor.TYPE_FIXED64: '<Q', FieldDescriptor.TYPE_SFIXED64: '<q',
+    FieldDescriptor.TYPE_FLOAT: '<f', FieldDescriptor.TYPE_FIXED32: '<I', FieldDescriptor.TYPE_SFIXED32: '<i',
+}
+
+
+class Event(object):
+    """
+    A step of the parse of a message. The path is the field numbers from the message to the field,
+     on the wire, so the repeated fields and the map entries don't have their position on it.
+    """
+    __slots__ = ('kind', 'path', 'value')
+
+    def __init__(self, kind: str, path: Tuple[int, ...] = (), value=None):
+        self.kind: str = kind
+        self.path: Tuple[int, ...] = path
+        self.value = value
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Event) and \
+            (self.kind, self.path, self.value) == (other.kind, other.path, other.value)
+
+    def __repr__(self) -> str:
+        return 'Event(' + self.kind + ', ' + str(self.path) + ', ' + repr(self.value) + ')'
+
+
+def read_varint(data, position: int) -> Optional[Tuple[int, int]]:
+    # The varint at the position and the position after it, None if the data ends before it.
+    result, shift = 0, 0
+    while position < len(data):
+        byte: int = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+    return None
+
+
+def read_header(data, position: int) -> Optional[Tuple[int, int, int, Union[int, bytes]]]:
+    """
+    The field number, wire type and value of the field at the position, and the position after them. The
+     value of a length delimited field is its length, its content is not read.
+    """
+    tag = read_varint(data, position)
+    if not tag:
+        return None
+    number, wire_type, position = tag[0] >> 3, tag[0] & 7, tag[1]
+    if wire_type in (VARINT, LENGTH_DELIMITED):
+        value = read_varint(data, position)
+        if not value:
+            return None
+        return number, wire_type, value[1], value[0]
+    if wire_type in (FIXED64, FIXED32):
+        end: int = position + (8 if wire_type == FIXED64 else 4)
+        if end > len(data):
+            return None
+        return number, wire_type, end, bytes(data[position:end])
+    raise Exception('gRPCbb: groups are not supported by the event parser, on the field ' + str(number))
+
+
+def decode_scalar(field: Optional[FieldDescriptor], wire_type: int, value: Union[int, bytes]):
+    # The value of a varint or fixed field as its type, as it's on the wire if the field is unknown.
+    if not field:
+        return value
+    if wire_type == VARINT:
+        if field.type == FieldDescriptor.TYPE_BOOL:
+            return bool(value)
+        if field.type in ZIGZAG_VARINTS:
+            return (value >> 1) ^ -(value & 1)
+        if field.type in SIGNED_VARINTS and value >= 1 << 63:
+            return value - (1 << 64)
+        return value
+    return struct.unpack(FIXED_FORMATS[field.type], value)[0]
+
+
+class WireDecoder(object):
+    """
+    Decodes the wire format of a message as its chunks arrive, without keeping them: the submessages
+     are entered, the scalars decoded, and the bytes and string fields given in chunks as they are. Only
+     the headers of the fields that are split between two chunks, and the packed scalars, are held.
+    Without descriptor the message is bytes, and its chunks are given as they are.
+    """
+
+    def __init__(self, descriptor: Optional[Descriptor]):
+        self.descriptor: Optional[Descriptor] = descriptor
+        self.offset: int = 0
+        # Open submessages: descriptor, path and the offset where they end.
+        self.frames: List[Tuple[Optional[Descriptor], Tuple[int, ...], Optional[int]]] = [(descriptor, (), None)]
+        self.pending: bytes = b''  # Start of a header split between chunks.
+        self.field: Optional[Tuple[int, ...]] = None  # Bytes field being read.
+        self.packed: Optional[FieldDescriptor] = None  # Packed scalars being read, on pending.
+        self.remaining: int = 0  # Bytes left of the bytes field or the packed scalars.
+
+    def path(self) -> Tuple[int, ...]:
+        # The innermost field open.
+        return self.field if self.field is not None else self.frames[-1][1]
+
+    def close_frames(self, events: List[Event]):
+        while self.frames[-1][2] is not None and self.frames[-1][2] <= self.offset:
+            if self.frames[-1][2] < self.offset:
+                raise Exception('gRPCbb: the field ' + str(self.frames[-1][1]) + ' is longer than its submessage.')
+            events.append(Event(FIELD_END, self.frames.pop()[1]))
+
+    def open_field(self, number: int, wire_type: int, value: Union[int, bytes], events: List[Event]):
+        descriptor, path, _ = self.frames[-1]
+        field: Optional[FieldDescriptor] = descriptor.fields_by_number.get(number) if descriptor else None
+        path = path + (number,)
+        if wire_type != LENGTH_DELIMITED:
+            events.append(Event(SCALAR, path, decode_scalar(field=field, wire_type=wire_type, value=value)))
+        elif field and field.type == FieldDescriptor.TYPE_MESSAGE:
+            events.append(Event(FIELD_START, path, value))
+            self.frames.append((field.message_type, path, self.offset + value))
+        elif field and field.type not in (FieldDescriptor.TYPE_BYTES, FieldDescriptor.TYPE_STRING):
+            self.packed, self.field, self.remaining = field, path, value
+        else:
+            events.append(Event(FIELD_START, path, value))
+            self.field, self.remaining = path, value
+
+    def end_field(self, events: List[Event]):
+        if self.packed:
+            wire_type: int = VARINT if self.packed.type not in FIXED_FORMATS else \
+                FIXED64 if struct.calcsize(FIXED_FORMATS[self.packed.type]) == 8 else FIXED32
+            size: int = 0 if wire_type == VARINT else 8 if wire_type == FIXED64 else 4
+            position: int = 0
+            while position < len(self.pending):
+                if wire_type == VARINT:
+                    value, position = read_varint(self.pending, position)
+                else:
+                    value, position = self.pending[position:position + size], position + size
+                events.append(Event(SCALAR, self.field,
+                                    decode_scalar(field=self.packed, wire_type=wire_type, value=value)))
+            self.packed, self.pending = None, b''
+        else:
+            events.append(Event(FIELD_END, self.field))
+        self.field = None
+
+    def feed(self, chunk: bytes) -> List[Event]:
+        events: List[Event] = []
+        if not self.descriptor:
+            if chunk:
+                events.append(Event(CHUNK, (), chunk))
+            self.offset += len(chunk)
+            return events
+
+        position: int = 0
+        while True:
+            if self.field is not None:
+                length: int = min(self.remaining, len(chunk) - position)
+                if length:
+                    if self.packed:
+                        self.pending += chunk[position:position + length]
+                    else:
+                        events.append(Event(CHUNK, self.field, chunk if length == len(chunk)
+                                            else chunk[position:position + length]))
+                    position += length
+                    self.offset += length
+                    self.remaining -= length
+                if self.remaining:
+                    return events
+                self.end_field(events=events)
+            self.close_frames(events=events)
+            if position == len(chunk):
+                return events
+
+            if self.pending:
+                data: bytes = self.pending + chunk[position:position + 20]
+                header = read_header(data, 0)
+                if not header:
+                    if position + 20 < len(chunk):
+                        raise Exception('gRPCbb: malformed field header on the message.')
+                    self.pending = data
+                    return events
+                position += header[2] - len(self.pending)
+                self.offset += header[2]
+                self.pending = b''
+            else:
+                header = read_header(chunk, position)
+                if not header:
+                    self.pending = chunk[position:]
+                    return events
+                self.offset += header[2] - position
+                position = header[2]
+            self.open_field(number=header[0], wire_type=header[1], value=header[3], events=events)
+
+    def end(self) -> List[Event]:
+        # Checks that the message has ended with its last field.
+        events: List[Event] = []
+        if self.field is None:
+            self.close_frames(events=events)
+        if self.pending or self.field is not None or len(self.frames) > 1:
+            raise Exception('gRPCbb: the message ended inside the field ' + str(self.path()))
+        return events
+
+
+def parse_events(
+        request_iterator,
+        indices: Union[Type[Message], Dict[int, Union[Type[bytes], Type[Message]]]] = None,
+        signal: Optional[Signal] = None,
+        instrumentation: Optional[Instrumentation] = None
+) -> Generator[Event, None, None]:
+    """
+    Parses the messages of a buffer stream as events, given as soon as the buffer that carries them is
+     received, instead of each message once it's whole: the head of each message, the start and end of
+     its submessages and bytes fields, its scalars, the chunks of its bytes fields, and the start and end
+     of its blocks. The content of the blocks that are on the registry is read from it.
+    The chunks of a field are given as they arrive, so strings can be split inside a character.
+    """
+    if not indices:
+        indices = buffer_pb2.Empty
+    if type(indices) is not dict:
+        indices = {1: indices}
+    indices = {**indices, 0: bytes}
+    if not signal:
+        signal = Signal(exist=False)
+    if instrumentation is None:
+        instrumentation = Enviroment.instrumentation
+
+    def get_decoder(index: int) -> WireDecoder:
+        if index not in indices:
+            raise Exception('Parse events error: buffer head index is not correct ' + str(index) + str(indices.keys()))
+        message_field = indices[index]
+        return WireDecoder(descriptor=message_field.DESCRIPTOR
+                           if isinstance(message_field, type) and issubclass(message_field, Message) else None)
+
+    def message_events(index: int, stream: BufferStream) -> Generator[Event, None, None]:
+        decoder: WireDecoder = get_decoder(index=index)
+        yield Event(HEAD, value=index)
+        blocks: List[Tuple[str, Tuple[int, ...]]] = []  # Open blocks and the field where they start.
+        skipping: Optional[str] = None
+
+        def write(chunk: bytes) -> List[Event]:
+            if skipping:
+                if instrumentation:
+                    instrumentation.count('deduplicated_bytes', len(chunk))
+                return []
+            return decoder.feed(chunk)
+
+        while True:
+            buffer: Optional[buffer_pb2.Buffer] = stream.next()
+            if buffer is None:
+                raise Exception('AbortedIteration')
+
+            if buffer.HasField('block'):
+                block_id: str = get_hash_from_block(buffer.block)
+                if block_id:
+                    if blocks and blocks[-1][0] == block_id:
+                        if skipping == block_id:
+                            skipping = None
+                        yield Event(BLOCK_END, blocks.pop()[1], block_id)
+                    elif block_id in (b[0] for b in blocks):
+                        raise Exception('gRPCbb: IntersectionError: Intersections between blocks are not allowed.')
+                    elif len(blocks) < Enviroment.block_depth:
+                        blocks.append((block_id, decoder.path()))
+                        yield Event(BLOCK_START, decoder.path(), block_id)
+                        if not skipping and block_exists(block_id=block_id):
+                            signal_block_buffer_stream(block_id, signal=signal)
+                            if instrumentation:
+                                instrumentation.count('blocks_skipped')
+                            for c in read_block(block_id=block_id):
+                                if type(c) is bytes:
+                                    yield from decoder.feed(c)
+                            skipping = block_id
+                if buffer.chunk:
+                    yield from write(buffer.chunk)
+                continue
+
+            if buffer.HasField('chunk'):
+                if buffer.chunk:
+                    yield from write(buffer.chunk)
+            elif not buffer.HasField('head'):
+                break
+            if buffer.separator:
+                break
+
+        if blocks:
+            raise Exception('gRPCbb: the message ended inside the block ' + blocks[-1][0])
+        yield from decoder.end()
+        yield Event(MESSAGE_END, value=index)
+
+    stream = BufferStream(request_iterator=request_iterator, signal=signal, instrumentation=instrumentation)
+    try:
+        while True:
+            buffer: Optional[buffer_pb2.Buffer] = stream.next()
+            if buffer is None:
+                break
+            if buffer.batch:
+                batch = buffer_pb2.Buffer.Batch.FromString(buffer.chunk)
+                for index, message in zip(batch.indices, batch.messages):
+                    decoder: WireDecoder = get_decoder(index=index)
+                    yield Event(HEAD, value=index)
+                    yield from decoder.feed(message)
+                    yield from decoder.end()
+                    yield Event(MESSAGE_END, value=index)
+                continue
+            stream.push(buffer)
+            yield from message_events(
+                index=buffer.head.index if buffer.HasField('head') else 1 if 1 in indices else 0,
+                stream=stream
+            )
+    finally:
+        stream.close()
@@ -0,0 +1,164 @@
+import threading
+import time
+from typing import Any, Dict, Generator, Iterator, List, Tuple
+
+# Name: (kind, unit, description) of the measures.
+MEASURES: Dict[str, Tuple[str, str, str]] = {
+    'received_bytes': ('counter', 'By', 'Bytes of chunks received by the parsers.'),
+    'received_chunks': ('counter', '1', 'Chunks received by the parsers.'),
+    'receive_throughput': ('histogram', 'By/s', 'Bytes per second of each received stream.'),
+    'sent_bytes': ('counter', 'By', 'Bytes of chunks sent by the serializers.'),
+    'sent_chunks': ('counter', '1', 'Chunks sent by the serializers.'),
+    'send_throughput': ('histogram', 'By/s', 'Bytes per second of each sent stream.'),
+    'signal_wait_seconds': ('histogram', 's', 'Time that the serializers are blocked on the signal.'),
+    'disk_write_seconds': ('histogram', 's', 'Latency of the chunk writes to disk.'),
+    'disk_read_seconds': ('histogram', 's', 'Latency of the chunk reads from disk.'),
+    'read_bytes': ('counter', 'By', 'Bytes of chunks read from disk.'),
+    'serialize_seconds': ('histogram', 's', 'Time to serialize each chunk of the messages sent from memory.'),
+    'serialized_bytes': ('counter', 'By', 'Bytes of chunks serialized from messages on memory.'),
+    'blocks_skipped': ('counter', '1', 'Blocks received that were already on the registry.'),
+    'deduplicated_bytes': ('counter', 'By', 'Bytes of the received blocks that were already on the registry.'),
+}
+
+# Bytes per second, from 64KB/s to 4GB/s.
+THROUGHPUT_BUCKETS: List[float] = [float(64 * 1024 * 2 ** i) for i in range(17)]
+
+
+class Instrumentation(object):
+    """
+    Receives the counters and histograms of the parsers, serializers and disk reads and writes.
+    The functions only measure when they have an instrumentation, so without one they cost nothing.
+    """
+
+    def count(self, name: str, value: float = 1):
+        pass
+
+    def observe(self, name: str, value: float):
+        pass
+
+
+class MemoryInstrumentation(Instrumentation):
+    # Keeps the counters and the observations of the histograms on memory.
+    def __init__(self):
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self.lock:
+            self.histograms.setdefault(name, []).append(value)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: list(values) for name, values in self.histograms.items()},
+            }
+
+
+class PrometheusInstrumentation(Instrumentation):
+    """
+    Counters and histograms of prometheus_client, on its default registry or the given one.
+    """
+
+    def __init__(self, registry=None, namespace: str = 'grpcbb'):
+        try:
+            import prometheus_client
+        except ModuleNotFoundError:
+            raise Exception('gRPCbb instrumentation error: PrometheusInstrumentation needs prometheus_client.')
+        self.metrics: Dict[str, Any] = {}
+        for name, (kind, unit, description) in MEASURES.items():
+            if kind == 'counter':
+                self.metrics[name] = prometheus_client.Counter(
+                    name=name,
+                    documentation=description,
+                    namespace=namespace,
+                    registry=registry if registry else prometheus_client.REGISTRY
+                )
+            else:
+                self.metrics[name] = prometheus_client.Histogram(
+                    name=name.replace('_seconds', ''),
+                    documentation=description,
+                    namespace=namespace,
+                    unit='seconds' if unit == 's' else '',
+                    buckets=THROUGHPUT_BUCKETS if unit == 'By/s' else prometheus_client.Histogram.DEFAULT_BUCKETS,
+                    registry=registry if registry else prometheus_client.REGISTRY
+                )
+
+    def count(self, name: str, value: float = 1):
+        self.metrics[name].inc(value)
+
+    def observe(self, name: str, value: float):
+        self.metrics[name].observe(value)
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Counters and histograms of an OpenTelemetry meter, like opentelemetry.metrics.get_meter('grpcbb').
+    """
+
+    def __init__(self, meter, prefix: str = 'grpcbb.'):
+        self.metrics: Dict[str, Any] = {}
+        for name, (kind, unit, description) in MEASURES.items():
+            self.metrics[name] = (meter.create_counter if kind == 'counter' else meter.create_histogram)(
+                name=prefix + name,
+                unit=unit,
+                description=description
+            )
+
+    def count(self, name: str, value: float = 1):
+        self.metrics[name].add(value)
+
+    def observe(self, name: str, value: float):
+        self.metrics[name].record(value)
+
+
+def measure_stream(buffers: Iterator, instrumentation: Instrumentation, direction: str) -> Generator:
+    # Counts the chunks of a buffer stream, and observes its throughput when it ends.
+    _bytes: int = 0
+    start: float = time.perf_counter()
+    try:
+        for buffer in buffers:
+            if buffer.HasField('chunk'):
+                _bytes += len(buffer.chunk)
+                instrumentation.count(direction + '_bytes', len(buffer.chunk))
+                instrumentation.count(direction + '_chunks')
+            yield buffer
+    finally:
+        elapsed: float = time.perf_counter() - start
+        if _bytes and elapsed > 0:
+            instrumentation.observe('receive_throughput' if direction == 'received' else 'send_throughput',
+                                    _bytes / elapsed)
+
+
+def measure_reads(chunks: Iterator, instrumentation: Instrumentation) -> Generator:
+    # Observes the latency of each chunk read from disk, blocks are given as they are.
+    chunks = iter(chunks)
+    while True:
+        start: float = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        if type(chunk) is bytes:
+            instrumentation.observe('disk_read_seconds', time.perf_counter() - start)
+            instrumentation.count('read_bytes', len(chunk))
+        yield chunk
+
+
+def measure_serialization(chunks: Iterator, instrumentation: Instrumentation) -> Generator:
+    # Observes the time to serialize each chunk of a message on memory.
+    chunks = iter(chunks)
+    while True:
+        start: float = time.perf_counter()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        instrumentation.observe('serialize_seconds', time.perf_counter() - start)
+        instrumentation.count('serialized_bytes', len(chunk))
+        yield chunk
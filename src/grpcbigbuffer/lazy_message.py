@@ -0,0 +1,229 @@
+import mmap
+import os
+import warnings
+from typing import Dict, List, Optional, Tuple, Type, Any
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import Message, DecodeError
+from google.protobuf.message_factory import GetMessageClass
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import get_hash_from_block
+from grpcbigbuffer.disk_stream import scan_records
+from grpcbigbuffer.reader import block_exists, read_field_index
+from grpcbigbuffer.utils import Dir, Enviroment, BLOCK_LENGTH, WITHOUT_BLOCK_POINTERS_FILE_NAME
+
+# Bytes fields from this length are given as file ranges instead of being read.
+LARGE_FIELD_LENGTH = 64 * 1024
+
+# Block pointers are 36 bytes on wbp files built by the parser, a bit more with the hash type.
+MAX_BLOCK_POINTER_LENGTH = 2 * BLOCK_LENGTH
+
+# Field number -> (record start, value start, record end) of each of its records.
+FieldIndex = Dict[int, List[Tuple[int, int, int]]]
+
+
+class FileRange(object):
+    """
+    A range of a file, the value of a large bytes field or the content of a block. It's only read
+     when it's asked for.
+    """
+
+    def __init__(self, filename: str, offset: int, length: int):
+        self.filename: str = filename
+        self.offset: int = offset
+        self.length: int = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __repr__(self) -> str:
+        return f"FileRange({self.filename!r}, {self.offset}, {self.length})"
+
+    def read(self) -> bytes:
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            return f.read(self.length)
+
+    def view(self) -> memoryview:
+        if self.length == 0:
+            return memoryview(b'')
+        with open(self.filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped)[self.offset:self.offset + self.length]
+
+
+def build_field_index(file, offset: int, length: int) -> FieldIndex:
+    index: FieldIndex = {}
+    for field, start, value_start, end in scan_records(file, offset, length):
+        index.setdefault(field, []).append((start, value_start, end))
+    return index
+
+
+class LazyMessage(object):
+    """
+    Read only view of a message stored on a file. The offsets of its fields are indexed once, when the
+     first field is accessed, and each field is decoded on its first access: sub messages as other lazy
+     views, large bytes fields as file ranges, block pointers as the file range of their block and
+     the rest parsed by protobuf.
+    """
+
+    def __init__(
+            self,
+            message_cls: Type[Message],
+            filename: str,
+            offset: int = 0,
+            length: Optional[int] = None,
+            blocks: bool = False,
+            field_index: Optional[Dict] = None,
+            _mapped: Optional[mmap.mmap] = None
+    ):
+        self._cls: Type[Message] = message_cls
+        self._filename: str = filename
+        self._offset: int = offset
+        self._length: int = os.path.getsize(filename) - offset if length is None else length
+        self._blocks: bool = blocks  # The file is the wbp.bin of a multiblock directory.
+        self._owner: bool = _mapped is None
+        self._mapped: Optional[mmap.mmap] = _mapped
+        if self._mapped is None and self._length > 0:
+            with open(filename, 'rb') as f:
+                self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._field_index: Optional[FieldIndex] = None
+        self._persisted_index: Optional[Dict] = field_index  # As generate_field_index writes it.
+        self._values: Dict[str, Any] = {}
+
+    @property
+    def DESCRIPTOR(self):
+        return self._cls.DESCRIPTOR
+
+    def _index(self) -> FieldIndex:
+        if self._field_index is None:
+            if self._persisted_index is not None:
+                self._field_index = {
+                    int(field): [tuple(record[:3]) for record in records]
+                    for field, records in self._persisted_index.items()
+                }
+            else:
+                self._field_index = build_field_index(self._mapped, self._offset, self._length) \
+                    if self._length > 0 else {}
+        return self._field_index
+
+    def _sub_index(self, field: int, position: int) -> Optional[Dict]:
+        if self._persisted_index is None:
+            return None
+        record: List = self._persisted_index[str(field)][position]
+        return record[3] if len(record) > 3 else None
+
+    def _field(self, name: str) -> FieldDescriptor:
+        field: Optional[FieldDescriptor] = self._cls.DESCRIPTOR.fields_by_name.get(name)
+        if not field:
+            raise AttributeError(self._cls.DESCRIPTOR.full_name + ' has not the field ' + name)
+        return field
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._values:
+            self._values[name] = self._decode(self._field(name))
+        return self._values[name]
+
+    def HasField(self, name: str) -> bool:
+        return self._field(name).number in self._index()
+
+    def fields(self) -> List[str]:
+        # Names of the fields present on the message, in field number order.
+        return [self._cls.DESCRIPTOR.fields_by_number[n].name
+                for n in sorted(self._index()) if n in self._cls.DESCRIPTOR.fields_by_number]
+
+    def _decode(self, field: FieldDescriptor):
+        records: List[Tuple[int, int, int]] = self._index().get(field.number, [])
+        is_repeated: bool = field.label == FieldDescriptor.LABEL_REPEATED
+
+        if field.message_type and not field.message_type.GetOptions().map_entry and (is_repeated or len(records) == 1):
+            views = [
+                LazyMessage(
+                    message_cls=GetMessageClass(field.message_type),
+                    filename=self._filename,
+                    offset=value_start,
+                    length=end - value_start,
+                    blocks=self._blocks,
+                    field_index=self._sub_index(field.number, position),
+                    _mapped=self._mapped
+                ) for position, (_, value_start, end) in enumerate(records)
+            ]
+            return views if is_repeated else views[0]
+
+        if field.type == FieldDescriptor.TYPE_BYTES and not is_repeated and records:
+            _, value_start, end = records[-1]  # The last one is the value.
+            if self._blocks and end - value_start <= MAX_BLOCK_POINTER_LENGTH:
+                block_range: Optional[FileRange] = self._get_block_range(value_start, end)
+                if block_range:
+                    return block_range
+            if end - value_start >= LARGE_FIELD_LENGTH:
+                return FileRange(filename=self._filename, offset=value_start, length=end - value_start)
+
+        return getattr(self._parse(numbers=[field.number]), field.name)
+
+    def _get_block_range(self, value_start: int, end: int) -> Optional[FileRange]:
+        # Only blocks stored on a single file can be given as a range.
+        try:
+            block = buffer_pb2.Buffer.Block()
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                block.ParseFromString(self._mapped[value_start:end])
+        except DecodeError:
+            return None
+        block_id: Optional[str] = get_hash_from_block(block=block, internal_block=True) or \
+            get_hash_from_block(block=block)
+        if not block_id:
+            return None
+        b, d = block_exists(block_id=block_id, is_dir=True)
+        if not b or d:
+            return None
+        return FileRange(
+            filename=Enviroment.block_dir + block_id,
+            offset=0,
+            length=os.path.getsize(Enviroment.block_dir + block_id)
+        )
+
+    def _parse(self, numbers: Optional[List[int]] = None) -> Message:
+        message: Message = self._cls()
+        records: List[Tuple[int, int, int]] = sorted(
+            r for n, _records in self._index().items() if numbers is None or n in numbers for r in _records
+        )
+        for start, _, end in records:
+            message.MergeFromString(self._mapped[start:end])
+        return message
+
+    def parse(self) -> Message:
+        """
+        Parses the complete message. Block pointers are kept as they are on the file.
+        """
+        return self._parse()
+
+    def close(self):
+        if self._owner and self._mapped is not None:
+            self._mapped.close()
+        self._mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, trace):
+        self.close()
+
+
+def lazy_parse_dir(_dir: Dir) -> LazyMessage:
+    """
+    Same message than parse_dir, but read from disk only the fields that are accessed.
+    The field index of multiblock directories is used instead of scanning their wbp file.
+    """
+    if os.path.isdir(_dir.dir):
+        field_index: Optional[Dict] = read_field_index(directory=_dir.dir)
+        return LazyMessage(
+            message_cls=_dir.type,
+            filename=_dir.dir + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME,
+            blocks=True,
+            field_index=field_index['wbp'] if field_index else None
+        )
+    return LazyMessage(message_cls=_dir.type, filename=_dir.dir)
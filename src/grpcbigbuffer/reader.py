@@ -1,13 +1,18 @@
 import gc
 import json
+import mmap
 import os
 import shutil
 from io import BufferedReader
-from typing import Generator, Union
+from typing import Generator, Union, List, Dict, Optional, Tuple, Type
 
-from google.protobuf.message import DecodeError
+from google.protobuf.message import DecodeError, Message
 from grpcbigbuffer import buffer_pb2
-from grpcbigbuffer.utils import Signal, CHUNK_SIZE, METADATA_FILE_NAME, Enviroment
+from grpcbigbuffer.block_driver import generate_field_index
+from grpcbigbuffer.disk_stream import read_varint
+from grpcbigbuffer.instrumentation import Instrumentation, measure_reads
+from grpcbigbuffer.utils import Signal, CHUNK_SIZE, METADATA_FILE_NAME, Enviroment, BEE_FILE_MAGIC, \
+    BEE_FILE_FOOTER_LENGTH, encode_bytes, FIELD_INDEX_FILE_NAME, WITHOUT_BLOCK_POINTERS_FILE_NAME
 
 
 def block_exists(block_id: str, is_dir: bool = False) -> bool:
@@ -80,42 +85,204 @@ def read_block(block_id: str) -> Generator[Union[bytes, buffer_pb2.Buffer.Block]
         raise Exception('gRPCbb: Error reading block.')
 
 
-def read_from_registry(filename: str, signal: Signal = None) -> Generator[buffer_pb2.Buffer, None, None]:
-    for c in read_multiblock_directory(
-            directory=filename,
-            ignore_blocks=False
+def read_from_registry(
+        filename: str,
+        signal: Signal = None,
+        instrumentation: Optional[Instrumentation] = None
+) -> Generator[buffer_pb2.Buffer, None, None]:
+    chunks = read_multiblock_directory(
+        directory=filename,
+        ignore_blocks=False
     ) if os.path.isdir(filename) else \
-            read_file_by_chunks(
-                filename=filename,
-                signal=signal
-            ):
+        read_file_by_chunks(
+            filename=filename,
+            signal=signal
+        )
+    if instrumentation is None: instrumentation = Enviroment.instrumentation
+    if instrumentation:
+        chunks = measure_reads(chunks=chunks, instrumentation=instrumentation)
+    for c in chunks:
         yield buffer_pb2.Buffer(chunk=c) if type(c) is bytes else buffer_pb2.Buffer(block=c)
 
 
-def read_bee_file(filename: str) -> Generator[buffer_pb2.Buffer, None, None]:
+def read_file_ranges(filename: str) -> Generator[Tuple[str, int, int], None, None]:
+    size: int = os.path.getsize(filename)
+    for offset in range(0, size, CHUNK_SIZE):
+        yield filename, offset, min(CHUNK_SIZE, size - offset)
+
+
+def read_multiblock_directory_ranges(directory: str) \
+        -> Generator[Union[Tuple[str, int, int], buffer_pb2.Buffer.Block], None, None]:
     """
-    Reads a `.bee` file containing serialized buffer_pb2.Buffer objects with length-prefixed encoding.
+    Same as read_multiblock_directory without ignoring blocks, but yields the (filename, offset, length)
+     range of each chunk instead of reading it.
+    """
+    if directory[-1] != '/':
+        directory = directory + '/'
+    with open(directory + METADATA_FILE_NAME) as f:
+        _json = json.load(f)
+    for e in _json:
+        if type(e) == int:
+            yield from read_file_ranges(filename=directory + str(e))
+        else:
+            block_id: str = e[0]
+            if type(block_id) != str:
+                raise Exception('gRPCbb error on block metadata file ( _.json ).')
+            block = buffer_pb2.Buffer.Block(
+                hashes=[buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=bytes.fromhex(block_id))],
+                previous_lengths_position=e[1]
+            )
+            yield block
+            b, d = block_exists(block_id=block_id, is_dir=True)
+            if b and not d:
+                yield from read_file_ranges(filename=Enviroment.block_dir + block_id)
+            elif d:
+                yield from read_multiblock_directory_ranges(directory=Enviroment.block_dir + block_id)
+            else:
+                raise Exception('gRPCbb: Error reading block.')
+            yield block
 
-    Each message is preceded by a 4-byte big-endian integer indicating its length. This function
-    parses and yields each message as a buffer_pb2.Buffer object.
 
-    Args:
-        filename (str): Path to the `.bee` file.
+def read_registry_ranges(filename: str) \
+        -> Generator[Union[Tuple[str, int, int], buffer_pb2.Buffer.Block], None, None]:
+    """
+    Same chunks and blocks as read_from_registry, as file ranges that can be copied without reading them.
+    """
+    yield from read_multiblock_directory_ranges(directory=filename) if os.path.isdir(filename) else \
+        read_file_ranges(filename=filename)
 
-    Yields:
-        buffer_pb2.Buffer: Parsed protobuf message.
 
-    Raises:
-        ValueError: If a message cannot be fully read or deserialized.
+def read_field_index(directory: str) -> Optional[Dict]:
+    """
+    Returns the field index of a multiblock directory, None if it was not written.
+    """
+    try:
+        with open(os.path.join(directory, FIELD_INDEX_FILE_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def get_field_ranges(directory: str, path: List[int], real: bool = True,
+                     message_cls: Optional[Type[Message]] = None) \
+        -> Generator[List[Tuple[str, int, int]], None, None]:
+    """
+    Yields, for each value of the field on the path of field numbers, its (filename, offset, length)
+     ranges. Values on the real layout can be split between parts and blocks, wbp values are on one range.
+    The field index is written on the first call, up to the depth of the path, which needs the message
+     class for nested fields.
+    """
+    field_index: Optional[Dict] = read_field_index(directory=directory)
+    if not field_index or field_index.get('depth', 1) < len(path):
+        if len(path) > 1 and not message_cls:
+            raise Exception('gRPCbb: the message class is needed to index the nested fields of ' + directory)
+        generate_field_index(dirname=directory, message_cls=message_cls, depth=len(path))
+        field_index = read_field_index(directory=directory)
+    if real and field_index['real'] is None:
+        raise Exception('gRPCbb: the directory ' + directory + ' has not a field index of its real layout.')
+
+    nodes: List[Dict] = [field_index['real' if real else 'wbp']]
+    for field in path[:-1]:
+        nodes = [record[3] for node in nodes for record in node.get(str(field), []) if len(record) > 3]
+    records: List[List] = [record for node in nodes for record in node.get(str(path[-1]), [])]
+
+    if not real:
+        for record in records:
+            yield [(os.path.join(directory, WITHOUT_BLOCK_POINTERS_FILE_NAME), record[1], record[2] - record[1])]
+        return
+
+    files: List[Tuple[str, int, int]] = []  # filename, start and end on the real layout.
+    position: int = 0
+    for e, size in field_index['files']:
+        files.append((os.path.join(directory, str(e)) if type(e) == int else Enviroment.block_dir + e,
+                      position, position + size))
+        position += size
+    for record in records:
+        yield [
+            (filename, max(record[1], start) - start, min(record[2], end) - max(record[1], start))
+            for filename, start, end in files if start < record[2] and record[1] < end
+        ]
+
+
+class BeeFileIndex:
+    """
+    Index of the buffers of a `.bee` file, built while they are written or scanned. It records the
+     messages (head index, start and end offsets and the ranges of their chunks) and, for each block,
+     the ranges between its two block buffers.
+    """
+
+    def __init__(self):
+        self.messages: List[Dict] = []
+        self.blocks: Dict[str, List[List[int]]] = {}
+        self.open_blocks: Dict[str, int] = {}
+        self.message: Optional[Dict] = None
+
+    def add(self, buff: buffer_pb2.Buffer, offset: int, size: int, chunk_length: Optional[int] = None):
+        """
+        Adds the buffer serialized on size bytes after its length prefix, which is at offset.
+        The chunk_length is given when the chunk is written apart from the buffer.
+        """
+        if chunk_length is None and buff.HasField('chunk'):
+            chunk_length = len(buff.chunk)
+        end: int = offset + 4 + size
+        if buff.HasField('head') or self.message is None:
+            self.message = {
+                'index': buff.head.index if buff.HasField('head') else None,
+                'start': offset,
+                'end': end,
+                'chunks': []
+            }
+            self.messages.append(self.message)
+        self.message['end'] = end
+
+        if buff.HasField('block'):
+            for _hash in buff.block.hashes:
+                if _hash.type == Enviroment.hash_type:
+                    block_id: str = _hash.value.hex()
+                    if block_id in self.open_blocks:
+                        self.blocks.setdefault(block_id, []).append([self.open_blocks.pop(block_id), end])
+                    else:
+                        self.open_blocks[block_id] = offset
+
+        if chunk_length:
+            # The chunk is the first field of the serialized buffer.
+            self.message['chunks'].append(
+                [offset + 4 + 1 + len(encode_bytes(chunk_length)), chunk_length]
+            )
+
+        if buff.HasField('separator') and buff.separator:
+            self.message = None
+
+    def to_dict(self) -> Dict:
+        return {'version': 2, 'messages': self.messages, 'blocks': self.blocks}
+
+
+def get_bee_file_data_range(filename: str) -> Tuple[int, int]:
+    """
+    Returns the start and end offsets of the length prefixed buffers of a v1 or v2 `.bee` file.
+    """
+    size: int = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        if f.read(len(BEE_FILE_MAGIC)) != BEE_FILE_MAGIC:
+            return 0, size
+        f.seek(size - BEE_FILE_FOOTER_LENGTH)
+        index_length: int = int.from_bytes(f.read(8), byteorder='big')
+        if f.read(len(BEE_FILE_MAGIC)) != BEE_FILE_MAGIC:
+            raise ValueError("Invalid file format: Incomplete bee file footer.")
+        return len(BEE_FILE_MAGIC), size - BEE_FILE_FOOTER_LENGTH - index_length
+
+
+def read_bee_records(filename: str, start: int, end: int) -> Generator[Tuple[int, int, buffer_pb2.Buffer], None, None]:
+    """
+    Yields the offset, the size and the parsed buffer of each length prefixed record between start and end.
     """
     try:
         with open(filename, 'rb') as f:
-            while True:
+            f.seek(start)
+            offset: int = start
+            while offset < end:
                 # Read the 4-byte length prefix
                 size_bytes = f.read(4)
-                if not size_bytes:
-                    break  # End of file
-
                 if len(size_bytes) != 4:
                     raise ValueError("Invalid file format: Could not read message size.")
 
@@ -134,6 +301,135 @@ def read_bee_file(filename: str) -> Generator[buffer_pb2.Buffer, None, None]:
                 except DecodeError as e:
                     raise ValueError(f"Failed to parse message: {e}")
 
-                yield buff
+                yield offset, message_size, buff
+                offset += 4 + message_size
+    finally:
+        gc.collect()
+
+
+def scan_bee_records(filename: str, start: int, end: int) \
+        -> Generator[Tuple[int, int, Optional[buffer_pb2.Buffer], Optional[Tuple[int, int]]], None, None]:
+    """
+    Same records as read_bee_records, but the chunk of each buffer is recognised on the wire, as the
+     first field of the record, and given as its (offset, length) range of the file, so it is neither
+     read nor parsed. Only the rest of the buffer (head, block, signal or separator) is parsed, None if empty.
+    """
+    if end <= start:
+        return
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with mapped:
+        offset: int = start
+        while offset < end:
+            if offset + 4 > end:
+                raise ValueError("Invalid file format: Could not read message size.")
+            message_size: int = int.from_bytes(mapped[offset:offset + 4], byteorder='big')
+            position: int = offset + 4
+            record_end: int = position + message_size
+            if record_end > end:
+                raise ValueError("Invalid file format: Incomplete message data.")
+
+            chunk: Optional[Tuple[int, int]] = None
+            if message_size > 0 and mapped[position] == 0x0a:  # Field 1 (chunk), length delimited.
+                length, position = read_varint(mapped, position + 1)
+                chunk = (position, length)
+                position += length
+                if position > record_end:
+                    raise ValueError("Invalid file format: Incomplete message data.")
+
+            control: Optional[buffer_pb2.Buffer] = None
+            if position < record_end:
+                control = buffer_pb2.Buffer()
+                try:
+                    control.ParseFromString(mapped[position:record_end])
+                except DecodeError as e:
+                    raise ValueError(f"Failed to parse message: {e}")
+                if control.HasField('chunk'):
+                    chunk = None  # Not serialized first, it was parsed with the rest.
+
+            yield offset, message_size, control, chunk
+            offset = record_end
+
+
+def read_bee_index(filename: str) -> Dict:
+    """
+    Returns the index of a `.bee` file. v2 files have it on their footer, v1 files are scanned.
+
+    Args:
+        filename (str): Path to the `.bee` file.
+
+    Returns:
+        Dict: The messages, with their head index, start and end offsets and chunk ranges (offset
+              and length), the blocks with the ranges between its block buffers, and the data end offset.
+    """
+    start, end = get_bee_file_data_range(filename=filename)
+    if start > 0:
+        with open(filename, 'rb') as f:
+            f.seek(end)
+            bee_index: Dict = json.loads(f.read(os.path.getsize(filename) - BEE_FILE_FOOTER_LENGTH - end))
+    else:
+        index = BeeFileIndex()
+        for offset, size, control, chunk in scan_bee_records(filename=filename, start=start, end=end):
+            index.add(
+                buff=control if control else buffer_pb2.Buffer(),
+                offset=offset,
+                size=size,
+                chunk_length=chunk[1] if chunk else None
+            )
+        bee_index: Dict = index.to_dict()
+        bee_index['version'] = 1
+    bee_index['data_end'] = end
+    return bee_index
+
+
+def read_bee_file(filename: str, message: Optional[int] = None) -> Generator[buffer_pb2.Buffer, None, None]:
+    """
+    Reads a `.bee` file containing serialized buffer_pb2.Buffer objects with length-prefixed encoding.
+
+    Each message is preceded by a 4-byte big-endian integer indicating its length. This function
+    parses and yields each message as a buffer_pb2.Buffer object. v2 files start with a magic
+    number and end with an index of their content, so a single message can be read by seeking to it.
+
+    Args:
+        filename (str): Path to the `.bee` file.
+        message (int, optional): Position of the only message to read. Defaults to `None`, all of them.
+
+    Yields:
+        buffer_pb2.Buffer: Parsed protobuf message.
+
+    Raises:
+        ValueError: If a message cannot be fully read or deserialized.
+    """
+    if message is None:
+        start, end = get_bee_file_data_range(filename=filename)
+    else:
+        _message: Dict = read_bee_index(filename=filename)['messages'][message]
+        start, end = _message['start'], _message['end']
+
+    for _, _, buff in read_bee_records(filename=filename, start=start, end=end):
+        yield buff
+
+
+def read_bee_chunks(filename: str, message: int) -> Generator[memoryview, None, None]:
+    """
+    Yields the content of a message of a `.bee` file as memoryviews over a memory map of the file.
+    The views have to be released, or dropped, before the generator ends, when the map is closed. A view
+     still referenced then keeps the map, and its file descriptor, open until they are garbage collected.
+    """
+    bee_index: Dict = read_bee_index(filename=filename)
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        for offset, length in bee_index['messages'][message]['chunks']:
+            yield view[offset:offset + length]
     finally:
-        gc.collect()
\ No newline at end of file
+        view.release()
+        try:
+            mapped.close()
+        except BufferError:  # Some views are still referenced.
+            pass
+
+
+def bee_file_contains_block(filename: str, block_id: str) -> bool:
+    return block_id in read_bee_index(filename=filename)['blocks']
@@ -0,0 +1,223 @@
+import os
+import queue
+import threading
+from hashlib import sha3_256
+from typing import Callable, Generator, Iterator, List, Optional, Set
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import BufferStream, send_with_credits, get_hash_from_block, block_exists, \
+    signal_block_buffer_stream, block_announcement, generate_random_file, move_to_block_dir, remove_file
+from grpcbigbuffer.instrumentation import Instrumentation, measure_stream
+from grpcbigbuffer.utils import Signal, Enviroment, FLOW_CONTROL_WINDOW
+
+
+def read_ahead(
+        iterator: Iterator[buffer_pb2.Buffer],
+        size: int,
+        signal: Optional[Signal] = None
+) -> Generator[buffer_pb2.Buffer, None, None]:
+    """
+    Iterates the buffers on a thread, up to size buffers before they're consumed, so the stream is
+     received while the previous buffers are sent.
+    With the signal of the hop, the credits and the block announcements of its parser are sent
+     while waiting for the buffers.
+    """
+    if size <= 0:
+        yield from iterator
+        return
+
+    items: queue.Queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                if signal:
+                    signal.notify()
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for buffer in iterator:
+                put(buffer)
+                if stop.is_set():
+                    return
+            put(end)
+        except BaseException as e:
+            put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            if signal and signal.window:
+                credit: Optional[int] = signal.wait_grant(ready=lambda: not items.empty())
+                announced: List[str] = signal.take_announced()
+                for block_id in announced:
+                    yield block_announcement(block_id=block_id)
+                if credit:
+                    yield buffer_pb2.Buffer(credit=credit)
+                if credit or announced:
+                    continue
+            item = items.get()
+            if item is end:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class Relay(object):
+    """
+    Forwards a received buffer stream to another stream buffer by buffer, without parsing its messages.
+    Each side is its own hop: the signals, credits and batch negotiation of the received stream are
+     applied to receive_signal, and the forwarded stream carries those of send_signal. Batches are
+     unpacked if the next peer doesn't decode them.
+    The blocks that aren't on the registry are written to it as they pass. The content of the blocks
+     that the next peer announces is not forwarded, only their block buffers, and if the block is on
+     the registry too the announcement is passed on to the previous peer.
+    """
+
+    def __init__(
+            self,
+            request_iterator,
+            receive_signal: Optional[Signal] = None,
+            send_signal: Optional[Signal] = None,
+            read_ahead: int = 16,
+            instrumentation: Optional[Instrumentation] = None
+    ):
+        if instrumentation is None:
+            instrumentation = Enviroment.instrumentation
+        self.receive_signal: Signal = receive_signal if receive_signal else Signal(exist=False)
+        self.send_signal: Signal = send_signal if send_signal else Signal(exist=False)
+        self.stream = BufferStream(request_iterator=request_iterator, signal=self.receive_signal,
+                                   instrumentation=instrumentation)
+        self.read_ahead: int = read_ahead
+        self.instrumentation: Optional[Instrumentation] = instrumentation
+        self.blocks: List[str] = []  # Open blocks, up to Enviroment.block_depth levels.
+        # The outermost block, written to the cache and moved to the registry once its hash is verified.
+        self.block_file: Optional[str] = None
+        self.block_hash = None
+        self.file = None
+        self.announced: Set[str] = set()  # Blocks announced to the previous peer.
+
+    def open_block(self, block_id: str):
+        if len(self.blocks) > 1:
+            return  # Its content is part of the outer block.
+        if block_exists(block_id):
+            # Not announced until the next peer has it too, its content is forwarded meanwhile.
+            if self.instrumentation:
+                self.instrumentation.count('blocks_skipped')
+        else:
+            self.block_file = generate_random_file()
+            self.block_hash = sha3_256()
+            self.file = open(self.block_file, 'wb')
+
+    def close_block(self, block_id: str):
+        if self.blocks or not self.file:
+            return
+        self.file.close()
+        if self.block_hash.hexdigest() == block_id:
+            move_to_block_dir(file_hash=block_id, file_path=self.block_file)
+        elif self.instrumentation:
+            self.instrumentation.count('blocks_rejected')
+        self.abort()  # The file is left on the cache if the block was wrong or was added meanwhile.
+
+    def abort(self):
+        # Drops the file of the open block, if it has not been moved to the registry.
+        if self.file:
+            self.file.close()
+        if self.block_file and os.path.isfile(self.block_file):
+            remove_file(self.block_file)
+        self.block_file, self.block_hash, self.file = None, None, None
+
+    def announce(self):
+        # The open block is on the registry and the next peer has it, so the previous one can stop sending it.
+        block_id: str = self.blocks[0]
+        if not self.file and block_id not in self.announced and block_id in self.send_signal.peer_blocks:
+            self.announced.add(block_id)
+            signal_block_buffer_stream(block_id, signal=self.receive_signal)
+
+    def tee(self, buffer: buffer_pb2.Buffer):
+        # Writes the chunk of the buffer to the open block.
+        if buffer.HasField('block'):
+            block_id: str = get_hash_from_block(buffer.block)
+            if block_id:
+                if self.blocks and self.blocks[-1] == block_id:
+                    self.blocks.pop()
+                    self.close_block(block_id)
+                elif block_id in self.blocks:
+                    raise Exception('gRPCbb: IntersectionError: Intersections between blocks are not allowed.')
+                elif len(self.blocks) < Enviroment.block_depth:
+                    self.blocks.append(block_id)
+                    self.open_block(block_id)
+        if buffer.chunk and self.file:
+            self.file.write(buffer.chunk)
+            self.block_hash.update(buffer.chunk)
+        if self.blocks:
+            self.announce()
+
+    def unbatch(self, buffer: buffer_pb2.Buffer) -> Generator[buffer_pb2.Buffer, None, None]:
+        # The messages of a batch, each one on its own buffer.
+        batch = buffer_pb2.Buffer.Batch.FromString(buffer.chunk)
+        for index, message in zip(batch.indices, batch.messages):
+            yield buffer_pb2.Buffer(chunk=message, head=buffer_pb2.Buffer.Head(index=index), separator=True)
+
+    def buffers(self) -> Generator[buffer_pb2.Buffer, None, None]:
+        try:
+            while True:
+                buffer: Optional[buffer_pb2.Buffer] = self.stream.next()
+                if buffer is None:
+                    break
+                # The signals and credits of the received stream are of its own hop.
+                for field in ('signal', 'credit', 'accepts_batch'):
+                    buffer.ClearField(field)
+                self.tee(buffer)
+                if buffer.batch and not self.send_signal.peer_reads_batches:
+                    yield from self.unbatch(buffer)
+                else:
+                    yield buffer
+            if self.blocks:
+                raise Exception('gRPCbb: the stream ended inside the block ' + self.blocks[-1])
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self.stream.close()
+
+    def __iter__(self) -> Iterator[buffer_pb2.Buffer]:
+        buffers = read_ahead(
+            iterator=send_with_credits(buffers=self.buffers(), signal=self.send_signal,
+                                       instrumentation=self.instrumentation),
+            size=self.read_ahead,
+            signal=self.send_signal
+        )
+        return measure_stream(buffers=buffers, instrumentation=self.instrumentation, direction='sent') \
+            if self.instrumentation else buffers
+
+
+def relay_grpc(
+        method: Callable,
+        request_iterator,
+        timeout=None,
+        read_ahead: int = 16,
+        flow_control_window: Optional[int] = FLOW_CONTROL_WINDOW,
+        instrumentation: Optional[Instrumentation] = None
+) -> Generator[buffer_pb2.Buffer, None, None]:
+    """
+    Forwards the request stream of a call to the method of the next hop, and returns its response
+     stream to be forwarded back, both through a Relay. To be yielded from a stream stream servicer
+     method of the relay node.
+    """
+    previous_hop = Signal(window=flow_control_window)
+    next_hop = Signal(window=flow_control_window)
+    requests = Relay(request_iterator=request_iterator, receive_signal=previous_hop, send_signal=next_hop,
+                     read_ahead=read_ahead, instrumentation=instrumentation)
+    responses = Relay(request_iterator=method(iter(requests), timeout=timeout), receive_signal=next_hop,
+                      send_signal=previous_hop, read_ahead=read_ahead, instrumentation=instrumentation)
+    yield from responses
@@ -0,0 +1,255 @@
+import functools
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Type, Union
+
+import grpc
+from google.protobuf.message import Message
+
+from grpcbigbuffer import buffer_pb2
+from grpcbigbuffer.client import parse_from_buffer, serialize_to_buffer, block_announcement
+from grpcbigbuffer.utils import Signal, MemoryBudget, Enviroment, CHUNK_SIZE, FLOW_CONTROL_WINDOW
+
+
+class SignalPool(object):
+    # Reuses the Signal objects of finished calls.
+    def __init__(self, size: int = 64, window: Optional[int] = None):
+        self.size: int = size
+        self.window: Optional[int] = window
+        self.signals: List[Signal] = []
+        self.lock = threading.Lock()
+
+    def acquire(self) -> Signal:
+        with self.lock:
+            if self.signals:
+                return self.signals.pop()
+        return Signal(window=self.window)
+
+    def release(self, signal: Signal):
+        signal.reset()
+        with self.lock:
+            if len(self.signals) < self.size:
+                self.signals.append(signal)
+
+
+class BeeServer(object):
+    """
+    Serves Bee-RPC stream methods with shared resources: a limit of concurrent calls, a budget of
+     buffered bytes in flight for all the calls, a thread pool that reads ahead the request and
+     response streams of each call, and a pool of signals.
+    """
+
+    def __init__(
+            self,
+            max_concurrent_calls: int = 16,
+            max_bytes_in_flight: Optional[int] = 64 * CHUNK_SIZE,
+            read_ahead: int = 4,
+            admission_timeout: Optional[float] = None,
+            flow_control_window: Optional[int] = FLOW_CONTROL_WINDOW
+    ):
+        self.max_concurrent_calls: int = max_concurrent_calls
+        self.read_ahead: int = read_ahead
+        self.admission_timeout: Optional[float] = admission_timeout
+        self.transfers = MemoryBudget(limit=max_bytes_in_flight)
+        # Each call reads ahead its request and its response streams.
+        self.executor = ThreadPoolExecutor(max_workers=2 * max_concurrent_calls)
+        # The credits are granted on the response stream while the handler is busy, so only with read ahead.
+        self.signals = SignalPool(
+            size=max_concurrent_calls,
+            window=flow_control_window if read_ahead > 0 else None
+        )
+        self.condition = threading.Condition()
+        self.active_calls: int = 0
+        self.waiting_calls: int = 0
+        self.queued_buffers: int = 0
+
+    def admit(self) -> bool:
+        with self.condition:
+            self.waiting_calls += 1
+            admitted: bool = self.condition.wait_for(
+                lambda: self.active_calls < self.max_concurrent_calls,
+                timeout=self.admission_timeout
+            )
+            self.waiting_calls -= 1
+            if admitted:
+                self.active_calls += 1
+            return admitted
+
+    def leave(self):
+        with self.condition:
+            self.active_calls -= 1
+            self.condition.notify()
+
+    def prefetch(
+            self,
+            iterator: Iterator[buffer_pb2.Buffer],
+            signal: Optional[Signal] = None,
+            producers: Optional[List[Future]] = None
+    ) -> Generator[buffer_pb2.Buffer, None, None]:
+        """
+        Iterates the buffers on the thread pool, up to read_ahead buffers before they're consumed.
+        Their bytes are held on the transfers budget until then. The task that reads them is appended
+         to producers.
+        With the signal of the call, the credits and the block announcements of its parser are sent
+         while waiting for the buffers.
+        """
+        if self.read_ahead <= 0:
+            yield from iterator
+            return
+
+        items: queue.Queue = queue.Queue(maxsize=self.read_ahead)
+        stop = threading.Event()
+        end = object()
+
+        def put(item, length: int):
+            with self.condition:
+                self.queued_buffers += 1
+            while not stop.is_set():
+                try:
+                    items.put((item, length), timeout=0.1)
+                    if signal:
+                        signal.notify()
+                    return
+                except queue.Full:
+                    pass
+            with self.condition:
+                self.queued_buffers -= 1
+            self.transfers.release(length)
+
+        def produce():
+            try:
+                for buffer in iterator:
+                    length: int = buffer.ByteSize()
+                    self.transfers.acquire(length)
+                    put(buffer, length)
+                    if stop.is_set():
+                        return
+                put(end, 0)
+            except BaseException as e:
+                put(e, 0)
+
+        producer: Future = self.executor.submit(produce)
+        if producers is not None:
+            producers.append(producer)
+        try:
+            while True:
+                if signal and signal.window:
+                    credit: Optional[int] = signal.wait_grant(ready=lambda: not items.empty())
+                    announced: List[str] = signal.take_announced()
+                    for block_id in announced:
+                        yield block_announcement(block_id=block_id)
+                    if credit:
+                        yield buffer_pb2.Buffer(credit=credit)
+                    if credit or announced:
+                        continue
+                item, length = items.get()
+                with self.condition:
+                    self.queued_buffers -= 1
+                self.transfers.release(length)
+                if item is end:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            while True:
+                try:
+                    item, length = items.get_nowait()
+                except queue.Empty:
+                    break
+                with self.condition:
+                    self.queued_buffers -= 1
+                self.transfers.release(length)
+
+    def release_signal(self, signal: Signal, producers: List[Future]):
+        # The signal goes back to the pool once the producers of its call have ended.
+        remaining: List[int] = [len(producers)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            self.signals.release(signal)
+
+        if not producers:
+            self.signals.release(signal)
+        for producer in producers:
+            producer.add_done_callback(done)
+
+    def method(
+            self,
+            indices_parser: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+            partitions_message_mode_parser: Union[bool, None, Dict[int, Optional[bool]]] = False,
+            indices_serializer: Union[Message, Dict[int, Union[Type[bytes], Message]]] = None,
+            mem_manager=None,
+            debug: Callable[[str], None] = lambda s: None
+    ):
+        """
+        Decorates a servicer method that receives the parsed input messages and the context, and returns
+         a message or an iterator of them, as the stream stream method of a Bee-RPC service.
+        """
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def servicer_method(*args):
+                *prefix, request_iterator, context = args
+                if not self.admit():
+                    context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'gRPCbb server: too many concurrent calls.')
+                signal: Signal = self.signals.acquire()
+                producers: List[Future] = []
+                # gRPC doesn't resume a cancelled response stream, so the signal wakes its waits.
+                ended: List[bool] = [False]
+                lock = threading.Lock()
+
+                def cancel():
+                    with lock:
+                        if not ended[0]:
+                            signal.cancel()
+
+                context.add_callback(cancel)
+                try:
+                    output = handler(*prefix, parse_from_buffer(
+                        request_iterator=self.prefetch(iter(request_iterator)),
+                        signal=signal,
+                        indices=dict(indices_parser) if type(indices_parser) is dict else indices_parser,
+                        partitions_message_mode=partitions_message_mode_parser,
+                        mem_manager=mem_manager if mem_manager else Enviroment.mem_manager,
+                        debug=debug
+                    ), context)
+                    yield from self.prefetch(serialize_to_buffer(
+                        message_iterator=output if output is not None else buffer_pb2.Empty(),
+                        signal=signal,
+                        indices=dict(indices_serializer) if type(indices_serializer) is dict else indices_serializer,
+                        mem_manager=mem_manager,
+                        debug=debug
+                    ), signal=signal, producers=producers)
+                finally:
+                    # A cancelled call can leave its producer inside the serializer, using the signal.
+                    with lock:
+                        ended[0] = True
+                        signal.cancel()
+                    self.release_signal(signal=signal, producers=producers)
+                    self.leave()
+
+            return servicer_method
+
+        return decorator
+
+    def metrics(self) -> Dict[str, Optional[int]]:
+        transfers: Dict[str, Optional[int]] = self.transfers.usage()
+        with self.condition:
+            return {
+                'active_calls': self.active_calls,
+                'waiting_calls': self.waiting_calls,
+                'queued_buffers': self.queued_buffers,
+                'bytes_in_flight': transfers['used'],
+                'bytes_in_flight_peak': transfers['peak'],
+                'waiting_transfers': transfers['waiting'],
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from hashlib import sha3_256
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+import grpc
+
+from grpcbigbuffer.client import parse_from_buffer, serialize_to_buffer, generate_random_file, move_to_block_dir, \
+    remove_file
+from grpcbigbuffer.events import parse_events, CHUNK
+from grpcbigbuffer.instrumentation import Instrumentation
+from grpcbigbuffer.reader import block_exists
+from grpcbigbuffer.utils import Dir, Enviroment, Signal, METADATA_FILE_NAME, FLOW_CONTROL_WINDOW
+
+
+def manifest_blocks(manifest: str) -> List[str]:
+    """
+    The blocks of an object, from its _.json metadata file or its multiblock directory, in the order
+     they're on the object and each one once.
+    """
+    if os.path.isdir(manifest):
+        manifest = os.path.join(manifest, METADATA_FILE_NAME)
+    with open(manifest) as f:
+        _json = json.load(f)
+    blocks: List[str] = []
+    for e in _json:
+        if type(e) != int:
+            if type(e[0]) != str:
+                raise Exception('gRPCbb error on block metadata file ( _.json ).')
+            if e[0] not in blocks:
+                blocks.append(e[0])
+    return blocks
+
+
+def is_block_id(block_id: str) -> bool:
+    try:
+        return len(bytes.fromhex(block_id)) == sha3_256().digest_size
+    except ValueError:
+        return False
+
+
+def block_servicer(block_dir: Optional[str] = None) -> Callable:
+    """
+    Stream stream servicer method that sends the blocks of block_dir (the registry by default) to the
+     peers that download them: the request is the id of each block and the response its content.
+    """
+
+    def serve_blocks(request_iterator, context):
+        directory: str = block_dir if block_dir else Enviroment.block_dir
+        signal = Signal(window=FLOW_CONTROL_WINDOW)
+        for block_id in parse_from_buffer(request_iterator=request_iterator, signal=signal, indices={0: bytes},
+                                          partitions_message_mode=True):
+            block_id: str = block_id.decode()
+            # Only the blocks stored as a file can be verified by the hash of their content.
+            if not is_block_id(block_id) or not os.path.isfile(directory + block_id):
+                context.abort(grpc.StatusCode.NOT_FOUND, 'gRPCbb: the block ' + block_id + ' is not on the registry.')
+            yield from serialize_to_buffer(message_iterator=Dir(dir=directory + block_id, _type=bytes), signal=signal)
+
+    return serve_blocks
+
+
+class BlockDownload(object):
+    """
+    Download of a block from a peer, to a file that is moved to the registry once its hash is verified.
+    The time of its last received buffer is kept, so it can be cancelled if it stalls.
+    """
+
+    def __init__(self, block_id: str, peer: int, method: Callable):
+        self.block_id: str = block_id
+        self.peer: int = peer
+        self.method: Callable = method
+        self.progress: float = time.monotonic()
+        self.call = None
+        self.cancelled: bool = False
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.call:
+                self.call.cancel()
+
+    def run(self) -> int:
+        # Returns the bytes received.
+        signal = Signal(window=FLOW_CONTROL_WINDOW)
+        with self.lock:
+            if self.cancelled:
+                raise Exception('gRPCbb: the download of the block ' + self.block_id + ' has been cancelled.')
+            self.call = self.method(
+                serialize_to_buffer(message_iterator=iter([self.block_id.encode()]), signal=signal)
+            )
+        filename: str = generate_random_file()
+        block_hash = sha3_256()
+        length: int = 0
+        try:
+            with open(filename, 'wb') as f:
+                for event in parse_events(request_iterator=self.call, indices={0: bytes}, signal=signal):
+                    self.progress = time.monotonic()
+                    if event.kind == CHUNK:
+                        f.write(event.value)
+                        block_hash.update(event.value)
+                        length += len(event.value)
+            if block_hash.hexdigest() != self.block_id:
+                raise Exception('gRPCbb: the block ' + self.block_id + ' received does not match its hash.')
+            move_to_block_dir(file_hash=self.block_id, file_path=filename)
+            return length
+        finally:
+            if os.path.isfile(filename):
+                remove_file(filename)
+
+
+def swarm_download(
+        methods: List[Callable],
+        manifest: str,
+        stall_timeout: float = 10,
+        downloads_per_peer: int = 2,
+        instrumentation: Optional[Instrumentation] = None
+) -> List[str]:
+    """
+    Downloads the blocks of an object that are not on the registry from several peers at once, each
+     block from one of them. The methods are the block_servicer methods of the peers, and the manifest the
+     _.json metadata file (or the multiblock directory) of the object.
+    A block that fails, doesn't match its hash, or doesn't receive a buffer for stall_timeout seconds is
+     asked again to another peer, and the download fails if no peer can send it.
+    Returns the blocks downloaded.
+    """
+    if instrumentation is None:
+        instrumentation = Enviroment.instrumentation
+    pending: Deque[str] = deque(b for b in manifest_blocks(manifest=manifest) if not block_exists(block_id=b))
+    tried: Dict[str, Set[int]] = {block_id: set() for block_id in pending}
+    busy: List[int] = [0 for _ in methods]
+    active: Dict[Future, BlockDownload] = {}
+    downloaded: List[str] = []
+
+    def next_peer(block_id: str) -> Optional[int]:
+        # The least busy peer that has not been tried for the block, and can take one more download.
+        peers: List[int] = [p for p in range(len(methods)) if p not in tried[block_id]]
+        if not peers:
+            raise Exception('gRPCbb: the block ' + block_id + ' could not be downloaded from any peer.')
+        peer: int = min(peers, key=lambda p: busy[p])
+        return peer if busy[peer] < downloads_per_peer else None
+
+    with ThreadPoolExecutor(max_workers=max(1, len(methods) * downloads_per_peer)) as executor:
+        try:
+            while pending or active:
+                for block_id in list(pending):
+                    peer: Optional[int] = next_peer(block_id=block_id)
+                    if peer is None:
+                        continue
+                    pending.remove(block_id)
+                    tried[block_id].add(peer)
+                    busy[peer] += 1
+                    download = BlockDownload(block_id=block_id, peer=peer, method=methods[peer])
+                    active[executor.submit(download.run)] = download
+
+                done, _ = wait(active, timeout=stall_timeout / 4, return_when=FIRST_COMPLETED)
+                for future in done:
+                    download: BlockDownload = active.pop(future)
+                    busy[download.peer] -= 1
+                    try:
+                        length: int = future.result()
+                    except Exception:
+                        pending.appendleft(download.block_id)
+                        if instrumentation:
+                            instrumentation.count('block_retries')
+                        continue
+                    downloaded.append(download.block_id)
+                    if instrumentation:
+                        instrumentation.count('blocks_downloaded')
+                        instrumentation.count('block_downloaded_bytes', length)
+
+                for download in active.values():
+                    if not download.cancelled and time.monotonic() - download.progress > stall_timeout:
+                        download.cancel()
+                        if instrumentation:
+                            instrumentation.count('blocks_stalled')
+        finally:
+            for download in active.values():
+                download.cancel()
+    return downloaded
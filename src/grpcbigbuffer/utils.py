@@ -5,33 +5,108 @@ from threading import Condition
 
 import typing
 
+from grpcbigbuffer.instrumentation import Instrumentation
+
 # GrpcBigBuffer.
 CHUNK_SIZE = 1024 * 1024  # 1MB
+FLOW_CONTROL_WINDOW = 8 * CHUNK_SIZE
+BATCH_RECORD_OVERHEAD = 11  # Bytes of the index and the length of each message of a batch, at most.
 MAX_DIR = 999999999
 WITHOUT_BLOCK_POINTERS_FILE_NAME = 'wbp.bin'
 METADATA_FILE_NAME = '_.json'
+FIELD_INDEX_FILE_NAME = 'index.json'
 BLOCK_LENGTH = 36
+# Bee file v2: magic, length prefixed buffers, json index, index length (8 bytes) and magic again.
+BEE_FILE_MAGIC = b'BEE\x02'
+BEE_FILE_FOOTER_LENGTH = 8 + len(BEE_FILE_MAGIC)
 
 
 class EmptyBufferException(Exception):
     pass
 
 
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
 class Dir(object):
     def __init__(self, dir: str, _type: type):
         self.dir: str = dir
         self.type: type = _type
 
 
+class MemoryBudget(object):
+    """
+    Process wide accountant of the bytes held on memory by parsers and serializers.
+    Without limit it only counts them.
+    """
+
+    def __init__(self, limit: typing.Optional[int] = None):
+        self.limit: typing.Optional[int] = limit
+        self.used: int = 0
+        self.peak: int = 0
+        self.waiting: int = 0
+        self.held_waiting: int = 0  # Bytes held by who is waiting for more.
+        self.condition = Condition()
+
+    def has_headroom(self, length: int) -> bool:
+        return self.limit is None or self.used + length <= self.limit
+
+    def acquire(self, length: int, wait: bool = True, force: bool = False, held: int = 0) -> bool:
+        # held are the bytes that the caller already holds.
+        with self.condition:
+            # A request bigger than the limit is served alone, otherwise it would never be.
+            while not force and self.used > held and not self.has_headroom(length):
+                # Who holds memory only waits for memory held by someone that is not waiting, or they
+                #  would wait for each other.
+                if not wait or held and self.used - held <= self.held_waiting:
+                    return False
+                self.waiting += 1
+                self.held_waiting += held
+                self.condition.wait()
+                self.held_waiting -= held
+                self.waiting -= 1
+            self.used += length
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, length: int):
+        with self.condition:
+            self.used -= length
+            self.condition.notify_all()
+
+    def usage(self) -> typing.Dict[str, typing.Optional[int]]:
+        with self.condition:
+            return {'limit': self.limit, 'used': self.used, 'peak': self.peak, 'waiting': self.waiting}
+
+
 class MemManager(object):
-    def __init__(self, len):
-        pass
+    # Holds len bytes of the memory budget while the context is open, waiting for them if it's exceeded.
+    # grow() waits for the memory that others release too, and fails when they all wait for more. With
+    #  spill it doesn't wait, once some memory is held it says that the caller should use the disk.
+    def __init__(self, len: int, budget: typing.Optional[MemoryBudget] = None):
+        self.budget: MemoryBudget = budget if budget else Enviroment.memory_budget
+        self.initial: int = len
+        self.len: int = 0
+
+    def grow(self, length: int, spill: bool = False) -> bool:
+        if length <= 0:
+            return True
+        if not self.budget.acquire(length, wait=self.len == 0 or not spill, held=0 if spill else self.len):
+            return False
+        self.len += length
+        return True
+
+    def release(self):
+        self.budget.release(self.len)
+        self.len = 0
 
     def __enter__(self):
+        self.grow(self.initial)
         return self
 
     def __exit__(self, exc_type, exc_value, trace):
-        pass
+        self.release()
 
 
 def get_file_hash(file_path: str) -> str:
@@ -52,29 +127,192 @@ def get_file_hash(file_path: str) -> str:
         return file_hash
 
 
+def copy_file_range(src_fd: int, dst_fd: int, offset: int, length: int, dst_offset: typing.Optional[int] = None) -> int:
+    """
+    Copies length bytes of src_fd, starting at offset, to dst_offset of dst_fd, or to its current
+    position if dst_offset is None.
+    Uses os.copy_file_range or os.sendfile when the platform supports them, so the data never
+    goes through user space, and falls back to pread/write otherwise.
+    """
+    copied: int = 0
+    while copied < length:
+        n: int = 0
+        try:
+            if hasattr(os, 'copy_file_range'):
+                n = os.copy_file_range(src_fd, dst_fd, length - copied, offset + copied,
+                                       dst_offset + copied if dst_offset is not None else None)
+            elif hasattr(os, 'sendfile') and dst_offset is None:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+        except OSError:
+            n = 0
+        if n == 0:
+            data: bytes = os.pread(src_fd, min(CHUNK_SIZE, length - copied), offset + copied)
+            if not data:
+                raise Exception('gRPCbb error copying file range, unexpected end of file.')
+            n = os.write(dst_fd, data) if dst_offset is None else os.pwrite(dst_fd, data, dst_offset + copied)
+        copied += n
+    return copied
+
+
 class Signal():
-    # The parser use change() when reads a signal on the buffer.
-    # The serializer use wait() for stop to send the buffer if it've to do it.
-    # It's thread safe because the open var is only used by one thread (the parser) with the change method.
-    def __init__(self, exist: bool = True) -> None:
+    """
+    Flow control of a call, shared by its parser and its serializer.
+    The receiver grants credits, in bytes of chunks, as it processes the buffers of the stream, and the
+     sender only sends while it has credits. A sender that has not received grants doesn't wait (the peer
+     doesn't use credits), and the signal buffers still stop and continue it.
+    The parser grants the window once the peer has shown that it reads credits, and then the bytes that
+     it has processed, each half window.
+    Like the credits, the first buffer of each side says if its parser decodes batches of small messages,
+     and the serializer of the other side only packs them then.
+    The parser announces the blocks of the stream that are already on the registry, and the serializer
+     of the other side stops sending their content once it reads the announcement.
+    """
+
+    def __init__(self, exist: bool = True, window: typing.Optional[int] = None) -> None:
         self.exist = exist
-        if exist: self.open = True
-        if exist: self.condition = Condition()
+        self.window: typing.Optional[int] = window if exist else None
+        self.condition = Condition()
+        self.reset()
+
+    def reset(self):
+        self.open = True
+        self.cancelled: bool = False  # The call has ended, nothing waits on the signal anymore.
+        # Sender.
+        self.sent: int = 0
+        self.credit: typing.Optional[int] = None  # None while the peer doesn't grant credits.
+        self.peer_reads_batches: bool = False  # The peer decodes batches of small messages.
+        # Receiver.
+        self.peer_reads_credits: bool = False
+        self.granted: bool = False
+        self.released: bool = False
+        self.processed: int = 0  # Bytes processed and not granted yet.
+        self.holding: int = 0  # Bytes of the last received buffer, processed when the next is asked.
+        self.announced: typing.List[str] = []  # Blocks on the registry, not announced to the peer yet.
+        # Sender.
+        self.peer_blocks: typing.Set[str] = set()  # Blocks that the peer has announced.
+        with self.condition:
+            self.condition.notify_all()
 
     def change(self):
+        # The parser use change() when reads a signal on the buffer.
         if self.exist:
-            if self.open:
-                self.open = False  # Stop the input buffer.
-            else:
-                with self.condition:
-                    self.condition.notify_all()
-                self.open = True  # Continue the input buffer.
+            with self.condition:
+                self.open = not self.open  # Stop or continue the input buffer.
+                self.condition.notify_all()
 
     def wait(self):
         if self.exist and not self.open:
             with self.condition:
+                self.condition.wait_for(lambda: self.open or self.cancelled)
+
+    def cancel(self):
+        # The call has ended, the threads that still use the signal stop waiting and fail on acquire().
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+
+    def grant(self, credit: int):
+        # The parser use grant() when reads a credit on the buffer, zero ends the flow control.
+        if self.exist:
+            with self.condition:
+                self.peer_reads_credits = True
+                if credit == 0:
+                    self.credit = None
+                else:
+                    # The first grant includes the bytes that the peer had processed before it.
+                    self.credit = (self.credit if self.credit is not None else -self.sent) + credit
+                self.condition.notify_all()
+
+    def announce(self, block_id: str):
+        # The parser use announce() when the block of the stream is already on the registry.
+        if self.exist:
+            with self.condition:
+                self.announced.append(block_id)
+                self.condition.notify_all()
+
+    def take_announced(self) -> typing.List[str]:
+        # Blocks to announce to the peer.
+        if not self.announced:
+            return []
+        with self.condition:
+            announced, self.announced = self.announced, []
+            return announced
+
+    def peer_has(self, block_id: str):
+        # The parser use peer_has() when reads the announcement of a block.
+        with self.condition:
+            self.peer_blocks.add(block_id)
+
+    def receive(self, length: int):
+        # The parser use receive() for each buffer read, the previous one has been processed.
+        if self.window:
+            with self.condition:
+                self.processed += self.holding
+                self.holding = length
+                if self._grant_due():
+                    self.condition.notify_all()
+
+    def _grant_due(self) -> bool:
+        if not self.window or self.released or not self.peer_reads_credits:
+            return False
+        return not self.granted or self.processed >= self.window // 2
+
+    def _take_grant(self) -> typing.Optional[int]:
+        if not self._grant_due():
+            return None
+        credit: int = self.processed + (0 if self.granted else self.window)
+        self.granted, self.processed = True, 0
+        return credit
+
+    def take_grant(self) -> typing.Optional[int]:
+        # Credit to send to the peer, if it's time to grant.
+        if not self.window:
+            return None
+        with self.condition:
+            return self._take_grant()
+
+    def wait_grant(self, ready: typing.Callable[[], bool]) -> typing.Optional[int]:
+        # Waits until ready(), a due grant, blocks to announce or the end of the call, and takes the grant.
+        with self.condition:
+            self.condition.wait_for(lambda: ready() or self._grant_due() or self.announced or self.cancelled)
+            return self._take_grant()
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def acquire(self, length: int) -> typing.Optional[int]:
+        """
+        The serializer use acquire() before sending a buffer with a chunk of length bytes. Waits for the
+         credits, and returns a credit to grant to the peer instead if it's due meanwhile, so both sides
+         of the call can't wait for each other.
+        """
+        if not self.exist:
+            return None
+        with self.condition:
+            while True:
+                if self.cancelled:
+                    raise Exception('gRPCbb: the call of the signal has ended.')
+                credit: typing.Optional[int] = self._take_grant() if self.window else None
+                if credit:
+                    return credit
+                if self.open and (length == 0 or self.credit is None or self.credit > 0):
+                    self.sent += length
+                    if self.credit is not None:
+                        self.credit -= length
+                    return None
                 self.condition.wait()
 
+    def release(self) -> bool:
+        # The serializer use release() when it ends, if it returns True it has to send a zero credit
+        #  because the peer could be waiting for more grants.
+        if not self.window:
+            return False
+        with self.condition:
+            release: bool = self.granted and not self.released
+            self.released = True
+            return release
+
 
 ## Enviroment ##
 
@@ -84,6 +322,8 @@ class Enviroment(type):
     cache_dir = os.path.abspath(os.curdir) + '/__cache__/grpcbigbuffer/'
     block_dir = os.path.abspath(os.curdir) + '/__block__/'
     block_depth = 1
+    memory_budget = MemoryBudget()
+    instrumentation: typing.Optional[Instrumentation] = None
     mem_manager = lambda len: MemManager(len=len)
     # SHA3_256
     hash_type: bytes = bytes.fromhex("a7ffc6f8bf1ed76651c14756a061d662f580ff4de43b49fa82d80a4b80f8434a")
@@ -99,7 +339,9 @@ def modify_env(
         mem_manager: typing.Optional[MemManager] = None,
         hash_type: typing.Optional[bytes] = None,
         block_depth: typing.Optional[int] = None,
-        block_dir: typing.Optional[str] = None
+        block_dir: typing.Optional[str] = None,
+        memory_limit: typing.Optional[int] = None,
+        instrumentation: typing.Optional[Instrumentation] = None
 ):
     if cache_dir: Enviroment.cache_dir = cache_dir + 'grpcbigbuffer/'
     if mem_manager: Enviroment.mem_manager = mem_manager
@@ -109,6 +351,16 @@ def modify_env(
         rmtree(Enviroment.block_dir)
     if block_depth: Enviroment.block_depth = block_depth
     if block_dir: Enviroment.block_dir = block_dir
+    if memory_limit:
+        with Enviroment.memory_budget.condition:
+            Enviroment.memory_budget.limit = memory_limit
+            Enviroment.memory_budget.condition.notify_all()
+    if instrumentation: Enviroment.instrumentation = instrumentation
+
+
+def get_memory_usage() -> typing.Dict[str, typing.Optional[int]]:
+    # Bytes limit, used and peak of the memory budget and the number of waiting parsers or serializers.
+    return Enviroment.memory_budget.usage()
 
 
 def create_lengths_tree(
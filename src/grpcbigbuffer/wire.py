@@ -0,0 +1,228 @@
+import struct
+from functools import lru_cache
+from typing import BinaryIO, Callable, Dict, Generator, List, Optional, Tuple, Union
+
+from google.protobuf.descriptor import Descriptor, FieldDescriptor
+from google.protobuf.message import Message
+from google.protobuf.unknown_fields import UnknownFieldSet
+
+from grpcbigbuffer.utils import CHUNK_SIZE, encode_bytes
+
+# How each field is written: submessages and bytes are walked, the rest is serialized as is.
+MESSAGE, BYTES, OTHER = 0, 1, 2
+
+
+@lru_cache(maxsize=None)
+def wire_fields(descriptor: Descriptor) -> Tuple[Tuple[FieldDescriptor, int, bytes], ...]:
+    # The fields of a message type in the order of SerializeToString, with their kind and tag.
+    fields: List[Tuple[FieldDescriptor, int, bytes]] = []
+    for field in sorted(descriptor.fields, key=lambda f: f.number):
+        if field.type == FieldDescriptor.TYPE_MESSAGE and not field.message_type.GetOptions().map_entry:
+            kind: int = MESSAGE
+        elif field.type in (FieldDescriptor.TYPE_BYTES, FieldDescriptor.TYPE_STRING):
+            kind: int = BYTES
+        else:
+            kind: int = OTHER
+        fields.append((field, kind, encode_bytes(field.number << 3 | 2)))
+    return tuple(fields)
+
+
+def field_values(message: Message, field: FieldDescriptor) -> List:
+    # The values of a submessage or bytes field, none if it's not set.
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        return list(getattr(message, field.name))
+    if field.has_presence:
+        return [getattr(message, field.name)] if message.HasField(field.name) else []
+    value = getattr(message, field.name)
+    return [value] if value else []
+
+
+# Wire type and encoding of each scalar type.
+SCALARS: Dict[int, Tuple[int, Callable]] = {
+    FieldDescriptor.TYPE_INT32: (0, lambda value: encode_bytes(value & 0xFFFFFFFFFFFFFFFF)),
+    FieldDescriptor.TYPE_INT64: (0, lambda value: encode_bytes(value & 0xFFFFFFFFFFFFFFFF)),
+    FieldDescriptor.TYPE_ENUM: (0, lambda value: encode_bytes(value & 0xFFFFFFFFFFFFFFFF)),
+    FieldDescriptor.TYPE_UINT32: (0, encode_bytes),
+    FieldDescriptor.TYPE_UINT64: (0, encode_bytes),
+    FieldDescriptor.TYPE_BOOL: (0, lambda value: encode_bytes(int(value))),
+    FieldDescriptor.TYPE_SINT32: (0, lambda value: encode_bytes((value << 1) ^ (value >> 31))),
+    FieldDescriptor.TYPE_SINT64: (0, lambda value: encode_bytes((value << 1) ^ (value >> 63))),
+    FieldDescriptor.TYPE_FIXED32: (5, struct.Struct('<I').pack),
+    FieldDescriptor.TYPE_SFIXED32: (5, struct.Struct('<i').pack),
+    FieldDescriptor.TYPE_FLOAT: (5, struct.Struct('<f').pack),
+    FieldDescriptor.TYPE_FIXED64: (1, struct.Struct('<Q').pack),
+    FieldDescriptor.TYPE_SFIXED64: (1, struct.Struct('<q').pack),
+    FieldDescriptor.TYPE_DOUBLE: (1, struct.Struct('<d').pack),
+}
+
+
+@lru_cache(maxsize=None)
+def is_packed(field: FieldDescriptor) -> bool:
+    # Repeated scalars are packed by default on proto3, and only with the packed option on proto2.
+    if field.label != FieldDescriptor.LABEL_REPEATED or field.type not in SCALARS:
+        return False
+    if field.GetOptions().HasField('packed'):
+        return field.GetOptions().packed
+    return field.containing_type.file.syntax == 'proto3'
+
+
+def field_bytes(message: Message, field: FieldDescriptor) -> bytes:
+    # The tag and value of a field that is not walked (scalars, packed scalars, maps), copied alone.
+    if field.type not in SCALARS:  # Maps and groups.
+        temp_message: Message = type(message)()
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            getattr(temp_message, field.name).MergeFrom(getattr(message, field.name))
+        elif not field.has_presence or message.HasField(field.name):
+            setattr(temp_message, field.name, getattr(message, field.name))
+        return temp_message.SerializeToString()
+
+    wire_type, encode = SCALARS[field.type]
+    if field.label == FieldDescriptor.LABEL_REPEATED:
+        values: List = list(getattr(message, field.name))
+    elif field.has_presence:
+        values: List = [getattr(message, field.name)] if message.HasField(field.name) else []
+    else:
+        values: List = [getattr(message, field.name)]
+    encoded: List[bytes] = [encode(value) for value in values]
+    if not field.has_presence and field.label != FieldDescriptor.LABEL_REPEATED and not encoded[0].strip(b'\x00'):
+        return b''  # The default value, all zero bytes (so a -0.0 float is written).
+    if is_packed(field):
+        content: bytes = b''.join(encoded)
+        return encode_bytes(field.number << 3 | 2) + encode_bytes(len(content)) + content if content else b''
+    tag: bytes = encode_bytes(field.number << 3 | wire_type)
+    return b''.join(tag + value for value in encoded)
+
+
+def is_walkable(message: Message) -> bool:
+    # Unknown fields and extensions are not walked, a message that has them is serialized at once.
+    if len(UnknownFieldSet(message)):
+        return False
+    return not message.DESCRIPTOR.is_extendable or not any(f.is_extension for f, _ in message.ListFields())
+
+
+def small_byte_size(message: Message, limit: int = CHUNK_SIZE) -> Optional[int]:
+    """
+    The ByteSize of the message if it's smaller than limit, None if it's not. ByteSize serializes the
+     message, so it's only asked once its bytes values, which the wire format has at least, add up less.
+    """
+    length: int = 0
+    messages: List[Message] = [message]
+    while messages and length < limit:
+        for field, value in messages.pop().ListFields():
+            if field.type == FieldDescriptor.TYPE_MESSAGE and field.message_type.GetOptions().map_entry:
+                value = list(value.values())
+                if value and isinstance(value[0], Message):
+                    messages.extend(value)
+                elif value and type(value[0]) in (bytes, str):
+                    length += sum(len(v) for v in value)
+            elif field.type in (FieldDescriptor.TYPE_MESSAGE, FieldDescriptor.TYPE_GROUP):
+                if field.label == FieldDescriptor.LABEL_REPEATED:
+                    messages.extend(value)
+                else:
+                    messages.append(value)
+            elif field.type in (FieldDescriptor.TYPE_BYTES, FieldDescriptor.TYPE_STRING):
+                length += sum(len(v) for v in value) if field.label == FieldDescriptor.LABEL_REPEATED \
+                    else len(value)
+    if length >= limit:
+        return None
+    size: int = message.ByteSize()
+    return size if size < limit else None
+
+
+class WireSizes(object):
+    """
+    The serialized sizes of a message and its submessages, computed once walking the message. ByteSize
+     serializes the whole message to know its size, for each submessage that is asked again.
+    The submessages are kept referenced, so their ids are not reused while the sizes are.
+    """
+
+    def __init__(self, message: Message):
+        self.sizes: Dict[int, Tuple[Message, int]] = {}
+        self.total: int = self.of(message)
+
+    def of(self, message: Message) -> int:
+        entry: Optional[Tuple[Message, int]] = self.sizes.get(id(message))
+        if entry and entry[0] is message:
+            return entry[1]
+        if not is_walkable(message):
+            size: int = message.ByteSize()
+            self.sizes[id(message)] = (message, size)
+            return size
+        size: int = 0
+        for field, kind, tag in wire_fields(message.DESCRIPTOR):
+            if kind == MESSAGE:
+                for value in field_values(message, field):
+                    value_size: int = self.of(value)
+                    size += len(tag) + len(encode_bytes(value_size)) + value_size
+            elif kind == BYTES:
+                for value in field_values(message, field):
+                    value_size: int = len(value.encode('utf-8')) if type(value) is str else len(value)
+                    size += len(tag) + len(encode_bytes(value_size)) + value_size
+            else:
+                size += len(field_bytes(message, field))
+        self.sizes[id(message)] = (message, size)
+        return size
+
+
+def iter_wire(message: Message, sizes: Optional[WireSizes] = None) -> Generator[Union[bytes, memoryview], None, None]:
+    """
+    Yields the wire format of the message in pieces, the same bytes that SerializeToString returns.
+    Submessages smaller than a chunk are serialized at once, the bigger ones are walked emitting the tag
+     and length of each field, and big bytes fields are yielded as they are, without being concatenated.
+    The submessages with unknown fields or extensions are serialized at once too, whatever their size.
+    """
+    if not sizes:
+        sizes = WireSizes(message)
+    if sizes.of(message) < CHUNK_SIZE or not is_walkable(message):
+        yield message.SerializeToString()
+        return
+    for field, kind, tag in wire_fields(message.DESCRIPTOR):
+        if kind == MESSAGE:
+            for value in field_values(message, field):
+                yield tag + encode_bytes(sizes.of(value))
+                yield from iter_wire(message=value, sizes=sizes)
+        elif kind == BYTES:
+            for value in field_values(message, field):
+                if type(value) is str:
+                    value = value.encode('utf-8')
+                yield tag + encode_bytes(len(value))
+                yield memoryview(value) if len(value) >= CHUNK_SIZE else value
+        else:
+            value: bytes = field_bytes(message, field)
+            if value:
+                yield value
+
+
+def iter_wire_chunks(
+        message: Message,
+        sizes: Optional[WireSizes] = None,
+        chunk_size: int = CHUNK_SIZE
+) -> Generator[Union[bytes, memoryview], None, None]:
+    """
+    The wire format of the message in chunks of chunk_size bytes (but the last one). Small pieces are
+     joined, and the chunks of a big bytes field are memoryview slices of it.
+    """
+    pending = bytearray()
+    for piece in iter_wire(message=message, sizes=sizes):
+        view = memoryview(piece)
+        while len(view):
+            if not pending and len(view) >= chunk_size:
+                yield view[:chunk_size]
+                view = view[chunk_size:]
+                continue
+            free: int = chunk_size - len(pending)
+            pending += view[:free]
+            view = view[free:]
+            if len(pending) == chunk_size:
+                yield bytes(pending)
+                pending = bytearray()
+    if pending:
+        yield bytes(pending)
+
+
+def write_wire(message: Message, f: BinaryIO, sizes: Optional[WireSizes] = None) -> int:
+    # Writes the wire format of the message on the file, returns the bytes written.
+    written: int = 0
+    for piece in iter_wire(message=message, sizes=sizes):
+        written += f.write(piece)
+    return written
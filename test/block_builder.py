@@ -6,7 +6,7 @@ from hashlib import sha3_256
 sys.path.append('../src/')
 
 from grpcbigbuffer import buffer_pb2
-from grpcbigbuffer.block_builder import build_multiblock, get_position_length
+from grpcbigbuffer.block_builder import build_multiblock, get_position_length, BuildStats
 from grpcbigbuffer.utils import Enviroment
 from grpcbigbuffer.utils import encode_bytes, create_lengths_tree
 
@@ -454,6 +454,41 @@ class TestBlockBuilder(unittest.TestCase):
                     )
 
 
+class TestBuildStats(unittest.TestCase):
+    def test_build_stats(self):
+        from grpcbigbuffer.test_pb2 import Filesystem
+
+        hashes: list = []
+        filesystem = Filesystem()
+        for name in (b'stats1', b'stats2'):
+            with open(Enviroment.block_dir + sha3_256(name).hexdigest(), 'wb') as file:
+                file.write(name * 100)
+            block = buffer_pb2.Buffer.Block()
+            block.hashes.append(buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=sha3_256(name).digest()))
+            filesystem.branch.add(name=name.decode()).filesystem.branch.add(name='file', file=block.SerializeToString())
+            hashes.append(sha3_256(name).digest())
+
+        phases: list = []
+        stats = BuildStats(hook=lambda name, seconds: phases.append(name))
+        object_id, cache_dir = build_multiblock(pf_object_with_block_pointers=filesystem, blocks=hashes, stats=stats)
+        self.assertEqual(object_id, build_multiblock(pf_object_with_block_pointers=filesystem, blocks=hashes)[0])
+
+        self.assertEqual(phases, [
+            'wire_sizes', 'search_on_message', 'create_lengths_tree', 'serialize', 'compute_real_lengths',
+            'generate_buffer', 'generate_id', 'search_on_message_real', 'write_partitions'
+        ])
+        self.assertEqual(set(stats.phases), set(phases))
+        self.assertEqual(stats.counters['pointers_found'], 2)
+        self.assertEqual(stats.counters['files_written'], len(os.listdir(cache_dir)))
+        with open(os.path.join(cache_dir, '_.json'), 'r') as f:
+            parts: list = [e for e in json.load(f) if type(e) == int]
+        self.assertEqual(
+            stats.counters['bytes_hashed'],
+            sum(os.path.getsize(os.path.join(cache_dir, str(p))) for p in parts) + 2 * 600
+        )
+        self.assertEqual(stats.counters['messages_sized'], 7)
+
+
 if __name__ == '__main__':
     os.makedirs("__cache__", exist_ok=True)
     os.makedirs("__block__", exist_ok=True)
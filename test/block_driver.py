@@ -683,6 +683,58 @@ class TestWBPFileGeneration(unittest.TestCase):
         self.assertEqual(generate_block(with_hash=False)[0], generated)
 
 
+class TestFieldIndex(unittest.TestCase):
+    def test_field_ranges(self):
+        from grpcbigbuffer.block_driver import generate_wbp_file
+        from grpcbigbuffer.reader import get_field_ranges
+        from grpcbigbuffer.test_pb2 import Filesystem
+
+        def read_ranges(ranges: List[Tuple[str, int, int]]) -> bytes:
+            content: bytes = b''
+            for filename, offset, length in ranges:
+                with open(filename, 'rb') as f:
+                    f.seek(offset)
+                    content += f.read(length)
+            return content
+
+        blocks: List[bytes] = []
+        filesystem = Filesystem()
+        for name in ('index_block1', 'index_block2'):
+            blocks.append(sha3_256(name.encode()).digest())
+            if not os.path.isfile(Enviroment.block_dir + blocks[-1].hex()):
+                with open(Enviroment.block_dir + blocks[-1].hex(), 'wb') as file:
+                    file.write(b''.join([name.encode() for i in range(100)]))
+            block = buffer_pb2.Buffer.Block(
+                hashes=[buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=blocks[-1])]
+            )
+            filesystem.branch.add(name=name, file=block.SerializeToString())
+        directory = filesystem.branch.add(name='directory')
+        directory.filesystem.branch.add(name='file', file=b'content')
+
+        object_id, cache_dir = build_multiblock(pf_object_with_block_pointers=filesystem, blocks=blocks)
+        os.remove(cache_dir + '/wbp.bin')
+        generate_wbp_file(cache_dir)
+        # The index is written on the first call, to the depth of its path.
+        self.assertFalse(os.path.isfile(cache_dir + '/index.json'))
+        self.assertEqual(len(list(get_field_ranges(cache_dir, [2]))), 3)
+        with self.assertRaises(Exception):
+            list(get_field_ranges(cache_dir, [2, 1]))
+
+        for real in (True, False):
+            self.assertEqual(
+                [read_ranges(r) for r in get_field_ranges(cache_dir, [2, 1], real=real, message_cls=Filesystem)],
+                [b'index_block1', b'index_block2', b'directory']
+            )
+            self.assertEqual(
+                [read_ranges(r) for r in get_field_ranges(cache_dir, [2, 4, 2, 2], real=real, message_cls=Filesystem)],
+                [b'content']
+            )
+        self.assertEqual(
+            [read_ranges(r) for r in get_field_ranges(cache_dir, [2, 2], real=True, message_cls=Filesystem)],
+            [b''.join([name.encode() for i in range(100)]) for name in ('index_block1', 'index_block2')]
+        )
+
+
 if __name__ == "__main__":
     os.makedirs("__cache__", exist_ok=True)
     os.makedirs("__block__", exist_ok=True)
@@ -691,3 +743,4 @@ if __name__ == "__main__":
     os.system('rm -rf __block__/*')
     os.system("rm -rf __generated_filesystem__/*")
     TestWBPFileGeneration().test_complex_filesystem_generate_wbp_file()
+    TestFieldIndex().test_field_ranges()
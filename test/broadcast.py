@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from hashlib import sha3_256
+
+sys.path.append('../src/')
+
+from grpcbigbuffer.broadcast import Broadcast
+from grpcbigbuffer.utils import Signal
+from helpers import BLOCK_ID, generate_buffers
+
+
+class TestBroadcast(unittest.TestCase):
+    def test_spill_slow_streams(self):
+        reads = []
+        broadcast = Broadcast(source=(reads.append(b) or b for b in generate_buffers()), capacity=2)
+        streams = [broadcast.stream() for i in range(3)]
+        # The first stream goes to the end, the others are spilled to disk.
+        self.assertEqual(list(streams[0]), list(generate_buffers()))
+        self.assertLessEqual(len(broadcast.ring), 2)
+        self.assertIsNotNone(streams[1].spill_file)
+        spill_file: str = streams[1].spill_file
+        self.assertEqual(next(streams[1]), next(generate_buffers()))
+        self.assertEqual(list(streams[1]), list(generate_buffers())[1:])
+        self.assertFalse(os.path.exists(spill_file))
+        streams[2].close()
+        self.assertIsNone(streams[2].spill_file)
+        self.assertEqual(len(reads), len(list(generate_buffers())))
+
+    def test_skip_block(self):
+        broadcast = Broadcast(source=generate_buffers())
+        signal = Signal(exist=False)
+        streams = [broadcast.stream(), broadcast.stream(signal=signal)]
+        # Only the stream whose receiver has announced the block skips its content.
+        signal.peer_has(block_id=BLOCK_ID)
+        self.assertEqual(list(streams[0]), list(generate_buffers()))
+        self.assertEqual(
+            list(streams[1]),
+            [b for b in generate_buffers() if not b.chunk.startswith(b'block')]
+        )
+
+    def test_announce_blocks(self):
+        # The blocks announced by the parser of the call go to the peer on the stream.
+        broadcast = Broadcast(source=generate_buffers())
+        signal = Signal()
+        stream = broadcast.stream(signal=signal)
+        signal.announce(block_id=sha3_256(b'announced').hexdigest())
+        buffers = list(stream)
+        self.assertTrue(buffers[0].signal)
+        self.assertEqual(buffers[0].block.hashes[0].value, sha3_256(b'announced').digest())
+        self.assertEqual(buffers[1:], list(generate_buffers()))
+
+    def test_slow_source(self):
+        # While a stream waits for the source, the others send the buffers that they have.
+        release = threading.Event()
+
+        def source():
+            buffers = list(generate_buffers())
+            yield from buffers[:3]
+            release.wait(timeout=30)
+            yield from buffers[3:]
+
+        broadcast = Broadcast(source=source(), capacity=2)
+        streams = [broadcast.stream() for i in range(2)]
+        first = [next(streams[0]) for i in range(3)]
+        waiting = threading.Thread(target=lambda: first.extend(streams[0]))
+        waiting.start()
+        while not broadcast.reading:
+            time.sleep(0.01)
+        # The buffer that the second stream still needs was spilled when the ring was full.
+        self.assertEqual([next(streams[1]) for i in range(3)], list(generate_buffers())[:3])
+        self.assertTrue(waiting.is_alive())
+        release.set()
+        waiting.join()
+        self.assertEqual(first, list(generate_buffers()))
+        self.assertEqual(list(streams[1]), list(generate_buffers())[3:])
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.channel_pool import ChannelPool, broadcast_grpc, CHANNEL_OPTIONS
+from grpcbigbuffer.client import client_grpc
+from grpcbigbuffer.server import BeeServer
+from grpcbigbuffer.utils import CHUNK_SIZE, Dir
+from helpers import LocalServer, bee_echo
+
+METHOD = '/test.Service/Echo'
+
+
+class TestChannelPool(unittest.TestCase):
+    def setUp(self):
+        self.bee_server = BeeServer()
+        self.servers = [LocalServer(methods={'Echo': bee_echo(self.bee_server)}) for i in range(3)]
+        self.pool = ChannelPool(size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        for server in self.servers:
+            server.stop()
+        self.bee_server.shutdown()
+
+    def test_channels(self):
+        target: str = self.servers[0].target
+        channels = [self.pool.channel(target) for i in range(4)]
+        self.assertIsNot(channels[0], channels[1])
+        self.assertIs(channels[0], channels[2])
+        methods = [self.pool.method(target, METHOD) for i in range(2)]
+        self.assertIs(methods[0], self.pool.method(target, METHOD))
+        message = test_pb2.Test(t1=b'pooled')
+        self.assertEqual(list(client_grpc(
+            method=self.pool.method(target, METHOD),
+            input=message,
+            indices_parser=test_pb2.Test,
+            partitions_message_mode_parser=True,
+            indices_serializer=test_pb2.Test
+        )), [message])
+
+    def test_keepalive(self):
+        # Pings that servers with the default options accept, not to be closed with too_many_pings.
+        options: dict = dict(self.pool.options)
+        self.assertGreaterEqual(options['grpc.keepalive_time_ms'], 300000)
+        self.assertNotIn('grpc.keepalive_permit_without_calls', dict(CHANNEL_OPTIONS))
+
+    def test_broadcast(self):
+        message = test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]), t2=b'broadcast')
+        filename: str = '__cache__/broadcast'
+        with open(filename, 'wb') as f:
+            f.write(message.SerializeToString())
+        results = broadcast_grpc(
+            methods=[self.pool.method(server.target, METHOD) for server in self.servers],
+            input=Dir(dir=filename, _type=test_pb2.Test),
+            indices_parser=test_pb2.Test,
+            partitions_message_mode_parser=True,
+            indices_serializer=test_pb2.Test
+        )
+        self.assertEqual(results, [[message] for i in range(3)])
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,639 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from hashlib import sha3_256
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, compile_pb2, test_pb2
+from grpcbigbuffer.block_builder import build_multiblock
+from grpcbigbuffer.client import combine_partitions, combine_partitions_to_dir, parse_dir, get_submessage, \
+    get_subclass, message_to_bytes, write_to_file, read_from_file, parse_from_buffer, serialize_to_buffer, \
+    record_to_file, feed_message, BufferStream, MessageDir, generate_random_dir, BeeFileImporter, send_with_credits, \
+    block_announcement
+from grpcbigbuffer.reader import read_bee_index, read_bee_chunks, read_bee_file, scan_bee_records, \
+    get_bee_file_data_range
+from grpcbigbuffer.utils import CHUNK_SIZE, Enviroment, METADATA_FILE_NAME, MemoryBudget, MemManager, \
+    modify_env, get_memory_usage, Signal
+from grpcbigbuffer.instrumentation import MemoryInstrumentation
+from grpcbigbuffer.utils import Dir
+from helpers import small_message
+
+
+def generate_service_with_meta() -> compile_pb2.ServiceWithMeta:
+    service_with_meta = compile_pb2.ServiceWithMeta()
+    service_with_meta.metadata.hashtag.tag.extend(['client', 'test'])
+    service_with_meta.service.container.architecture = b''.join([b'arch' for i in range(1000)])
+    service_with_meta.service.container.entrypoint.extend(['start.sh'])
+    service_with_meta.service.api.slot.add().port = 8080
+    return service_with_meta
+
+
+def generate_partitions_model() -> tuple:
+    partitions_model = []
+    for index in (1, 2):
+        partition = buffer_pb2.Buffer.Head.Partition()
+        partition.index[index].CopyFrom(buffer_pb2.Buffer.Head.Partition())
+        partitions_model.append(partition)
+    return tuple(partitions_model)
+
+
+def generate_partition(model: dict) -> buffer_pb2.Buffer.Head.Partition:
+    partition = buffer_pb2.Buffer.Head.Partition()
+    for index, sub_model in model.items():
+        partition.index[index].CopyFrom(generate_partition(sub_model))
+    return partition
+
+
+class TestPartitionPlan(unittest.TestCase):
+    def test_get_subclass(self):
+        self.assertEqual(get_subclass(generate_partition({3: {}}), test_pb2.Test), test_pb2.Test)
+        self.assertEqual(get_subclass(generate_partition({3: {1: {}}}), test_pb2.Test), bytes)
+        self.assertEqual(get_subclass(generate_partition({1: {}, 2: {}}), test_pb2.Test), test_pb2.Test)
+        self.assertEqual(
+            get_subclass(generate_partition({2: {2: {}}}), compile_pb2.ServiceWithMeta),
+            compile_pb2.celaut__pb2.Service.Api
+        )
+
+    def test_split_and_combine(self):
+        message = test_pb2.Test(t1=b'mt1', t2=b'mt2', t5=b'mt5')
+        message.t3.t1 = b'st1'
+        message.t3.t2 = b'st2'
+        message.t3.t3.t1 = b'sst1'
+        for model in [
+            [{1: {}}, {2: {}}, {3: {}}, {5: {}}],
+            [{1: {}, 5: {}}, {3: {1: {}}}, {3: {2: {}, 3: {}}}, {2: {}}],
+            [{3: {3: {1: {}}}}, {3: {1: {}, 2: {}}}, {1: {}, 2: {}, 5: {}}],
+        ]:
+            partitions_model = tuple(generate_partition(m) for m in model)
+            partitions = []
+            for i, partition in enumerate(partitions_model):
+                obj = test_pb2.Test()
+                obj.CopyFrom(message)
+                partitions.append('__cache__/partition_' + str(i))
+                with open(partitions[-1], 'wb') as f:
+                    f.write(message_to_bytes(get_submessage(partition=partition, obj=obj)))
+
+            self.assertEqual(
+                combine_partitions(obj_cls=test_pb2.Test, partitions_model=partitions_model, partitions=partitions),
+                message
+            )
+            self.assertEqual(
+                parse_dir(combine_partitions_to_dir(
+                    obj_cls=test_pb2.Test, partitions_model=partitions_model, partitions=partitions
+                )),
+                message
+            )
+
+
+class TestCombinePartitions(unittest.TestCase):
+    def test_combine_partitions_to_dir(self):
+        service_with_meta = generate_service_with_meta()
+        service_file: str = '__cache__/service'
+        with open(service_file, 'wb') as f:
+            f.write(service_with_meta.service.SerializeToString())
+
+        _dir: Dir = combine_partitions_to_dir(
+            obj_cls=compile_pb2.ServiceWithMeta,
+            partitions_model=generate_partitions_model(),
+            partitions=(service_with_meta.metadata, service_file)
+        )
+        self.assertEqual(_dir.type, compile_pb2.ServiceWithMeta)
+        self.assertEqual(parse_dir(_dir), service_with_meta)
+        self.assertEqual(
+            parse_dir(_dir),
+            combine_partitions(
+                obj_cls=compile_pb2.ServiceWithMeta,
+                partitions_model=generate_partitions_model(),
+                partitions=(service_with_meta.metadata, service_file)
+            )
+        )
+        self.assertEqual(
+            parse_dir(_dir, fields=[1]),
+            compile_pb2.ServiceWithMeta(metadata=service_with_meta.metadata)
+        )
+        os.remove(_dir.dir)
+        os.remove(service_file)
+
+
+class TestBeeFile(unittest.TestCase):
+    @staticmethod
+    def generate_messages():
+        return [
+            test_pb2.Test(t1=b'first'),
+            test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]), t5=b'second'),
+            test_pb2.Test(t2=b'third'),
+        ]
+
+    def test_read_v1_and_v2(self):
+        for version in (1, 2):
+            filename: str = write_to_file(
+                path='__cache__/bee',
+                file_name='test_v' + str(version),
+                input=(m for m in self.generate_messages()),
+                indices=test_pb2.Test,
+                version=version
+            )
+            self.assertEqual(
+                [parse_dir(_dir) for _dir in read_from_file(path=filename, indices=test_pb2.Test)],
+                self.generate_messages()
+            )
+            self.assertEqual(
+                [parse_dir(_dir) for _dir in read_from_file(path=filename, indices=test_pb2.Test, message=1)],
+                self.generate_messages()[1:2]
+            )
+
+            bee_index = read_bee_index(filename)
+            self.assertEqual(bee_index['version'], version)
+            self.assertEqual([m['index'] for m in bee_index['messages']], [1, 1, 1])
+            self.assertEqual(
+                b''.join(read_bee_chunks(filename, message=1)),
+                self.generate_messages()[1].SerializeToString()
+            )
+            self.assertEqual(
+                list(read_bee_file(filename, message=2))[-1].separator, True
+            )
+
+        # v1 by default, so older readers can read the files.
+        filename: str = write_to_file(path='__cache__/bee', file_name='test_default',
+                                      input=iter(self.generate_messages()), indices=test_pb2.Test)
+        self.assertEqual(read_bee_index(filename)['version'], 1)
+
+    def test_partial_reads(self):
+        # The memory maps of the generators that are not consumed are closed with them.
+        filename: str = write_to_file(path='__cache__/bee', file_name='test_partial',
+                                      input=iter(self.generate_messages()), indices=test_pb2.Test, version=2)
+        start, end = get_bee_file_data_range(filename=filename)
+        fds: int = len(os.listdir('/proc/self/fd'))
+        for generator in (scan_bee_records(filename, start, end), read_bee_chunks(filename, message=1)):
+            next(generator)
+            self.assertGreater(len(os.listdir('/proc/self/fd')), fds)
+            generator.close()
+            self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+    def test_record(self):
+        filename: str = '__cache__/bee/test_record.bee'
+        if os.path.exists(filename):
+            os.remove(filename)
+        buffers: list = list(serialize_to_buffer(message_iterator=iter(self.generate_messages()), indices=test_pb2.Test))
+        self.assertEqual(list(record_to_file(request_iterator=iter(buffers), filename=filename)), buffers)
+        self.assertEqual(list(read_bee_file(filename)), buffers)
+        self.assertEqual(
+            list(parse_from_buffer(request_iterator=read_bee_file(filename), indices=test_pb2.Test,
+                                   partitions_message_mode=True)),
+            self.generate_messages()
+        )
+
+    def test_parallel_write(self):
+        dir_file: str = '__cache__/bee_dir_input'
+        with open(dir_file, 'wb') as f:
+            f.write(self.generate_messages()[1].SerializeToString())
+        files: list = []
+        for workers in (1, 4):
+            files.append(write_to_file(
+                path='__cache__/bee',
+                file_name='test_workers_' + str(workers),
+                input=(m for m in self.generate_messages() + [Dir(dir=dir_file, _type=test_pb2.Test)]),
+                indices=test_pb2.Test,
+                workers=workers
+            ))
+            self.assertEqual(
+                [parse_dir(_dir) for _dir in read_from_file(path=files[-1], indices=test_pb2.Test)],
+                self.generate_messages() + self.generate_messages()[1:2]
+            )
+        with open(files[0], 'rb') as f1, open(files[1], 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        os.remove(dir_file)
+
+    def test_memory_of_dir_inputs(self):
+        # Only the bytes held on memory are charged to the memory manager, not the chunks copied from Dir files.
+        dir_file: str = '__cache__/bee_dir_charged'
+        with open(dir_file, 'wb') as f:
+            f.write(self.generate_messages()[1].SerializeToString())
+        charged: list = []
+        write_to_file(
+            path='__cache__/bee',
+            file_name='test_dir_charged',
+            input=iter([Dir(dir=dir_file, _type=test_pb2.Test), self.generate_messages()[1]]),
+            indices=test_pb2.Test,
+            mem_manager=lambda len: charged.append(len) or MemManager(len=len)
+        )
+        self.assertLess(charged[0], 100)
+        self.assertGreater(charged[1], os.path.getsize(dir_file))
+        os.remove(dir_file)
+
+    @staticmethod
+    def read_dir(_dir: Dir) -> list:
+        if not os.path.isdir(_dir.dir):
+            with open(_dir.dir, 'rb') as f:
+                return [f.read()]
+        with open(os.path.join(_dir.dir, METADATA_FILE_NAME)) as f:
+            _json: list = json.load(f)
+        parts: list = [_json]
+        for e in _json:
+            if type(e) is int:
+                with open(os.path.join(_dir.dir, str(e)), 'rb') as f:
+                    parts.append(f.read())
+        return parts
+
+    def test_import_multiblock(self):
+        filesystem = test_pb2.Filesystem()
+        for name in ('block1', 'block2'):
+            block = buffer_pb2.Buffer.Block()
+            block.hashes.append(buffer_pb2.Buffer.Block.Hash(
+                type=Enviroment.hash_type, value=sha3_256(name.encode()).digest()
+            ))
+            if not os.path.isfile(Enviroment.block_dir + sha3_256(name.encode()).hexdigest()):
+                with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'wb') as f:
+                    f.write(b''.join([name.encode() for i in range(100)]))
+            filesystem.branch.add(name=name, file=block.SerializeToString())
+        _, cache_dir = build_multiblock(
+            pf_object_with_block_pointers=filesystem,
+            blocks=[sha3_256(b'block1').digest(), sha3_256(b'block2').digest()]
+        )
+
+        filename: str = write_to_file(
+            path='__cache__/bee',
+            file_name='test_multiblock',
+            input=(m for m in [Dir(dir=cache_dir, _type=test_pb2.Filesystem), test_pb2.Filesystem()]),
+            indices=test_pb2.Filesystem
+        )
+        imported: list = list(read_from_file(path=filename, indices=test_pb2.Filesystem))
+        parsed: list = list(parse_from_buffer(
+            request_iterator=read_bee_file(filename), indices=test_pb2.Filesystem
+        ))
+        self.assertEqual(len(imported), 2)
+        self.assertTrue(os.path.isdir(imported[0].dir))
+        for i, p in zip(imported, parsed):
+            self.assertEqual(i.type, p.type)
+            self.assertEqual(self.read_dir(i), self.read_dir(p))
+
+    def test_import_aborted_block(self):
+        content: bytes = b''.join([b'import_block' for i in range(100)])
+        block_id: str = sha3_256(content).hexdigest()
+        with open(Enviroment.block_dir + block_id, 'wb') as f:
+            f.write(content)
+        block = buffer_pb2.Buffer.Block(previous_lengths_position=[1])
+        block.hashes.append(buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=bytes.fromhex(block_id)))
+        filesystem = test_pb2.Filesystem()
+        filesystem.branch.add(name='import_block', file=block.SerializeToString())
+        _, cache_dir = build_multiblock(pf_object_with_block_pointers=filesystem, blocks=[bytes.fromhex(block_id)])
+        filename: str = write_to_file(
+            path='__cache__/bee',
+            file_name='test_aborted_block',
+            input=iter([Dir(dir=cache_dir, _type=test_pb2.Filesystem)]),
+            indices=test_pb2.Filesystem
+        )
+        os.remove(Enviroment.block_dir + block_id)
+        start, end = get_bee_file_data_range(filename=filename)
+        records: list = [(control, chunk) for _, _, control, chunk in scan_bee_records(filename, start, end)]
+        inside_block: int = [i for i, (control, _) in enumerate(records)
+                             if control and control.HasField('block')][0] + 1
+
+        # Neither an aborted import nor a message that ends inside the block leave it on the registry.
+        importer = BeeFileImporter(filename=filename, indices={1: test_pb2.Filesystem})
+        for control, chunk in records[:inside_block + 1]:
+            importer.on_record(control=control, chunk=chunk)
+        importer.close()
+        self.assertFalse(os.path.isfile(Enviroment.block_dir + block_id))
+
+        importer = BeeFileImporter(filename=filename, indices={1: test_pb2.Filesystem})
+        for control, chunk in records[:inside_block + 1]:
+            importer.on_record(control=control, chunk=chunk)
+        with self.assertRaises(Exception):
+            importer.on_record(control=buffer_pb2.Buffer(separator=True), chunk=None)
+        importer.close()
+        self.assertFalse(os.path.isfile(Enviroment.block_dir + block_id))
+
+        self.assertEqual(len(list(read_from_file(path=filename, indices=test_pb2.Filesystem))), 1)
+        with open(Enviroment.block_dir + block_id, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+
+class TestFeedMessage(unittest.TestCase):
+    @staticmethod
+    def block_buffer(name: bytes) -> buffer_pb2.Buffer:
+        block = buffer_pb2.Buffer.Block(previous_lengths_position=[1])
+        block.hashes.append(buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=sha3_256(name).digest()))
+        return buffer_pb2.Buffer(block=block)
+
+    def test_multiblock_on_memory(self):
+        filesystem = test_pb2.Filesystem()
+        real = test_pb2.Filesystem()
+        for name in ('block1', 'block2'):
+            block = buffer_pb2.Buffer.Block()
+            block.hashes.append(buffer_pb2.Buffer.Block.Hash(
+                type=Enviroment.hash_type, value=sha3_256(name.encode()).digest()
+            ))
+            if not os.path.isfile(Enviroment.block_dir + sha3_256(name.encode()).hexdigest()):
+                with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'wb') as f:
+                    f.write(b''.join([name.encode() for i in range(100)]))
+            filesystem.branch.add(name=name, file=block.SerializeToString())
+            with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'rb') as f:
+                real.branch.add(name=name, file=f.read())
+        _, cache_dir = build_multiblock(
+            pf_object_with_block_pointers=filesystem,
+            blocks=[sha3_256(b'block1').digest(), sha3_256(b'block2').digest()]
+        )
+
+        # The whole message is parsed, with the blocks read from the registry.
+        self.assertEqual(list(parse_from_buffer(
+            request_iterator=serialize_to_buffer(message_iterator=Dir(dir=cache_dir, _type=test_pb2.Filesystem),
+                                                 indices=test_pb2.Filesystem),
+            indices=test_pb2.Filesystem,
+            partitions_message_mode=True
+        )), [real])
+
+    def test_nested_blocks(self):
+        name: bytes = b'nested block ' + os.urandom(8)
+        stream: list = [
+            buffer_pb2.Buffer(head=buffer_pb2.Buffer.Head(index=1), chunk=b'a'),
+            self.block_buffer(name),
+            buffer_pb2.Buffer(chunk=b'b'),
+            self.block_buffer(b'inner'),  # Deeper than block_depth, it's part of the outer block.
+            buffer_pb2.Buffer(chunk=b'c'),
+            self.block_buffer(b'inner'),
+            self.block_buffer(name),
+            buffer_pb2.Buffer(chunk=b'd'),
+            buffer_pb2.Buffer(separator=True),
+        ]
+        self.assertEqual(list(parse_from_buffer(request_iterator=iter(stream), indices={1: bytes},
+                                                partitions_message_mode=True)), [b'abcd'])
+
+        dirname: str = generate_random_dir()
+        sink = MessageDir(dirname=dirname, signal=Signal(exist=False))
+        feed_message(stream=BufferStream(request_iterator=iter(stream), signal=Signal(exist=False)), sink=sink)
+        sink.close()
+        self.assertEqual(sink._json, [1, (sha3_256(name).hexdigest(), [1]), 2])
+        for filename, content in ((dirname + '/1', b'a'), (dirname + '/2', b'd'),
+                                  (Enviroment.block_dir + sha3_256(name).hexdigest(), b'bc')):
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+        modify_env(block_depth=2)
+        try:
+            with self.assertRaisesRegex(Exception, 'IntersectionError'):
+                list(parse_from_buffer(request_iterator=iter(stream[:5] + stream[6:]), indices={1: bytes}))
+        finally:
+            modify_env(block_depth=1)
+
+    def test_block_announcements(self):
+        name: bytes = b'announced block ' + os.urandom(8)
+        block_id: str = sha3_256(name).hexdigest()
+        stream: list = [
+            buffer_pb2.Buffer(head=buffer_pb2.Buffer.Head(index=1), chunk=b'a'),
+            self.block_buffer(name),
+            buffer_pb2.Buffer(chunk=b'b'),
+            buffer_pb2.Buffer(chunk=b'c'),
+            self.block_buffer(name),
+            buffer_pb2.Buffer(separator=True),
+        ]
+        with open(Enviroment.block_dir + block_id, 'wb') as f:
+            f.write(b'bc')
+        try:
+            # The receiver has the block, so its parser announces it through the serializer of its side.
+            receiver, sender = Signal(), Signal()
+            self.assertEqual(list(parse_from_buffer(request_iterator=iter(stream), signal=receiver,
+                                                    indices={1: bytes}, partitions_message_mode=True)), [b'abc'])
+            announcements = list(send_with_credits(buffers=iter([]), signal=receiver))
+            self.assertEqual(announcements, [block_announcement(block_id=block_id)])
+            self.assertIsNone(BufferStream(request_iterator=iter(announcements), signal=sender).next())
+            self.assertEqual(sender.peer_blocks, {block_id})
+            # The sender doesn't send its content, only the block buffers.
+            self.assertEqual(list(send_with_credits(buffers=iter(stream), signal=Signal(exist=False))), stream)
+            sent = list(send_with_credits(buffers=(buffer_pb2.Buffer.FromString(b.SerializeToString())
+                                                   for b in stream), signal=sender))
+            self.assertEqual([b.chunk for b in sent], [b'a', b'', b'', b''])
+
+            # Announced while the block is sent, the rest of its content is not sent.
+            sender = Signal(exist=False)
+            sent = []
+            for buffer in send_with_credits(buffers=iter(stream), signal=sender):
+                sent.append(buffer)
+                if buffer.chunk == b'b':
+                    sender.peer_has(block_id=block_id)
+            self.assertEqual(sent, stream[:3] + stream[4:])
+        finally:
+            os.remove(Enviroment.block_dir + block_id)
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_mem_manager(self):
+        budget = MemoryBudget(limit=100)
+        with MemManager(len=80, budget=budget) as first:
+            self.assertEqual(budget.usage()['used'], 80)
+            # Who holds memory alone goes over the budget, or says it with spill.
+            self.assertFalse(first.grow(40, spill=True))
+            self.assertTrue(first.grow(40))
+            self.assertFalse(budget.acquire(10, wait=False))
+        self.assertEqual(budget.usage(), {'limit': 100, 'used': 0, 'peak': 120, 'waiting': 0})
+        # A request bigger than the limit is served alone.
+        with MemManager(len=200, budget=budget):
+            self.assertEqual(budget.usage()['used'], 200)
+
+    def test_grow_waits(self):
+        budget = MemoryBudget(limit=100)
+        first, second = MemManager(len=60, budget=budget), MemManager(len=30, budget=budget)
+        with first, second:
+            # The memory released by a holder is waited for, and goes over the budget only alone.
+            threading.Timer(0.2, first.release).start()
+            self.assertTrue(second.grow(50))
+            self.assertEqual(budget.usage()['peak'], 90)
+            self.assertEqual(budget.usage()['used'], 80)
+
+        first, second = MemManager(len=50, budget=budget), MemManager(len=40, budget=budget)
+        with first, second:
+            # Two holders that would wait for each other don't, the last one fails.
+            grown: list = []
+            waiting = threading.Thread(target=lambda: grown.append(first.grow(40)))
+            waiting.start()
+            while not budget.usage()['waiting']:
+                waiting.join(timeout=0.01)
+            self.assertFalse(second.grow(40))
+            second.release()
+            waiting.join()
+            self.assertEqual(grown, [True])
+        self.assertEqual(budget.usage()['used'], 0)
+
+    def test_mem_manager_without_grow(self):
+        # Any context manager is a mem_manager, like the ones of older versions.
+        class Counter(object):
+            entered: list = []
+
+            def __init__(self, len):
+                Counter.entered.append(len)
+
+            def __enter__(self):
+                pass
+
+            def __exit__(self, exc_type, exc_value, trace):
+                pass
+
+        message = test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))
+        self.assertEqual(
+            list(parse_from_buffer(
+                request_iterator=serialize_to_buffer(message_iterator=iter([message]), indices=test_pb2.Test,
+                                                     mem_manager=Counter),
+                indices=test_pb2.Test,
+                partitions_message_mode=True,
+                mem_manager=Counter
+            )),
+            [message]
+        )
+        self.assertTrue(Counter.entered)
+
+    def test_auto_partitions_message_mode(self):
+        messages = [test_pb2.Test(t1=b'small'), test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))]
+        limit = Enviroment.memory_budget.limit
+        modify_env(memory_limit=2 * CHUNK_SIZE)
+        try:
+            # The big message starts to be parsed on memory and is spilled to disk.
+            buffers = list(serialize_to_buffer(message_iterator=(m for m in messages), indices=test_pb2.Test))
+            results = list(parse_from_buffer(
+                request_iterator=iter(buffers),
+                indices=test_pb2.Test,
+                partitions_message_mode=None
+            ))
+        finally:
+            Enviroment.memory_budget.limit = limit
+        self.assertEqual(results[0], messages[0])
+        self.assertIs(type(results[1]), Dir)
+        self.assertEqual(parse_dir(results[1]), messages[1])
+        self.assertEqual(get_memory_usage()['used'], 0)
+
+
+class TestFlowControl(unittest.TestCase):
+    def test_credits(self):
+        receiver, sender = Signal(window=4), Signal()
+        # Nothing is granted until the peer shows that it reads credits, and without grants nobody waits.
+        self.assertIsNone(receiver.take_grant())
+        self.assertIsNone(sender.acquire(3))
+        receiver.grant(0)
+        receiver.receive(3)
+        sender.grant(receiver.take_grant())
+        self.assertEqual(sender.credit, 1)
+        self.assertIsNone(sender.acquire(2))
+
+        blocked = threading.Thread(target=sender.acquire, args=(1,), daemon=True)
+        blocked.start()
+        blocked.join(timeout=0.1)
+        self.assertTrue(blocked.is_alive())
+        receiver.receive(2)  # The first buffer has been processed, half of the window.
+        sender.grant(receiver.take_grant())
+        blocked.join(timeout=1)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(sender.credit, 1)
+
+        self.assertTrue(receiver.release())
+        self.assertFalse(receiver.release())
+        sender.grant(0)
+        self.assertIsNone(sender.credit)
+
+    def test_control_buffers(self):
+        messages = [test_pb2.Test(t1=b'first'), test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))]
+        signal = Signal(window=CHUNK_SIZE)
+        buffers = list(serialize_to_buffer(message_iterator=(m for m in messages), indices=test_pb2.Test,
+                                           signal=signal))
+        self.assertEqual(buffers[0].credit, 0)
+        # The credits of the peer between the buffers are applied to the signal, not parsed.
+        received = Signal(window=CHUNK_SIZE)
+        results = list(parse_from_buffer(
+            request_iterator=iter(buffers[:2] + [buffer_pb2.Buffer(credit=CHUNK_SIZE)] + buffers[2:]),
+            signal=received,
+            indices=test_pb2.Test,
+            partitions_message_mode=True
+        ))
+        self.assertEqual(results, messages)
+        self.assertTrue(received.peer_reads_credits)
+        # All the chunks have been processed, but the last buffer that is held until the next is asked.
+        self.assertEqual(received.take_grant(), sum(len(b.chunk) for b in buffers[:-1]) + received.window)
+
+    def test_batch(self):
+        big = test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))
+        messages = [small_message(str(i).encode() * (i % 20)) for i in range(20000)]
+        messages[0] = test_pb2.Test()
+        messages = messages[:100] + [big] + messages[100:]
+        buffers = list(serialize_to_buffer(message_iterator=(m for m in messages), indices=test_pb2.Test, batch=True))
+        batches = [b for b in buffers if b.batch]
+        self.assertGreater(len(batches), 1)
+        self.assertTrue(all(len(b.chunk) <= CHUNK_SIZE for b in batches))
+        # The empty message of the first batch is skipped, like when it comes on its own buffer.
+        expected = [m for m in messages if m.ByteSize()]
+        self.assertEqual(list(parse_from_buffer(request_iterator=iter(buffers), indices=test_pb2.Test,
+                                                partitions_message_mode=True)), expected)
+        outputs = list(parse_from_buffer(request_iterator=iter(buffers[:1]), indices=test_pb2.Test,
+                                         partitions_message_mode=False))
+        self.assertEqual([parse_dir(o) for o in outputs], expected[:99])
+
+        # Without being forced, only when the peer has said that it decodes them.
+        signal = Signal(window=CHUNK_SIZE)
+        buffers = list(serialize_to_buffer(message_iterator=iter(messages[:10]), indices=test_pb2.Test,
+                                           signal=signal))
+        self.assertTrue(buffers[0].accepts_batch)
+        self.assertFalse(any(b.batch for b in buffers))
+        list(parse_from_buffer(request_iterator=iter(buffers), signal=signal, indices=test_pb2.Test,
+                               partitions_message_mode=True))
+        self.assertTrue(signal.peer_reads_batches)
+        buffers = list(serialize_to_buffer(message_iterator=iter(messages[:10]), indices=test_pb2.Test,
+                                           signal=signal))
+        self.assertEqual([b.batch for b in buffers], [True])
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_stream(self):
+        message = test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))
+        instrumentation = MemoryInstrumentation()
+        buffers = list(serialize_to_buffer(message_iterator=message, indices=test_pb2.Test,
+                                           instrumentation=instrumentation))
+        results = list(parse_from_buffer(request_iterator=iter(buffers), indices=test_pb2.Test,
+                                         instrumentation=instrumentation))
+        self.assertEqual(parse_dir(results[0]), message)
+
+        snapshot = instrumentation.snapshot()
+        chunks: int = (message.ByteSize() + CHUNK_SIZE - 1) // CHUNK_SIZE
+        for name in ('sent_bytes', 'received_bytes', 'serialized_bytes'):
+            self.assertEqual(snapshot['counters'][name], message.ByteSize())
+        self.assertEqual(snapshot['counters']['sent_chunks'], chunks)
+        self.assertEqual(snapshot['counters']['received_chunks'], chunks)
+        self.assertEqual(len(snapshot['histograms']['disk_write_seconds']), chunks)
+        self.assertEqual(len(snapshot['histograms']['serialize_seconds']), chunks)
+        self.assertEqual(len(snapshot['histograms']['signal_wait_seconds']), len(buffers))
+        self.assertEqual(len(snapshot['histograms']['send_throughput']), 1)
+        self.assertEqual(len(snapshot['histograms']['receive_throughput']), 1)
+
+    def test_skipped_blocks(self):
+        filesystem = test_pb2.Filesystem()
+        block_size: int = 0
+        for name in ('block1', 'block2'):
+            block = buffer_pb2.Buffer.Block()
+            block.hashes.append(buffer_pb2.Buffer.Block.Hash(
+                type=Enviroment.hash_type, value=sha3_256(name.encode()).digest()
+            ))
+            if not os.path.isfile(Enviroment.block_dir + sha3_256(name.encode()).hexdigest()):
+                with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'wb') as f:
+                    f.write(b''.join([name.encode() for i in range(100)]))
+            block_size += os.path.getsize(Enviroment.block_dir + sha3_256(name.encode()).hexdigest())
+            filesystem.branch.add(name=name, file=block.SerializeToString())
+        _, cache_dir = build_multiblock(
+            pf_object_with_block_pointers=filesystem,
+            blocks=[sha3_256(b'block1').digest(), sha3_256(b'block2').digest()]
+        )
+
+        # The receiver already has both blocks, their content is read from the registry.
+        instrumentation = MemoryInstrumentation()
+        list(parse_from_buffer(
+            request_iterator=serialize_to_buffer(message_iterator=Dir(dir=cache_dir, _type=test_pb2.Filesystem),
+                                                 indices=test_pb2.Filesystem),
+            indices=test_pb2.Filesystem,
+            partitions_message_mode=True,
+            instrumentation=instrumentation
+        ))
+        self.assertEqual(instrumentation.snapshot()['counters']['blocks_skipped'], 2)
+        self.assertEqual(instrumentation.snapshot()['counters']['deduplicated_bytes'], block_size)
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
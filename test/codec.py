@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.client import parse_from_buffer, serialize_to_buffer
+from grpcbigbuffer.codec import BeeCodec
+from grpcbigbuffer.server import BeeServer
+from grpcbigbuffer.utils import CHUNK_SIZE, Dir
+from helpers import LocalServer, bee_echo
+
+
+class TestBeeCodec(unittest.TestCase):
+    def setUp(self):
+        self.codec = BeeCodec(indices_parser=test_pb2.Test, partitions_message_mode_parser=True,
+                              indices_serializer=test_pb2.Test)
+
+    def test_small_message(self):
+        message = test_pb2.Test(t1=b'small', t2=b'message')
+        buffers: list = list(self.codec.serialize(input=message))
+        self.assertEqual(buffers, [buffer_pb2.Buffer(chunk=message.SerializeToString(),
+                                                     head=buffer_pb2.Buffer.Head(index=1), separator=True)])
+        self.assertEqual(list(self.codec.parse(iter(buffers))), [message])
+        # The same buffers of serialize_to_buffer and parse_from_buffer.
+        self.assertEqual(list(parse_from_buffer(iter(buffers), indices=test_pb2.Test, partitions_message_mode=True)),
+                         [message])
+        self.assertEqual(list(self.codec.parse(serialize_to_buffer(message_iterator=message, indices=test_pb2.Test))),
+                         [message])
+
+    def test_big_and_many_messages(self):
+        big = test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))
+        self.assertEqual(list(self.codec.parse(self.codec.serialize(input=big))), [big])
+
+        messages: list = [test_pb2.Test(t1=b'first'), big, test_pb2.Test(t2=b'third')]
+        self.assertEqual(list(self.codec.parse(serialize_to_buffer(message_iterator=iter(messages),
+                                                                   indices=test_pb2.Test))), messages)
+
+    def test_defaults(self):
+        codec = BeeCodec()
+        self.assertEqual(list(codec.parse(codec.serialize())), [buffer_pb2.Empty()])
+        codec = BeeCodec(indices_parser={1: test_pb2.Test, 2: bytes},
+                         partitions_message_mode_parser={0: True, 1: True})
+        self.assertEqual(list(codec.parse(codec.serialize(input=b'bytes'))), [b'bytes'])
+        # Messages parsed on disk don't take the fast path.
+        outputs: list = list(codec.parse(iter([
+            buffer_pb2.Buffer(chunk=b'on disk', head=buffer_pb2.Buffer.Head(index=2), separator=True)
+        ])))
+        self.assertEqual(type(outputs[0]), Dir)
+
+    def test_call(self):
+        bee_server = BeeServer()
+        server = LocalServer(methods={'Echo': bee_echo(bee_server)}, max_workers=4)
+        try:
+            for message in (test_pb2.Test(t1=b'small'), test_pb2.Test(t1=os.urandom(3 * CHUNK_SIZE))):
+                self.assertEqual(list(self.codec.call(method=server.stub(), input=message, timeout=30)), [message])
+        finally:
+            server.stop()
+            bee_server.shutdown()
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import unittest
+from hashlib import sha3_256
+from typing import Dict, List
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.disk_stream import partition_disk_stream, write_partition_disk_stream, \
+    calculate_hash_of_complete, validate_partitions
+
+CACHE_DIR = '__cache__/disk_stream/'
+
+
+def generate_partition(model: Dict) -> buffer_pb2.Buffer.Head.Partition:
+    partition = buffer_pb2.Buffer.Head.Partition()
+    for index, sub_model in model.items():
+        partition.index[index].CopyFrom(generate_partition(sub_model))
+    return partition
+
+
+def prune(message, model: Dict):
+    # Copies on a new message the fields selected by the model.
+    pruned = type(message)()
+    for index, sub_model in model.items():
+        field = message.DESCRIPTOR.fields_by_number[index]
+        if sub_model:
+            getattr(pruned, field.name).CopyFrom(prune(getattr(message, field.name), sub_model))
+        elif field.message_type:
+            getattr(pruned, field.name).CopyFrom(getattr(message, field.name))
+        else:
+            setattr(pruned, field.name, getattr(message, field.name))
+    return pruned
+
+
+def write_partition_file(message, model: Dict, filename: str):
+    # A chain of single index partitions only stores the value of the last field.
+    while len(model) == 1:
+        index, model = next(iter(model.items()))
+        message = getattr(message, message.DESCRIPTOR.fields_by_number[index].name)
+        if not model:
+            break
+    with open(filename, 'wb') as f:
+        if type(message) is bytes:
+            f.write(message)
+        else:
+            f.write(prune(message, model).SerializeToString() if model else message.SerializeToString())
+
+
+def generate_message() -> test_pb2.Test:
+    message = test_pb2.Test()
+    message.t1 = b''.join([b'mt1' for i in range(1000)])
+    message.t2 = b'mt2'
+    message.t3.t1 = b''.join([b'st1' for i in range(200)])
+    message.t3.t2 = b'st2'
+    message.t3.t3.t1 = b''.join([b'sst1' for i in range(50)])
+    message.t5 = b''.join([b'mt5' for i in range(100)])
+    return message
+
+
+class TestPartitionDiskStream(unittest.TestCase):
+    models: List[List[Dict]] = [
+        [{1: {}}, {2: {}}],
+        [{1: {}, 2: {}}, {3: {}}],
+        [{1: {}}, {3: {1: {}}}, {3: {2: {}}, 5: {}}],
+        [{3: {1: {}}}, {1: {}}, {3: {2: {}}}],
+        [{1: {}, 2: {}}, {3: {1: {}, 2: {}}}, {3: {3: {1: {}}}}, {5: {}}],
+        # Unordered partition models.
+        [{1: {}, 5: {}}, {2: {}}],
+        [{3: {3: {1: {}}}}, {3: {1: {}, 2: {}}}, {1: {}, 5: {}}],
+        [{3: {2: {}}, 5: {}}, {2: {}}, {1: {}, 3: {1: {}, 3: {}}}],
+    ]
+
+    def setUp(self):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+    def write_partitions(self, message, model: List[Dict]) -> List[str]:
+        dirs: List[str] = []
+        for i, m in enumerate(model):
+            dirs.append(CACHE_DIR + str(i))
+            write_partition_file(message, m, dirs[-1])
+        return dirs
+
+    def expected(self, message, model: List[Dict]) -> test_pb2.Test:
+        expected = test_pb2.Test()
+        for m in model:
+            expected.MergeFrom(prune(message, m))
+        return expected
+
+    def test_partition_disk_stream(self):
+        message = generate_message()
+        for model in self.models:
+            dirs = self.write_partitions(message, model)
+            merged = test_pb2.Test()
+            merged.ParseFromString(
+                b''.join(partition_disk_stream(
+                    dirs=dirs,
+                    partitions=[generate_partition(m) for m in model],
+                    chunk_size=128
+                ))
+            )
+            self.assertEqual(self.expected(message, model), merged, model)
+
+    def test_write_partition_disk_stream(self):
+        message = generate_message()
+        for model in self.models:
+            dirs = self.write_partitions(message, model)
+            partitions = [generate_partition(m) for m in model]
+            written: int = write_partition_disk_stream(
+                dirs=dirs,
+                partitions=partitions,
+                filename=CACHE_DIR + 'merged'
+            )
+            with open(CACHE_DIR + 'merged', 'rb') as f:
+                content: bytes = f.read()
+            self.assertEqual(written, len(content))
+            self.assertEqual(b''.join(partition_disk_stream(dirs=dirs, partitions=partitions)), content)
+            self.assertEqual(
+                calculate_hash_of_complete(dirs=dirs, partitions=partitions),
+                sha3_256(content).hexdigest()
+            )
+
+    def test_unordered_partition_models(self):
+        self.assertFalse(validate_partitions([generate_partition(m) for m in self.models[5]]))
+
+    def test_overlapped_partition_models(self):
+        message = generate_message()
+        for model in [
+            [{3: {}}, {3: {1: {}}}],
+            [{1: {}, 2: {}}, {2: {}}],
+        ]:
+            dirs = self.write_partitions(message, model)
+            with self.assertRaises(Exception):
+                list(partition_disk_stream(dirs=dirs, partitions=[generate_partition(m) for m in model]))
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import sys
+import unittest
+from hashlib import sha3_256
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, celaut_pb2, test_pb2
+from grpcbigbuffer.block_builder import build_multiblock
+from grpcbigbuffer.client import serialize_to_buffer
+from grpcbigbuffer.events import Event, WireDecoder, parse_events, HEAD, FIELD_START, FIELD_END, SCALAR, CHUNK, \
+    BLOCK_START, BLOCK_END, MESSAGE_END
+from grpcbigbuffer.instrumentation import MemoryInstrumentation
+from grpcbigbuffer.utils import CHUNK_SIZE, Dir, Enviroment
+
+
+def join_chunks(events: list) -> list:
+    # The consecutive chunks of a field as one, as if the message had come on a single chunk.
+    joined: list = []
+    for event in events:
+        if event.kind == CHUNK and joined and joined[-1].kind == CHUNK and joined[-1].path == event.path:
+            joined[-1] = Event(CHUNK, event.path, joined[-1].value + event.value)
+        else:
+            joined.append(event)
+    return joined
+
+
+def decode(message, chunk_size: int) -> list:
+    serialized: bytes = message.SerializeToString()
+    decoder = WireDecoder(descriptor=message.DESCRIPTOR)
+    events: list = []
+    for i in range(0, len(serialized), chunk_size):
+        events.extend(decoder.feed(serialized[i:i + chunk_size]))
+    return events + decoder.end()
+
+
+class TestEvents(unittest.TestCase):
+    def test_decoder(self):
+        message = test_pb2.Test(t1=b'ab', t3=test_pb2.Test(t4=[test_pb2.Test(), test_pb2.Test(t5=b'c')]))
+        self.assertEqual(decode(message=message, chunk_size=CHUNK_SIZE), [
+            Event(FIELD_START, (1,), 2), Event(CHUNK, (1,), b'ab'), Event(FIELD_END, (1,)),
+            Event(FIELD_START, (3,), 7),
+            Event(FIELD_START, (3, 4), 0), Event(FIELD_END, (3, 4)),
+            Event(FIELD_START, (3, 4), 3),
+            Event(FIELD_START, (3, 4, 5), 1), Event(CHUNK, (3, 4, 5), b'c'), Event(FIELD_END, (3, 4, 5)),
+            Event(FIELD_END, (3, 4)),
+            Event(FIELD_END, (3,)),
+        ])
+
+        enum_def = celaut_pb2.FieldDef()
+        enum_def.enum.value['b'] = -5
+        field_def = celaut_pb2.FieldDef()
+        field_def.message.oneof.add(index=[1, 2, 300])
+        self.assertEqual([e.value for e in decode(message=enum_def, chunk_size=1) if e.kind == SCALAR], [-5])
+        self.assertEqual([e for e in decode(message=field_def, chunk_size=1) if e.kind == SCALAR],
+                         [Event(SCALAR, (1, 2, 1), value) for value in (1, 2, 300)])
+
+    def test_split_fields(self):
+        # Any chunk boundary, inside the headers too, gives the same events.
+        field_def = celaut_pb2.FieldDef()
+        field_def.message.param[3].field.primitive.regex = 'regex' * 100
+        field_def.message.param[3].repeated = True
+        field_def.message.param[400].repeated = False
+        field_def.message.oneof.add(index=[1, 2, 300])
+        for message in (field_def, test_pb2.Test(t1=os.urandom(300), t3=test_pb2.Test(t2=b'x' * 200))):
+            events: list = decode(message=message, chunk_size=len(message.SerializeToString()))
+            for chunk_size in (1, 2, 3, 7, 64):
+                self.assertEqual(join_chunks(decode(message=message, chunk_size=chunk_size)), events)
+
+    def test_stream(self):
+        message = test_pb2.Test(t1=os.urandom(3 * CHUNK_SIZE), t2=b'small', t4=[test_pb2.Test(t1=b'element')])
+        received: list = []
+        buffers: list = list(serialize_to_buffer(message_iterator=message, indices=test_pb2.Test))
+        events: list = []
+        for event in parse_events(request_iterator=(received.append(b) or b for b in buffers), indices=test_pb2.Test):
+            if event.kind == CHUNK and not any(e.kind == CHUNK for e in events):
+                # The first chunk of the field is given before the message is received.
+                self.assertLess(len(received), len(buffers))
+            events.append(event)
+        self.assertEqual(events[0], Event(HEAD, (), 1))
+        self.assertEqual(events[-1], Event(MESSAGE_END, (), 1))
+        self.assertEqual(b''.join(e.value for e in events if e.kind == CHUNK and e.path == (1,)), message.t1)
+        self.assertEqual(join_chunks(events[1:-1]), join_chunks(decode(message=message, chunk_size=CHUNK_SIZE)))
+
+    def test_blocks(self):
+        filesystem = test_pb2.Filesystem()
+        contents: dict = {}
+        for name in ('block1', 'block2'):
+            block = buffer_pb2.Buffer.Block()
+            block.hashes.append(buffer_pb2.Buffer.Block.Hash(
+                type=Enviroment.hash_type, value=sha3_256(name.encode()).digest()
+            ))
+            if not os.path.isfile(Enviroment.block_dir + sha3_256(name.encode()).hexdigest()):
+                with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'wb') as f:
+                    f.write(b''.join([name.encode() for i in range(100)]))
+            with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'rb') as f:
+                contents[sha3_256(name.encode()).hexdigest()] = f.read()
+            filesystem.branch.add(name=name, file=block.SerializeToString())
+        _, cache_dir = build_multiblock(
+            pf_object_with_block_pointers=filesystem,
+            blocks=[sha3_256(b'block1').digest(), sha3_256(b'block2').digest()]
+        )
+
+        instrumentation = MemoryInstrumentation()
+        events: list = list(parse_events(
+            request_iterator=serialize_to_buffer(message_iterator=Dir(dir=cache_dir, _type=test_pb2.Filesystem),
+                                                 indices=test_pb2.Filesystem),
+            indices=test_pb2.Filesystem,
+            instrumentation=instrumentation
+        ))
+        blocks: list = [e for e in events if e.kind in (BLOCK_START, BLOCK_END)]
+        self.assertEqual(blocks, [Event(kind, (2, 2), block_id) for block_id in contents
+                                  for kind in (BLOCK_START, BLOCK_END)])
+        # The content of each block is given between its events, read from the registry.
+        for block_id, content in contents.items():
+            start: int = events.index(Event(BLOCK_START, (2, 2), block_id))
+            end: int = events.index(Event(BLOCK_END, (2, 2), block_id))
+            self.assertEqual(b''.join(e.value for e in events[start:end] if e.kind == CHUNK), content)
+        self.assertEqual(instrumentation.snapshot()['counters']['blocks_skipped'], 2)
+
+    def test_batch(self):
+        messages: list = [test_pb2.Test(t1=b'\x00' + str(i).encode()) for i in range(3)]
+        events: list = list(parse_events(
+            request_iterator=serialize_to_buffer(message_iterator=iter(messages), indices=test_pb2.Test, batch=True),
+            indices=test_pb2.Test
+        ))
+        self.assertEqual(len([e for e in events if e.kind == HEAD]), 3)
+        self.assertEqual([e.value for e in events if e.kind == CHUNK], [m.t1 for m in messages])
+        self.assertEqual(events[-1], Event(MESSAGE_END, (), 1))
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,99 @@
+import signal
+import sys
+import threading
+from concurrent import futures
+from hashlib import sha3_256
+from typing import Callable, Dict, Union
+
+import grpc
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.server import BeeServer
+from grpcbigbuffer.utils import Enviroment
+
+BLOCK_ID: str = sha3_256(b'block0block1block2').hexdigest()  # The hash of the content of the block.
+
+
+def generate_block() -> buffer_pb2.Buffer.Block:
+    return buffer_pb2.Buffer.Block(
+        hashes=[buffer_pb2.Buffer.Block.Hash(type=Enviroment.hash_type, value=bytes.fromhex(BLOCK_ID))]
+    )
+
+
+def generate_buffers():
+    # A message with ten chunks and a block of three.
+    yield buffer_pb2.Buffer(head=buffer_pb2.Buffer.Head(index=1))
+    for i in range(10):
+        yield buffer_pb2.Buffer(chunk=str(i).encode())
+    yield buffer_pb2.Buffer(block=generate_block())
+    for i in range(3):
+        yield buffer_pb2.Buffer(chunk=b'block' + str(i).encode())
+    yield buffer_pb2.Buffer(block=generate_block())
+    yield buffer_pb2.Buffer(separator=True)
+
+
+def small_message(payload: bytes) -> test_pb2.Test:
+    # A zero first byte keeps the payload from parsing as a block.
+    return test_pb2.Test(t1=b'\x00' + payload)
+
+
+def bee_echo(bee_server: BeeServer):
+    # A method of the BeeServer that returns the Test messages that it receives.
+    @bee_server.method(indices_parser=test_pb2.Test, partitions_message_mode_parser=True,
+                       indices_serializer=test_pb2.Test)
+    def echo(messages, context):
+        return [m for m in messages]
+
+    return echo
+
+
+def stream_stub(channel: grpc.Channel, service: str = 'test.Service', name: str = 'Echo'):
+    return channel.stream_stream(
+        '/' + service + '/' + name,
+        request_serializer=buffer_pb2.Buffer.SerializeToString,
+        response_deserializer=buffer_pb2.Buffer.FromString
+    )
+
+
+class LocalServer(object):
+    """
+    A gRPC server of the methods of a service, on a free port of localhost or on the given address, with
+     a channel to it. The methods are stream methods of buffers, unless they are given as handlers.
+    """
+    def __init__(
+            self,
+            methods: Dict[str, Union[Callable, grpc.RpcMethodHandler]],
+            service: str = 'test.Service',
+            address: str = 'localhost:0',
+            max_workers: int = 8
+    ):
+        self.service: str = service
+        self.server: grpc.Server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        self.server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(service, {
+            name: method if isinstance(method, grpc.RpcMethodHandler) else grpc.stream_stream_rpc_method_handler(
+                method,
+                request_deserializer=buffer_pb2.Buffer.FromString,
+                response_serializer=buffer_pb2.Buffer.SerializeToString
+            ) for name, method in methods.items()
+        }),))
+        port: int = self.server.add_insecure_port(address)
+        self.server.start()
+        self.target: str = address if address.startswith('unix:') else 'localhost:' + str(port)
+        self.channel: grpc.Channel = grpc.insecure_channel(self.target)
+
+    def stub(self, name: str = 'Echo'):
+        return stream_stub(channel=self.channel, service=self.service, name=name)
+
+    def stop(self):
+        self.channel.close()
+        self.server.stop(None)
+
+    def serve(self):
+        # The server process of a benchmark prints its target and runs until its client terminates it.
+        print(self.target, flush=True)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        stop.wait()
+        self.stop()
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+from hashlib import sha3_256
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.block_builder import build_multiblock
+from grpcbigbuffer.client import parse_dir
+from grpcbigbuffer.lazy_message import lazy_parse_dir, FileRange, LARGE_FIELD_LENGTH
+from grpcbigbuffer.utils import Dir, Enviroment
+
+
+class TestLazyMessage(unittest.TestCase):
+    def test_single_file(self):
+        message = test_pb2.Test(t1=b''.join([b'mt1' for i in range(LARGE_FIELD_LENGTH)]), t2=b'mt2')
+        message.t3.t1 = b'st1'
+        message.t3.t3.t5 = b'sst5'
+        message.t4.add(t2=b'first')
+        message.t4.add(t2=b'second')
+        filename: str = '__cache__/lazy_message'
+        with open(filename, 'wb') as f:
+            f.write(message.SerializeToString())
+
+        with lazy_parse_dir(Dir(dir=filename, _type=test_pb2.Test)) as lazy:
+            self.assertEqual(lazy.fields(), ['t1', 't2', 't3', 't4'])
+            self.assertIs(type(lazy.t1), FileRange)
+            self.assertEqual(lazy.t1.read(), message.t1)
+            self.assertEqual(bytes(lazy.t1.view()), message.t1)
+            self.assertEqual(lazy.t2, b'mt2')
+            self.assertEqual(lazy.t5, b'')
+            self.assertTrue(lazy.HasField('t3'))
+            self.assertFalse(lazy.HasField('t5'))
+            self.assertEqual(lazy.t3.t1, b'st1')
+            self.assertEqual(lazy.t3.t3.t5, b'sst5')
+            self.assertEqual([t.t2 for t in lazy.t4], [b'first', b'second'])
+            self.assertEqual(lazy.parse(), message)
+        os.remove(filename)
+
+    def test_multiblock(self):
+        filesystem = test_pb2.Filesystem()
+        for name in ('block1', 'block2'):
+            block = buffer_pb2.Buffer.Block()
+            block.hashes.append(buffer_pb2.Buffer.Block.Hash(
+                type=Enviroment.hash_type, value=sha3_256(name.encode()).digest()
+            ))
+            if not os.path.isfile(Enviroment.block_dir + sha3_256(name.encode()).hexdigest()):
+                with open(Enviroment.block_dir + sha3_256(name.encode()).hexdigest(), 'wb') as f:
+                    f.write(b''.join([name.encode() for i in range(100)]))
+            filesystem.branch.add(name=name, file=block.SerializeToString())
+        _, cache_dir = build_multiblock(
+            pf_object_with_block_pointers=filesystem,
+            blocks=[sha3_256(b'block1').digest(), sha3_256(b'block2').digest()]
+        )
+
+        _dir = Dir(dir=cache_dir, _type=test_pb2.Filesystem)
+        with lazy_parse_dir(_dir) as lazy:
+            self.assertEqual([b.name for b in lazy.branch], ['block1', 'block2'])
+            for branch in lazy.branch:
+                self.assertIs(type(branch.file), FileRange)
+                with open(Enviroment.block_dir + sha3_256(branch.name.encode()).hexdigest(), 'rb') as f:
+                    self.assertEqual(branch.file.read(), f.read())
+            self.assertEqual(lazy.parse(), parse_dir(_dir))
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import buffer_pb2, test_pb2
+from grpcbigbuffer.client import client_grpc
+from grpcbigbuffer.relay import Relay, relay_grpc
+from grpcbigbuffer.server import BeeServer
+from grpcbigbuffer.utils import CHUNK_SIZE, Enviroment, Signal
+from helpers import BLOCK_ID, LocalServer, bee_echo, generate_buffers
+
+
+class TestRelay(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(Enviroment.block_dir + BLOCK_ID):
+            os.remove(Enviroment.block_dir + BLOCK_ID)
+
+    def test_tee_blocks(self):
+        self.assertEqual(list(Relay(request_iterator=generate_buffers())), list(generate_buffers()))
+        with open(Enviroment.block_dir + BLOCK_ID, 'rb') as f:
+            self.assertEqual(f.read(), b'block0block1block2')
+
+    def test_skip_block(self):
+        # The next peer has announced the block.
+        send_signal = Signal(exist=False)
+        send_signal.peer_has(block_id=BLOCK_ID)
+        receive_signal = Signal()
+        self.assertEqual(
+            list(Relay(request_iterator=generate_buffers(), receive_signal=receive_signal, send_signal=send_signal)),
+            [b for b in generate_buffers() if not b.chunk.startswith(b'block')]
+        )
+        # The block is stored all the same, so the previous peer has to send it.
+        with open(Enviroment.block_dir + BLOCK_ID, 'rb') as f:
+            self.assertEqual(f.read(), b'block0block1block2')
+        self.assertEqual(receive_signal.take_announced(), [])
+
+        # Once it's on the registry, the announcement is passed on to the previous peer.
+        send_signal = Signal(exist=False)
+        relay = Relay(request_iterator=generate_buffers(), receive_signal=receive_signal, send_signal=send_signal,
+                      read_ahead=0)
+        forwarded = []
+        for buffer in relay:
+            forwarded.append(buffer)
+            if buffer.chunk == b'block0':
+                send_signal.peer_has(block_id=BLOCK_ID)
+        self.assertEqual(forwarded, [b for b in generate_buffers() if b.chunk not in (b'block1', b'block2')])
+        self.assertEqual(receive_signal.take_announced(), [BLOCK_ID])
+
+    def test_aborted_block(self):
+        buffers = list(generate_buffers())[:-2]
+        with self.assertRaises(Exception):
+            list(Relay(request_iterator=iter(buffers)))
+        self.assertFalse(os.path.exists(Enviroment.block_dir + BLOCK_ID))
+
+    def test_rejected_block(self):
+        # The content doesn't match the hash of the block, so it's forwarded but not stored.
+        buffers = [buffer_pb2.Buffer(chunk=b'block3') if b.chunk == b'block2' else b for b in generate_buffers()]
+        self.assertEqual(list(Relay(request_iterator=iter(buffers))), buffers)
+        self.assertFalse(os.path.exists(Enviroment.block_dir + BLOCK_ID))
+
+    def test_unbatch(self):
+        batch = buffer_pb2.Buffer(chunk=buffer_pb2.Buffer.Batch(
+            indices=[1, 1], messages=[b'\x00a', b'\x00b']
+        ).SerializeToString(), batch=True)
+        self.assertEqual(list(Relay(request_iterator=iter([batch]))), [
+            buffer_pb2.Buffer(chunk=b'\x00a', head=buffer_pb2.Buffer.Head(index=1), separator=True),
+            buffer_pb2.Buffer(chunk=b'\x00b', head=buffer_pb2.Buffer.Head(index=1), separator=True),
+        ])
+        # The batch is forwarded as is to a peer that decodes them.
+        send_signal = Signal(exist=False)
+        send_signal.peer_reads_batches = True
+        self.assertEqual(list(Relay(request_iterator=iter([batch]), send_signal=send_signal)), [batch])
+
+
+class TestRelayGrpc(unittest.TestCase):
+    def setUp(self):
+        self.bee_server = BeeServer(flow_control_window=2 * CHUNK_SIZE)
+        self.server = LocalServer(methods={'Echo': bee_echo(self.bee_server)})
+        server_method = self.server.stub()
+        self.relay = LocalServer(methods={
+            'Echo': lambda request_iterator, context: relay_grpc(method=server_method,
+                                                                 request_iterator=request_iterator)
+        })
+        self.stub_method = self.relay.stub()
+
+    def tearDown(self):
+        self.relay.stop()
+        self.server.stop()
+        self.bee_server.shutdown()
+
+    def test_echo(self):
+        messages = [test_pb2.Test(t1=b'small'), test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))]
+        self.assertEqual(list(client_grpc(
+            method=self.stub_method,
+            input=(m for m in messages),
+            indices_parser=test_pb2.Test,
+            partitions_message_mode_parser=True,
+            indices_serializer=test_pb2.Test
+        )), messages)
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
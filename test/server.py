@@ -0,0 +1,138 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.append('../src/')
+
+from grpcbigbuffer import test_pb2
+from grpcbigbuffer.client import client_grpc, serialize_to_buffer
+from grpcbigbuffer.server import BeeServer
+from grpcbigbuffer.utils import CHUNK_SIZE, Signal
+from helpers import LocalServer
+
+
+class TestBeeServer(unittest.TestCase):
+    def setUp(self):
+        self.bee_server = BeeServer(max_concurrent_calls=2, max_bytes_in_flight=4 * CHUNK_SIZE,
+                                    flow_control_window=2 * CHUNK_SIZE)
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+        @self.bee_server.method(indices_parser=test_pb2.Test, partitions_message_mode_parser=True,
+                                indices_serializer=test_pb2.Test)
+        def echo(messages, context):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            try:
+                return [m for m in messages]
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+        self.server = LocalServer(methods={'Echo': echo})
+        self.stub_method = self.server.stub()
+
+    def tearDown(self):
+        self.server.stop()
+        self.bee_server.shutdown()
+
+    def call(self, messages):
+        return list(client_grpc(
+            method=self.stub_method,
+            input=(m for m in messages),
+            indices_parser=test_pb2.Test,
+            partitions_message_mode_parser=True,
+            indices_serializer=test_pb2.Test
+        ))
+
+    def test_echo(self):
+        messages = [test_pb2.Test(t1=b'small'), test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))]
+        self.assertEqual(self.call(messages), messages)
+        metrics = self.bee_server.metrics()
+        self.assertEqual(metrics['active_calls'], 0)
+        self.assertEqual(metrics['queued_buffers'], 0)
+        self.assertEqual(metrics['bytes_in_flight'], 0)
+        self.assertGreater(metrics['bytes_in_flight_peak'], 0)
+
+    def test_concurrent_calls(self):
+        messages = [test_pb2.Test(t1=b''.join([b'big' for i in range(CHUNK_SIZE)]))]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.call(messages))) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [messages for i in range(6)])
+        self.assertLessEqual(self.max_running, 2)
+        self.assertLessEqual(self.bee_server.metrics()['bytes_in_flight_peak'], 4 * CHUNK_SIZE + CHUNK_SIZE)
+        self.assertEqual(self.bee_server.metrics()['active_calls'], 0)
+
+    def test_flow_control(self):
+        # Messages bigger than the window of the server, that grants credits while it receives them.
+        messages = [test_pb2.Test(t1=b''.join([b'big' for i in range(2 * CHUNK_SIZE)])) for i in range(2)]
+        credits = []
+
+        def method(request_iterator, timeout=None):
+            for buffer in self.stub_method(request_iterator, timeout=timeout):
+                if buffer.HasField('credit'):
+                    credits.append(buffer.credit)
+                yield buffer
+
+        self.assertEqual(list(client_grpc(
+            method=method,
+            input=(m for m in messages),
+            indices_parser=test_pb2.Test,
+            partitions_message_mode_parser=True,
+            indices_serializer=test_pb2.Test
+        )), messages)
+        self.assertGreater(len(credits), 1)
+        self.assertGreaterEqual(credits[0], 2 * CHUNK_SIZE)
+
+    def test_batch(self):
+        # The client says that it decodes batches, so the small messages of the response are packed.
+        messages = [test_pb2.Test(t1=b'\x00' + str(i).encode()) for i in range(1000)]
+        responses = []
+
+        def method(request_iterator, timeout=None):
+            for buffer in self.stub_method(request_iterator, timeout=timeout):
+                responses.append(buffer)
+                yield buffer
+
+        self.assertEqual(list(client_grpc(
+            method=method,
+            input=(m for m in messages),
+            indices_parser=test_pb2.Test,
+            partitions_message_mode_parser=True,
+            indices_serializer=test_pb2.Test
+        )), messages)
+        self.assertTrue(any(buffer.accepts_batch for buffer in responses))
+        self.assertTrue(all(buffer.batch for buffer in responses if buffer.HasField('chunk')))
+        self.assertLess(len(responses), 10)
+
+    def test_cancelled_call(self):
+        # The client grants a single chunk, so the response stops on acquire() until the call is cancelled.
+        messages = [test_pb2.Test(t1=b''.join([b'big' for i in range(2 * CHUNK_SIZE)]))]
+        requests = list(serialize_to_buffer(message_iterator=iter(messages), indices=test_pb2.Test))
+        requests[0].credit = CHUNK_SIZE
+        call = self.stub_method(iter(requests))
+        while not next(call).chunk:
+            pass
+        call.cancel()
+        deadline: float = time.monotonic() + 10
+        while len(self.bee_server.signals.signals) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # The signal is back on the pool only once its producer has ended, so nothing changes it anymore.
+        signal: Signal = self.bee_server.signals.signals[0]
+        time.sleep(0.2)
+        self.assertEqual((signal.sent, signal.credit, signal.cancelled), (0, None, False))
+        self.assertEqual(self.bee_server.metrics()['queued_buffers'], 0)
+        self.assertEqual(self.call(messages), messages)
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import unittest
+from hashlib import sha3_256
+
+sys.path.append('../src/')
+
+from grpcbigbuffer.instrumentation import MemoryInstrumentation
+from grpcbigbuffer.swarm import block_servicer, manifest_blocks, swarm_download
+from grpcbigbuffer.utils import CHUNK_SIZE, Enviroment, METADATA_FILE_NAME
+from helpers import LocalServer
+
+PEERS_DIR: str = os.path.abspath(os.curdir) + '/__cache__/swarm/'
+
+
+class TestSwarm(unittest.TestCase):
+    def setUp(self):
+        self.blocks = {}
+        for i in range(4):
+            content: bytes = os.urandom(2 * CHUNK_SIZE + i)
+            self.blocks[sha3_256(content).hexdigest()] = content
+        # The object: its parts and the blocks, once one of them.
+        self.object_dir: str = PEERS_DIR + 'object/'
+        os.makedirs(self.object_dir, exist_ok=True)
+        with open(self.object_dir + METADATA_FILE_NAME, 'w') as f:
+            json.dump([1] + [[block_id, [1]] for block_id in self.blocks] + [2, [list(self.blocks)[0], [1]]], f)
+        self.peers = []
+        self.served = []
+        self.release = threading.Event()
+
+    def add_peer(self, blocks: dict, stall: bool = False):
+        block_dir: str = PEERS_DIR + str(len(self.peers)) + '/'
+        os.makedirs(block_dir, exist_ok=True)
+        for block_id, content in blocks.items():
+            with open(block_dir + block_id, 'wb') as f:
+                f.write(content)
+        servicer = block_servicer(block_dir=block_dir)
+        peer: int = len(self.peers)
+
+        def method(request_iterator, context):
+            self.served.append(peer)
+            if stall:
+                self.release.wait(timeout=30)
+            yield from servicer(request_iterator, context)
+
+        self.peers.append(LocalServer(methods={'Blocks': method}, service='test.Peer', max_workers=4))
+
+    def tearDown(self):
+        self.release.set()
+        for peer in self.peers:
+            peer.stop()
+        shutil.rmtree(PEERS_DIR, ignore_errors=True)
+        for block_id in self.blocks:
+            if os.path.isfile(Enviroment.block_dir + block_id):
+                os.remove(Enviroment.block_dir + block_id)
+
+    def methods(self) -> list:
+        return [peer.stub('Blocks') for peer in self.peers]
+
+    def assert_registry(self):
+        for block_id, content in self.blocks.items():
+            with open(Enviroment.block_dir + block_id, 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_manifest(self):
+        self.assertEqual(manifest_blocks(self.object_dir), list(self.blocks))
+
+    def test_download(self):
+        for _ in range(3):
+            self.add_peer(blocks=self.blocks)
+        instrumentation = MemoryInstrumentation()
+        downloaded: list = swarm_download(methods=self.methods(), manifest=self.object_dir + METADATA_FILE_NAME,
+                                          downloads_per_peer=1, instrumentation=instrumentation)
+        self.assertEqual(sorted(downloaded), sorted(self.blocks))
+        self.assert_registry()
+        # Each block once, from several peers at once.
+        self.assertEqual(len(self.served), len(self.blocks))
+        self.assertEqual(len(set(self.served)), 3)
+        self.assertEqual(instrumentation.snapshot()['counters']['block_downloaded_bytes'],
+                         sum(len(c) for c in self.blocks.values()))
+        # The blocks on the registry are not downloaded again.
+        self.assertEqual(swarm_download(methods=self.methods(), manifest=self.object_dir), [])
+
+    def test_retry(self):
+        # A peer sends wrong content, another one stalls, and the other one doesn't have some blocks.
+        self.add_peer(blocks={block_id: b'wrong' + content for block_id, content in self.blocks.items()})
+        self.add_peer(blocks=self.blocks, stall=True)
+        self.add_peer(blocks=dict(list(self.blocks.items())[:2]))
+        self.add_peer(blocks=dict(list(self.blocks.items())[2:]))
+        instrumentation = MemoryInstrumentation()
+        downloaded: list = swarm_download(methods=self.methods(), manifest=self.object_dir, stall_timeout=0.5,
+                                          downloads_per_peer=1, instrumentation=instrumentation)
+        self.assertEqual(sorted(downloaded), sorted(self.blocks))
+        self.assert_registry()
+        counters: dict = instrumentation.snapshot()['counters']
+        self.assertGreaterEqual(counters['block_retries'], 2)
+        self.assertGreaterEqual(counters['blocks_stalled'], 1)
+
+    def test_no_peer(self):
+        self.add_peer(blocks=dict(list(self.blocks.items())[:2]))
+        with self.assertRaisesRegex(Exception, 'could not be downloaded from any peer'):
+            swarm_download(methods=self.methods(), manifest=self.object_dir)
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()
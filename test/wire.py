@@ -0,0 +1,120 @@
+import os
+import sys
+import unittest
+from io import BytesIO
+
+sys.path.append('../src/')
+
+from google.protobuf import descriptor_pb2, descriptor_pool
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message_factory import GetMessageClass
+
+from grpcbigbuffer import celaut_pb2, test_pb2
+from grpcbigbuffer.utils import CHUNK_SIZE
+from grpcbigbuffer.wire import WireSizes, field_bytes, iter_wire, iter_wire_chunks, small_byte_size, write_wire
+
+SCALAR_TYPES: list = [
+    FieldDescriptor.TYPE_INT32, FieldDescriptor.TYPE_INT64, FieldDescriptor.TYPE_UINT32, FieldDescriptor.TYPE_UINT64,
+    FieldDescriptor.TYPE_SINT32, FieldDescriptor.TYPE_SINT64, FieldDescriptor.TYPE_BOOL,
+    FieldDescriptor.TYPE_FIXED32, FieldDescriptor.TYPE_SFIXED32, FieldDescriptor.TYPE_FLOAT,
+    FieldDescriptor.TYPE_FIXED64, FieldDescriptor.TYPE_SFIXED64, FieldDescriptor.TYPE_DOUBLE,
+]
+
+
+def generate_messages() -> list:
+    field_def = celaut_pb2.FieldDef()
+    field_def.message.param[3].field.primitive.regex = 'regex' * CHUNK_SIZE
+    field_def.message.param[3].repeated = True
+    field_def.message.oneof.add(index=[1, 2, 300])
+    enum_def = celaut_pb2.FieldDef()
+    enum_def.enum.value['a'] = 1
+    enum_def.enum.value['b'] = -5
+    return [
+        test_pb2.Test(),
+        test_pb2.Test(t1=b'small', t4=[test_pb2.Test(t2=b'element')]),
+        test_pb2.Test(
+            t1=os.urandom(3 * CHUNK_SIZE + 5),
+            t3=test_pb2.Test(t2=os.urandom(CHUNK_SIZE), t4=[test_pb2.Test(t1=b'nested') for i in range(5)]),
+            t4=[test_pb2.Test(t1=str(i).encode()) for i in range(1000)] + [test_pb2.Test(t5=os.urandom(2 * CHUNK_SIZE))],
+            t5=b'last'
+        ),
+        field_def,
+        enum_def,
+    ]
+
+
+def scalars_class(syntax: str):
+    # A message with a single and a repeated field of each scalar type.
+    file = descriptor_pb2.FileDescriptorProto(name='scalars_' + syntax + '.proto', package=syntax, syntax=syntax)
+    message = file.message_type.add(name='Scalars')
+    for i, _type in enumerate(SCALAR_TYPES):
+        message.field.add(name='single' + str(i), number=i + 1, type=_type, label=FieldDescriptor.LABEL_OPTIONAL)
+        message.field.add(name='repeated' + str(i), number=i + 100, type=_type, label=FieldDescriptor.LABEL_REPEATED)
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file)
+    return GetMessageClass(pool.FindMessageTypeByName(syntax + '.Scalars'))
+
+
+class TestWire(unittest.TestCase):
+    def test_same_as_serialize_to_string(self):
+        for message in generate_messages():
+            serialized: bytes = message.SerializeToString()
+            sizes = WireSizes(message=message)
+            self.assertEqual(sizes.total, len(serialized))
+            self.assertEqual(b''.join(bytes(piece) for piece in iter_wire(message=message, sizes=sizes)), serialized)
+            f = BytesIO()
+            self.assertEqual(write_wire(message=message, f=f), len(serialized))
+            self.assertEqual(f.getvalue(), serialized)
+
+    def test_chunks(self):
+        message = generate_messages()[2]
+        chunks: list = list(iter_wire_chunks(message=message))
+        self.assertEqual(b''.join(bytes(chunk) for chunk in chunks), message.SerializeToString())
+        self.assertTrue(all(len(chunk) == CHUNK_SIZE for chunk in chunks[:-1]))
+        # The chunks of the big bytes fields are slices of them, not copies.
+        self.assertTrue(any(type(chunk) is memoryview for chunk in chunks))
+        self.assertEqual([len(c) for c in iter_wire_chunks(message=test_pb2.Test(t1=b'small'), chunk_size=4)],
+                         [4, 3])
+
+    def test_scalars(self):
+        values: dict = {
+            FieldDescriptor.TYPE_INT32: [-1, 0, 2 ** 31 - 1], FieldDescriptor.TYPE_INT64: [-2 ** 63, 300],
+            FieldDescriptor.TYPE_UINT32: [0, 2 ** 32 - 1], FieldDescriptor.TYPE_UINT64: [2 ** 64 - 1],
+            FieldDescriptor.TYPE_SINT32: [-2 ** 31, 5], FieldDescriptor.TYPE_SINT64: [-1, 2 ** 63 - 1],
+            FieldDescriptor.TYPE_BOOL: [True, False], FieldDescriptor.TYPE_FIXED32: [7],
+            FieldDescriptor.TYPE_SFIXED32: [-7], FieldDescriptor.TYPE_FLOAT: [-0.0, 1.5],
+            FieldDescriptor.TYPE_FIXED64: [2 ** 64 - 1], FieldDescriptor.TYPE_SFIXED64: [-2 ** 63],
+            FieldDescriptor.TYPE_DOUBLE: [-0.0, 0.1],
+        }
+        for syntax in ('proto3', 'proto2'):
+            cls = scalars_class(syntax=syntax)
+            messages: list = [cls()]
+            for position in (0, -1):
+                message = cls()
+                for i, _type in enumerate(SCALAR_TYPES):
+                    setattr(message, 'single' + str(i), values[_type][position])
+                    getattr(message, 'repeated' + str(i)).extend(values[_type])
+                messages.append(message)
+            for message in messages:
+                self.assertEqual(b''.join(field_bytes(message, field) for field in
+                                          sorted(message.DESCRIPTOR.fields, key=lambda f: f.number)),
+                                 message.SerializeToString())
+
+    def test_unknown_fields(self):
+        # The messages with unknown fields are serialized at once, so they are not lost.
+        message = test_pb2.Test.FromString(generate_messages()[2].SerializeToString() + b'\xf8\x07\x01')
+        message.t3.MergeFromString(b'\xf8\x07\x02')
+        serialized: bytes = message.SerializeToString()
+        self.assertEqual(WireSizes(message=message).total, len(serialized))
+        self.assertEqual(b''.join(bytes(chunk) for chunk in iter_wire_chunks(message=message)), serialized)
+
+    def test_small_byte_size(self):
+        messages: list = generate_messages()
+        self.assertEqual(small_byte_size(message=messages[1]), messages[1].ByteSize())
+        self.assertIsNone(small_byte_size(message=messages[2]))
+        self.assertIsNone(small_byte_size(message=messages[3]))
+
+
+if __name__ == '__main__':
+    os.makedirs("__cache__", exist_ok=True)
+    unittest.main()